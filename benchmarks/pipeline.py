@@ -0,0 +1,188 @@
+"""
+Offline benchmark of the CPU stages that process a model response - no model calls are made.
+Each stage is timed on synthetic responses (see benchmarks/synthetic.py) and reported as
+throughput (MB/s of response text) and peak memory allocated during the stage.
+
+    python -m benchmarks.pipeline
+    python -m benchmarks.pipeline --save baseline.json
+    python -m benchmarks.pipeline --compare baseline.json --tolerance 0.2
+
+With --compare, exits non-zero if any stage's throughput dropped by more than the tolerance.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import AsyncGenerator, Callable, Dict, List
+from rich.console import Console
+from pydantic import BaseModel
+from lib import Agent, Task, config
+from lib.models import ConsoleRenderer, Model, NullRenderer, Response, run_sync
+from configs.tasks import generate_code, generate_requirements, generate_functional_tests
+import configs.handler_config
+from benchmarks import synthetic
+
+
+# Streams a canned response in fixed-size chunks, standing in for a provider
+class ReplayModel(Model):
+
+    def __init__(self, response: str, chunk_size: int = 16):
+        super().__init__()
+        self.model_name = 'replay'
+        self.response = response
+        self.chunk_size = chunk_size
+
+    async def stream_prompt(self, prompt_text: str, use_json_schema: bool = False, system_prompt: str = None, json_schema: type[BaseModel] = None) -> AsyncGenerator[str, None]:
+        for i in range(0, len(self.response), self.chunk_size):
+            yield self.response[i:i + self.chunk_size]
+
+
+def measure(func: Callable, repeat: int) -> Dict[str, float]:
+    """Best wall time over repeat runs, then peak memory over one more (traced) run."""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {'seconds': best, 'peak_bytes': peak}
+
+
+def build_stages(task: Task, text: str, chunk_size: int) -> Dict[str, Callable]:
+    """Callables running each stage of the pipeline on one response."""
+    model = ReplayModel(text, chunk_size)
+    agent = Agent(model=model, role='benchmark', system_prompt='')
+    tags = task.get_valid_tags()
+    resp = Response(text, tags=tags)
+    agent._validate_elements(task, resp, resp.validated)
+
+    def prompt(renderer):
+        def run():
+            Model.renderer = renderer
+            run_sync(model.async_prompt('', render=True, tags=tags, use_cache=False))
+        return run
+
+    def validate():
+        agent._validate_elements(task, resp, set())
+
+    # Commands are left out of processing, as their handler really runs them (in a venv, installing packages)
+    processed = Response(resp.buffer, props={
+        tag: items for tag, items in resp.props.items() if type(config.handlers.get(tag)).__name__ != 'CommandHandler'
+    })
+    processed.validated = resp.validated
+
+    stages = {
+        'prompt (render)': prompt(ConsoleRenderer),
+        'prompt (headless)': prompt(NullRenderer),
+        'extract_tagged_content': lambda: Response._extract_tagged_content(text, tags),
+        'validate_elements': validate,
+        'process_elements': lambda: agent._process_elements(task, processed)
+    }
+
+    # Handler writes on their own, for each element type the response contains
+    for tag, items in resp.props.items():
+        handler = config.handlers.get(tag)
+        if handler and type(handler).__name__ in ('DataHandler', 'FileHandler'):
+            stages[f'{type(handler).__name__} ({tag})'] = lambda handler=handler, items=items, tag=tag: \
+                handler.process(items, validated=tag in resp.validated)
+    return stages
+
+
+def run_benchmarks(args) -> List[dict]:
+    responses = [
+        ('code', generate_code, synthetic.code_response(
+            seed=args.seed, files=args.files, min_file_bytes=args.min_file_kb * 1024, max_file_bytes=args.max_file_kb * 1024
+        )),
+        ('requirements', generate_requirements, synthetic.requirements_response(seed=args.seed, count=args.items)),
+        ('tests', generate_functional_tests, synthetic.tests_response(seed=args.seed, count=args.items))
+    ]
+
+    # Keep console output and handler writes out of the way (and off the real project)
+    Model.console = Console(file=io.StringIO(), width=120)
+    Model.cache = None
+    results = []
+    with tempfile.TemporaryDirectory() as project_root:
+        config.project_root = project_root
+        os.makedirs(os.path.join(project_root, config.src_dir), exist_ok=True)
+        for name, task, text in responses:
+            size = len(text.encode('utf-8'))
+            for stage, func in build_stages(task, text, args.chunk_size).items():
+                if args.stage and not any(s in stage for s in args.stage):
+                    continue
+                with contextlib.redirect_stdout(io.StringIO()):
+                    stats = measure(func, args.repeat)
+                results.append({
+                    'response': name,
+                    'stage': stage,
+                    'bytes': size,
+                    'seconds': stats['seconds'],
+                    'mb_per_s': size / 1e6 / stats['seconds'] if stats['seconds'] else float('inf'),
+                    'peak_mb': stats['peak_bytes'] / 1e6
+                })
+                print_result(results[-1])
+                Model.console.file.seek(0)
+                Model.console.file.truncate()
+    return results
+
+
+def print_result(result: dict, baseline: dict = None):
+    line = f"{result['response']:<14}{result['stage']:<34}{result['bytes'] / 1e6:>9.2f}{result['seconds'] * 1000:>11.1f}" \
+           + f"{result['mb_per_s']:>11.1f}{result['peak_mb']:>10.1f}"
+    if baseline:
+        line += f"{result['mb_per_s'] / baseline['mb_per_s'] - 1:>+10.1%}"
+    print(line)
+
+
+def compare(results: List[dict], baseline_path: str, tolerance: float) -> int:
+    with open(baseline_path, 'r', encoding='utf-8') as f:
+        baseline = {(r['response'], r['stage']): r for r in json.load(f)}
+    print(f"\nCompared to {baseline_path}:")
+    regressions = []
+    for result in results:
+        base = baseline.get((result['response'], result['stage']))
+        if not base:
+            continue
+        print_result(result, base)
+        if result['mb_per_s'] < base['mb_per_s'] * (1 - tolerance):
+            regressions.append(result)
+    for result in regressions:
+        print(f"REGRESSION: {result['response']} / {result['stage']}")
+    return 1 if regressions else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the response-processing pipeline on synthetic model output")
+    parser.add_argument('--files', type=int, default=24, help="<file> elements in the code response")
+    parser.add_argument('--min-file-kb', type=int, default=10)
+    parser.add_argument('--max-file-kb', type=int, default=1024)
+    parser.add_argument('--items', type=int, default=300, help="<req>/<test> items in the data responses")
+    parser.add_argument('--chunk-size', type=int, default=16, help="Characters per streamed chunk")
+    parser.add_argument('--repeat', type=int, default=3, help="Timed runs per stage (best is reported)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--stage', action='append', help="Only run stages whose name contains this (repeatable)")
+    parser.add_argument('--save', help="Write results to this JSON file")
+    parser.add_argument('--compare', help="Compare against results previously written with --save")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="Allowed throughput drop for --compare")
+    args = parser.parse_args()
+
+    print(f"{'response':<14}{'stage':<34}{'MB':>9}{'ms':>11}{'MB/s':>11}{'peak MB':>10}")
+    results = run_benchmarks(args)
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=4)
+    if args.compare:
+        sys.exit(compare(results, args.compare, args.tolerance))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""
+Compares the XML tag path with schema-constrained structured output (JSON) on a live
+vLLM or Ollama server: how often responses fail validation (and so cause a retry in
+Agent.perform_task), and how many tokens a task costs including those retries.
+
+    python -m benchmarks.structured_output --provider vllm --host http://localhost:8000/v1 \
+        --model Qwen/Qwen2.5-Coder-32B-Instruct --runs 10
+"""
+import argparse
+import time
+from pathlib import Path
+from lib import Agent, Task, config, usage_tracker
+from lib.models import Model, NullRenderer, Ollama, VLLM, run_sync
+from lib.retry import FORMAT_ERRORS
+from configs.agents import product_owner
+from configs.tasks import generate_requirements, generate_functional_tests
+import configs.handler_config
+
+MODES = {'xml': False, 'structured': True}
+
+
+async def run_task(agent: Agent, task: Task, inputs: dict, max_attempts: int) -> dict:
+    """Attempt a task until it validates (or max_attempts), without processing its elements."""
+    system_prompt = agent.get_system_prompt(task)
+    prompt_text = task.get_prompt(**inputs)
+    result = {'attempts': 0, 'format_failures': 0, 'response': None}
+    for _ in range(max_attempts):
+        result['attempts'] += 1
+        try:
+            result['response'] = await agent._attempt(task, prompt_text, system_prompt, render=False, use_cache=False)
+            break
+        except FORMAT_ERRORS:
+            result['format_failures'] += 1
+    return result
+
+
+def benchmark_mode(agent: Agent, jobs: list, mode: str, runs: int, max_attempts: int) -> dict:
+    stats = {'tasks': 0, 'completed': 0, 'attempts': 0, 'format_failures': 0, 'seconds': 0.0}
+    with usage_tracker.scope('benchmark', mode):
+        for task, inputs in jobs:
+            task.structured_output = MODES[mode]
+            for _ in range(runs):
+                start = time.monotonic()
+                result = run_sync(run_task(agent, task, inputs, max_attempts))
+                stats['seconds'] += time.monotonic() - start
+                stats['tasks'] += 1
+                stats['completed'] += result['response'] is not None
+                stats['attempts'] += result['attempts']
+                stats['format_failures'] += result['format_failures']
+    usage = usage_tracker.summary()[('benchmark', mode)]
+    stats['retry_rate'] = (stats['attempts'] - stats['tasks']) / stats['tasks']
+    stats['failure_rate'] = stats['format_failures'] / stats['attempts']
+    stats['tokens_per_task'] = usage.total_tokens / stats['tasks']
+    stats['completion_tokens_per_task'] = usage.completion_tokens / stats['tasks']
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark XML vs structured output against a live model server")
+    parser.add_argument('--provider', choices=['vllm', 'ollama'], default='vllm')
+    parser.add_argument('--host', required=True)
+    parser.add_argument('--model', required=True)
+    parser.add_argument('--specs', default='user_specs_example.txt', help="User specs used as the task input")
+    parser.add_argument('--runs', type=int, default=10, help="Runs of each task per mode")
+    parser.add_argument('--max-attempts', type=int, default=3)
+    args = parser.parse_args()
+
+    Model.renderer = NullRenderer
+    model = VLLM(args.model, host=args.host) if args.provider == 'vllm' else Ollama(args.model, host=args.host)
+    if not model.structured_output:
+        raise SystemExit(f"{args.provider} does not support structured output")
+    agent = Agent(model=model, role=product_owner.role, system_prompt=product_owner.system_prompt)
+
+    # Requirements from one run are the input for the functional tests task
+    specs = Path(args.specs).read_text(encoding='utf-8')
+    generate_requirements.structured_output = True
+    seed = run_sync(run_task(agent, generate_requirements, {'specs': specs}, args.max_attempts))['response']
+    if seed is None:
+        raise SystemExit("Unable to generate requirements to seed the benchmark")
+    jobs = [
+        (generate_requirements, {'specs': specs}),
+        (generate_functional_tests, {'requirements': seed.props['req']})
+    ]
+
+    print(f"{'mode':<12}{'tasks':>7}{'completed':>11}{'retry rate':>12}{'fail rate':>11}{'tokens/task':>13}{'compl/task':>12}{'s/task':>9}")
+    for mode in MODES:
+        s = benchmark_mode(agent, jobs, mode, args.runs, args.max_attempts)
+        print(f"{mode:<12}{s['tasks']:>7}{s['completed']:>11}{s['retry_rate']:>12.1%}{s['failure_rate']:>11.1%}" \
+              + f"{s['tokens_per_task']:>13.0f}{s['completion_tokens_per_task']:>12.0f}{s['seconds'] / s['tasks']:>9.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""
+Synthetic model responses shaped like the ones the pipeline handles: code generation
+responses with dozens of large <file> elements, and data responses with hundreds of
+<req>/<test> items (with nested <test_data>). Output is deterministic for a given seed.
+"""
+import math
+import random
+from typing import List
+
+# Lines of plausible source code - including characters that look like tags, and
+# HTML, since generated file content regularly contains both
+CODE_LINES = [
+    "def process_item(item, options=None):",
+    "    if item.count < options.limit and item.size > 0:",
+    "        return {'id': item.id, 'value': item.value * 2}",
+    "    for i in range(len(items)):",
+    "        logger.debug(f\"Processing item {i} of {len(items)}\")",
+    "    html = \"<div class='row'><span>{}</span></div>\".format(name)",
+    "    # TODO: handle the case where a < b and b > c",
+    "class Handler(BaseHandler):",
+    "    \"\"\"Handles incoming <request> payloads.\"\"\"",
+    "    raise ValueError(\"Invalid value: <none>\")",
+    "",
+    "    x = [a for a in values if a is not None]",
+    "    return \"\".join(parts)",
+]
+
+WORDS = (
+    "the user must be able to create edit delete and view records in the system which should validate "
+    "all input and report errors clearly while storing data securely and allowing export to csv or json "
+    "files with search filtering sorting pagination and role based access control for administrators"
+).split()
+
+
+def _sentence(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize() + "."
+
+
+def _file_content(rng: random.Random, size: int) -> str:
+    lines = []
+    total = 0
+    while total < size:
+        line = rng.choice(CODE_LINES)
+        lines.append(line)
+        total += len(line) + 1
+    return "\n".join(lines)
+
+
+def file_sizes(rng: random.Random, count: int, min_bytes: int, max_bytes: int) -> List[int]:
+    """File sizes spread log-uniformly between min_bytes and max_bytes."""
+    low, high = math.log(min_bytes), math.log(max_bytes)
+    return [int(math.exp(rng.uniform(low, high))) for _ in range(count)]
+
+
+def code_response(
+        seed: int = 0,
+        files: int = 24,
+        min_file_bytes: int = 10 * 1024,
+        max_file_bytes: int = 1024 * 1024,
+        commands: int = 5
+) -> str:
+    rng = random.Random(seed)
+    parts = ["Below are the files and commands required to implement the specifications.\n"]
+    for i, size in enumerate(file_sizes(rng, files, min_file_bytes, max_file_bytes)):
+        parts.append(
+            f"<file>\n<file_name>module_{i}.py</file_name>\n"
+            f"<file_content>\n```python\n{_file_content(rng, size)}\n```\n</file_content>\n</file>\n"
+        )
+    for i in range(commands):
+        parts.append(f"<cmd>\n<command>pip install package-{i}</command>\n</cmd>\n")
+    parts.append("Let me know if you need anything else.")
+    return "".join(parts)
+
+
+def requirements_response(seed: int = 0, count: int = 300) -> str:
+    rng = random.Random(seed)
+    parts = ["Here are the functional requirements:\n"]
+    for i in range(1, count + 1):
+        parts.append(
+            f"<req>\n<req_id>{i}</req_id>\n<req_details>{_sentence(rng, rng.randint(10, 40))}</req_details>\n</req>\n"
+        )
+    return "".join(parts)
+
+
+def tests_response(seed: int = 0, count: int = 300) -> str:
+    rng = random.Random(seed)
+    parts = ["Here is the functional test plan:\n"]
+    for i in range(1, count + 1):
+        test_data = "".join(
+            f"<test_data><file_name>data_{i}_{j}.csv</file_name>"
+            f"<file_description>{_sentence(rng, 12)}</file_description></test_data>\n"
+            for j in range(rng.randint(0, 1))
+        )
+        parts.append(
+            f"<test>\n<test_id>{i}</test_id>\n<req_id>{rng.randint(1, count)}</req_id>\n"
+            f"<test_title>{_sentence(rng, 6)}</test_title>\n<test_details>{_sentence(rng, 40)}</test_details>\n"
+            f"{test_data}<exp_result>{_sentence(rng, 15)}</exp_result>\n</test>\n"
+        )
+    return "".join(parts)
@@ -1,6 +1,14 @@
 from textwrap import dedent
 from lib import Agent
-from lib.models import VLLM
+from lib.models import VLLM, ModelPool
+
+### DEFINE MODEL ENDPOINTS ###
+
+# Equivalent OpenAI-compatible/Ollama endpoints serving the same model - add hosts here to
+# spread load across them. Each agent binds to the pool so it sticks to one warm endpoint.
+coder_pool = ModelPool([
+    VLLM('Qwen/Qwen2.5-Coder-32B-Instruct', host='http://10.243.170.187:11434/v1'),
+])
 
 ### DEFINE AGENTS ###
 
@@ -23,7 +31,7 @@ product_owner = Agent(
         task as closely as possible - while keeping the above role in mind.
         """
     ), 
-    model=VLLM('Qwen/Qwen2.5-Coder-32B-Instruct', host='http://10.243.170.187:11434/v1')
+    model=coder_pool.bind('product_owner')
 )
 
 # 2. Lead Developer
@@ -44,5 +52,5 @@ developer = Agent(
         task as closely as possible - while keeping the above role in mind.
         """
     ), 
-    model=VLLM('Qwen/Qwen2.5-Coder-32B-Instruct', host='http://10.243.170.187:11434/v1')
+    model=coder_pool.bind('developer')
 )
\ No newline at end of file
@@ -6,23 +6,30 @@ from configs.handlers import *
 config.handlers = {
     'req': DataHandler(
         title="requirements",
-        file_name="requirements.json",
+        file_name="requirements.jsonl",
+        key="req_id",
+        table="requirements",
         element=Requirement
     ),
     'code_segment': DataHandler(
         title="code_segments",
-        file_name="code_segments.json",
+        file_name="code_segments.jsonl",
         dir="llm_data",
+        table="code_segments",
         element=CodeSegment
     ),
     'test': DataHandler(
         title="tests",
-        file_name="test_plan.json",
+        file_name="test_plan.jsonl",
+        key="test_id",
+        table="tests",
         element=FunctionalityTest
     ),
     'imp': DataHandler(
         title="implementation",
-        file_name="implementation.json",
+        file_name="implementation.jsonl",
+        key="req_id",
+        table="implementations",
         element=Implementation
     ),
     'file': FileHandler(
@@ -1,10 +1,19 @@
 import json
-from typing import Dict, Any, Optional, List
-from lib import Handler, Shell
+from typing import Dict, Any, Optional, List, Tuple, Union
+from lib import Handler, Shell, RecordStore
+from lib import CommandExecutor, VenvCache
+from lib.files import atomic_write
+from lib.state import StateTable
+from lib.task import TaskValidationError
 from lib import config
+from lib.models import ElementDict
 from pydantic import ValidationError
 import sys
 import os
+import hashlib
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import logging
 logger = logging.getLogger(__name__)
 logger.propagate = True
@@ -17,6 +26,8 @@ class DataHandler(Handler):
             title: str,
             file_name: str,
             dir: str = None,
+            key: str = None,
+            table: str = None,
             *args,
             **kwargs
     ):
@@ -24,65 +35,140 @@ class DataHandler(Handler):
         self.title = title
         self.file_name = file_name
         self.dir = dir
+
+        # Field (by alias) that identifies an item - items are upserted by it. Without one,
+        # each batch of items replaces the previous one
+        self.key = key
+
+        # Table in the project state store (see lib/state.py) when config.state_backend is 'sqlite'
+        self.table = table or title
+        self._store: RecordStore = None
         logger.debug(f"DataHandler initialized with title: {self.title}, file_name: {self.file_name}")
 
-    # Write element items to file using handler
-    def process(self, items):
+    @property
+    def file_path(self) -> str:
+        if self.dir:
+            return f"{config.project_root}/{self.dir}/{self.file_name}"
+        return f"{config.project_root}/{self.file_name}"
+
+    # Store for the current project (which may change after the handler is created)
+    @property
+    def store(self) -> Union[StateTable, RecordStore]:
+        if config.state_backend == 'sqlite':
+            return config.get_state().table(self.table)
+        if self._store is None or self._store.path != self.file_path:
+            self._store = RecordStore(self.file_path, key=self.key)
+        return self._store
+
+    # Write element items to the store
+    def process(self, items, validated=False):
         try:
-            # Validate all items first
-            for item in items:
-                self.element.model_validate(item)
+            # Validate all items first, unless the Agent already has
+            if not validated:
+                self.validate(items)
 
             logger.info(f"Processing data with DataHandler: {self.title}")
-            if self.dir:
-                file_path = f"{config.project_root}/{self.dir}/{self.file_name}"
-            else:
-                file_path = f"{config.project_root}/{self.file_name}"
-            data = {self.title: items}
-            with open(file_path, 'w', encoding="utf-8") as f:
-                output = json.dumps(data, indent=4)
-                f.write(output)
-            logger.info(f"Data written to file: {file_path}")
+            try:
+                if self.key:
+                    self.store.upsert(items)
+                else:
+                    self.store.replace(items)
+
+            # E.g. a test for a requirement that doesn't exist - the model got it wrong, so retry the task
+            except sqlite3.IntegrityError as e:
+                raise TaskValidationError(f"Validation Error: {self.title} are inconsistent with the project: {e}") from e
+            logger.info(f"Data written to store: {self.table}")
             return {self.title: items}
         except ValidationError as e:
             logger.error(f"Error processing data with DataHandler: {e}")
             raise
 
+    # All stored items, as returned by process - lazily queried with the sqlite backend
+    def load(self) -> dict:
+        return {self.title: self.store.rows()}
+
+    def has_data(self) -> bool:
+        return len(self.store) > 0
+
 
 # File (tool) element handler
 class FileHandler(Handler):
 
     def __init__(
             self,
+            max_workers: int = 4,
             *args,
             **kwargs
     ):
         super().__init__(*args, **kwargs)
+        self.max_workers = max_workers
         logger.debug(f"FileHandler initialized")
 
-    def process(self, items):
+    # Write files whose content changed, in parallel. Unchanged files are left alone (keeping
+    # their mtimes), and the names of changed files are returned as changed_files
+    def process(self, items, validated=False):
         logger.info(f"Processing files with FileHandler")
         try:
-            # Validate all items first
-            for item in items:
-                self.element.model_validate(item)
+            # Validate all items first, unless the Agent already has
+            if not validated:
+                self.validate(items)
 
             logger.debug(f"Validated file elements")
-            return_val = {
-                'files': items
+            changed_files = []
+            written = []
+            if items:
+                with ThreadPoolExecutor(max_workers=min(self.max_workers, len(items))) as pool:
+                    for item, (changed, sha256, size) in zip(items, pool.map(self.write_file, items)):
+                        if changed:
+                            changed_files.append(item['file_name'])
+                        written.append((item['file_name'], sha256, size))
+            if config.state_backend == 'sqlite':
+                config.get_state().record_files(written)
+            logger.info(f"Files changed: {len(changed_files)} of {len(items)}")
+            return {
+                'files': items,
+                'changed_files': changed_files
             }
-            for item in items:
-                file_name = item['file_name']
-                file_content = item['file_content']
-                print(config.project_root, config.project_name)
-                with open(f"{config.project_root}/{config.src_dir}/{file_name}", "w") as fout:
-                    fout.write(file_content)
-                logger.info(f"File written: {file_name}")
-            return return_val
         except Exception as e:
             logger.error(f"Error processing files with FileHandler: {e}")
             raise
 
+    # Write a file atomically, unless it already has this content. Returns whether it was written,
+    # and the content's SHA-256 and size
+    def write_file(self, item) -> Tuple[bool, str, int]:
+        file_name = item['file_name']
+        file_path = os.path.join(config.project_root, config.src_dir, file_name)
+
+        # Parsed content is hashed and written straight from the response buffer, rather than copied out first
+        span = item.span('file_content') if isinstance(item, ElementDict) else None
+        pieces = span.views() if span is not None else [item['file_content'].encode('utf-8')]
+        incoming = hashlib.sha256()
+        for piece in pieces:
+            incoming.update(piece)
+        size = sum(len(piece) for piece in pieces)
+        if self.file_digest(file_path, size) == incoming.digest():
+            logger.debug(f"File unchanged: {file_name}")
+            return False, incoming.hexdigest(), size
+
+        # Written to a temp file and renamed into place, so that a crash never leaves a partial file
+        atomic_write(file_path, pieces)
+        logger.info(f"File written: {file_name}")
+        return True, incoming.hexdigest(), size
+
+    # SHA-256 of a file - or None if it doesn't exist, or isn't the given size (so can't match anyway)
+    @staticmethod
+    def file_digest(file_path: str, size: int) -> Union[None, bytes]:
+        try:
+            if os.path.getsize(file_path) != size:
+                return None
+            digest = hashlib.sha256()
+            with open(file_path, 'rb') as f:
+                for block in iter(lambda: f.read(1024 * 1024), b''):
+                    digest.update(block)
+            return digest.digest()
+        except FileNotFoundError:
+            return None
+
 
 # Command (tool) element handler
 class CommandHandler(Handler):
@@ -90,6 +176,9 @@ class CommandHandler(Handler):
     # Only hold a single terminal open for the entire execution
     venv: Shell = None
 
+    # Tasks run their handlers in worker threads (see Agent), so the shell is created under a lock
+    _shell_lock = threading.Lock()
+
     def __init__(
             self,
             *args,
@@ -99,11 +188,16 @@ class CommandHandler(Handler):
         logger.debug(f"CommandHandler initialized")
 
     def init_shell(self):
-        if not CommandHandler.venv:
+        with CommandHandler._shell_lock:
+            if CommandHandler.venv:
+                return
             logger.info("Initializing shell for CommandHandler")
             CommandHandler.venv = Shell(
                 venv_path=f"{config.project_root}/{config.src_dir}/", 
-                python=config.python_version
+                python=config.python_version,
+                venv_cache=VenvCache(config.venv_cache_dir, config.venv_cache_max_templates),
+                max_output_bytes=config.command_output_max_bytes,
+                log_dir=config.command_log_dir
             )
             logger.debug(f"Shell initialized with venv_path: {config.project_root}/{config.src_dir}/, python: {config.python_version}")
 
@@ -121,27 +215,32 @@ class CommandHandler(Handler):
         logger.debug(f"Command does not need cleaning: {cmd}")
         return cmd
 
-    def process(self, items):
-
-        #TODO: PUT THIS BACK!
-        return_val = {
-            'commands': items
-        }
-        return return_val
-        '''
+    # Run the commands in the project's venv - independent ones in parallel (see CommandExecutor) - and
+    # add each one's output, exit code and run time to its item
+    def process(self, items, validated=False):
         logger.info(f"Processing commands with CommandHandler")
         try:
             self.init_shell()
-            # Validate all items first
-            for item in items:
-                self.element.model_validate(item)
+            # Validate all items first, unless the Agent already has
+            if not validated:
+                self.validate(items)
             logger.debug(f"Validated console command elements")
-            for item in items:
-                logger.debug(f"Running command: {item['command']}")
-                item['output'] = CommandHandler.venv.run_shell_command(
-                    self.clean_command(item['command'])
-                )
-                logger.debug(f"Command output: {item['output']}")
+            executor = CommandExecutor(
+                cwd=CommandHandler.venv.proj_src,
+                venv_path=CommandHandler.venv.venv_path,
+                max_workers=config.command_workers,
+                max_output_bytes=config.command_output_max_bytes,
+                log_dir=config.command_log_dir
+            )
+            results = executor.run([self.clean_command(item['command']) for item in items])
+            for item, result in zip(items, results):
+                item['kind'] = result.kind
+                item['output'] = result.output
+                item['exit_code'] = result.exit_code
+                item['seconds'] = round(result.seconds, 3)
+                if result.log_path:
+                    item['log_path'] = result.log_path
+                logger.debug(f"Command ({result.kind}) finished in {result.seconds:.1f}s with exit code {result.exit_code}: {item['command']}")
             return_val = {
                 'commands': items
             }
@@ -149,4 +248,3 @@ class CommandHandler(Handler):
         except Exception as e:
             logger.error(f"Error processing commands with CommandHandler: {e}")
             raise
-        '''
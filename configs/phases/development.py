@@ -2,7 +2,7 @@ from math import floor
 import os
 import sys
 import re
-from lib import Phase
+from lib import Phase, Budget, usage_tracker
 from configs.handler_config import config
 from configs.agents import *
 from configs.tasks import *
@@ -32,8 +32,9 @@ def run_development_phase(**data):
         results = fetch_relevant_code(data, "The script must accept a name command line argument to greet the user", 1)
         print(results)
 
-        # Validation loop
+        # Validation loop - bounded by the phase budget in case it never converges
         while True:
+            usage_tracker.check_budgets()
             
             # Validate requirements
             data = validate_items(
@@ -91,12 +92,11 @@ def validate_development_phase():
     
     # List required files
     src_folder = os.path.join(config.project_root, config.src_dir)
-    imp_file = os.path.join(config.project_root, 'implementation.json')
     
-    # Check for existance of files
+    # Check for existance of source files and stored implementation results
     tests = [
         len(os.listdir(src_folder)) > 0,
-        os.path.exists(imp_file)
+        config.handlers['imp'].has_data()
     ]
 
     # Only return True if all file checks pass
@@ -106,11 +106,8 @@ def validate_development_phase():
 # Load data from previously completed phase
 def load_development_data(data):
     
-    with open(f"{config.project_root}/requirements.json", 'r') as f:
-        data = json.loads(f.read())
-    
-    with open(f"{config.project_root}/test_plan.json", 'r') as f:
-        data = json.loads(f.read()) | data
+    data = config.handlers['req'].load()
+    data = config.handlers['test'].load() | data
 
     return data
 
@@ -125,5 +122,10 @@ development_phase = Phase(
     """),
     phase_func=run_development_phase,
     validation_func=validate_development_phase,
-    load_func=lambda data: None
+    load_func=lambda data: None,
+    budget=Budget(
+        max_tokens=2_000_000,
+        max_cost=25.0,
+        max_time=4 * 60 * 60
+    )
 )
@@ -29,14 +29,10 @@ def run_planning_phase(**data):
 # Define planning phase validation method
 def validate_planning_phase():
     
-    # List required file paths
-    requirements_path = os.path.join(config.project_root, 'requirements.json')
-    tests_path = os.path.join(config.project_root, 'test_plan.json')
-
-    # Check for existance of files
+    # Check for stored requirements and tests
     tests = [
-        os.path.exists(requirements_path),
-        os.path.exists(tests_path)
+        config.handlers['req'].has_data(),
+        config.handlers['test'].has_data()
     ]
 
     # Only return True if all file checks pass
@@ -46,11 +42,8 @@ def validate_planning_phase():
 # Load data from previously completed phase
 def load_planning_data(data):
     
-    with open(f"{config.project_root}/requirements.json", 'r') as f:
-        data = json.loads(f.read())
-    
-    with open(f"{config.project_root}/test_plan.json", 'r') as f:
-        data = json.loads(f.read()) | data
+    data = config.handlers['req'].load()
+    data = config.handlers['test'].load() | data
 
     return data
 
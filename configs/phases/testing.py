@@ -1,21 +1,30 @@
 import os
-from lib import Phase
+from lib import Phase, SandboxManager
 from configs.handler_config import config
 from configs.agents import *
 from configs.tasks import *
 
-# Runs a command directly using the command handler
-def run_tests():
-    data = config.handlers['cmd'].process(
-        [
-            {
-                'command': f"{config.python_version} -m unittest test.py",
-            }
-        ]
+# Sandboxes of the project's src tree, sharing its venv
+def get_sandbox_manager():
+    config.handlers['cmd'].init_shell()
+    return SandboxManager(
+        source=os.path.join(config.project_root, config.src_dir),
+        venv_path=config.handlers['cmd'].venv.venv_path,
+        max_sandboxes=config.max_sandboxes,
+        max_output_bytes=config.command_output_max_bytes,
+        log_dir=config.command_log_dir
     )
 
-    # Return output of the single command run
-    return data['commands'][0]['output']
+# Runs the test suite against each set of candidate fixes (file name -> content) concurrently, each
+# in its own sandbox of the src tree - returns the output of each run
+def run_tests_with_fixes(candidates):
+    command = f"{config.python_version} -m unittest test.py"
+    results = get_sandbox_manager().run_many([(files, [command]) for files in candidates])
+    return [job_results[0].output for job_results in results]
+
+# Runs the test suite against the src tree as it is
+def run_tests():
+    return run_tests_with_fixes([None])[0]
 
 # Define test phase 
 def run_test_phase(**data):
@@ -3,6 +3,7 @@ import os
 import re
 import google.generativeai as genai
 import numpy as np
+from lib.models import json_default
 from .tasks import *
 from .agents import *
 import logging
@@ -40,7 +41,7 @@ def fetch_relevant_code(data, query, num_results=5):
     """Fetch relevant code segments based on semantic similarity to query.
     
     Args:
-        data: Dictionary containing 'code_segment' list
+        data: Dictionary containing 'code_segments' list (only used without the sqlite state backend)
         query: String to compare against code segments
         num_results: Number of top results to return
         
@@ -55,19 +56,31 @@ def fetch_relevant_code(data, query, num_results=5):
         # Get query embedding with validation
         query_embedding = get_valid_embedding(model, query, "retrieval_query")
         
+        # Segment embeddings are kept in the project state store, so each is only requested once
+        if config.state_backend == 'sqlite':
+            state = config.get_state()
+            segments = state.code_segments()
+        else:
+            state = None
+            segments = [(None, item, item.get('vector')) for item in data['code_segments']]
+
         # Process each code segment
         similarities = []
-        for item in data['code_segments']:
+        for segment_id, item, vector in segments:
             # Get or create embedding for segment
-            if 'vector' not in item or not item['vector']:
-                item['vector'] = get_valid_embedding(
+            if not vector:
+                vector = get_valid_embedding(
                     model,
                     item['segment_description'],
                     "retrieval_document"
                 )
+                if state:
+                    state.set_embedding(segment_id, vector)
+                else:
+                    item['vector'] = vector
             
             # Calculate cosine similarity
-            vector = np.array(item['vector'])
+            vector = np.array(vector)
             query_vec = np.array(query_embedding)
             cosine_sim = np.dot(vector, query_vec) / (np.linalg.norm(vector) * np.linalg.norm(query_vec))
             similarities.append((cosine_sim, item))
@@ -113,7 +126,8 @@ def validate_items(
                     input_label: data_slice,
                     validation_target: json.dumps(
                         {validation_target: data[validation_target]}, 
-                        indent=4
+                        indent=4,
+                        default=json_default
                     )
                 }
             )[output_label]
@@ -132,7 +146,8 @@ def validate_items(
             input_label: data_slice,
             validation_target: json.dumps(
                 {validation_target: data[validation_target]}, 
-                indent=4
+                indent=4,
+                default=json_default
             )
         }
     )[output_label]
@@ -194,7 +209,7 @@ def index_code(code_gen_data, max_attempts = 3):
         data = developer.perform_task(
             index_code_semantically,
             inputs={
-                'source_files': json.dumps(files, indent=4)
+                'source_files': json.dumps(files, indent=4, default=json_default)
             }
         )
 
@@ -7,6 +7,7 @@ from lib import Task
 
 # Define user specification cleanup task
 generate_specs = Task(
+    name="generate_specs",
     details=dedent("""
         Take the below rough specifications, clean them up, and write them as you would write professional specifications 
         to be handed to a software developer. Take your time, and be as detailed as possible. 
@@ -20,6 +21,7 @@ generate_specs = Task(
 
 # Define high-level requirements generation task
 generate_requirements = Task(
+    name="generate_requirements",
     details=dedent("""
         Take the below technical specifications, and write a numbered list of clear, concise functional requirements that
         must be met by the software. Each requirement should map directly to a function or feature of the software. Requirements
@@ -35,6 +37,7 @@ generate_requirements = Task(
 
 # Define functional test case generation task
 generate_functional_tests = Task(
+    name="generate_functional_tests",
     details=dedent("""
         Take the below technical requirements, and write a detailed, numbered list of test cases that cover all of the different
         types of user interaction that may occur - ensuring that the outcome in each case conforms to the technical requirements.
@@ -53,6 +56,7 @@ generate_functional_tests = Task(
 
 # Define code generation task
 generate_code = Task(
+    name="generate_code",
     details=dedent(f"""
         Take the below technical specifications, and write Python code that satisfies all of them - ensuring that the code 
         follows best practises, and is well documented. Assume you are already in the root source code directory, so any 
@@ -79,6 +83,7 @@ generate_code = Task(
 
 # Define code generation task
 generate_documentation = Task(
+    name="generate_documentation",
     details=dedent(f"""
         Ensure that doxy
                    
@@ -91,6 +96,7 @@ generate_documentation = Task(
 
 # Define task that validates written code against requirements to assess completion
 validate_code = Task(
+    name="validate_code",
     details=dedent("""
         Provided the below technical requirements, your task is to ensure that the requirements are properly addressed
         and implemented in one or more of the segments of code that have been included. 
@@ -108,6 +114,7 @@ validate_code = Task(
 
 # Define task that adds requirements that were previously missed when writing code in the development phase
 add_missing_requirements = Task(
+    name="add_missing_requirements",
     details=dedent("""
         Provided the below list of missed requirements, your task is to ensure that these requirements are fully and properly
         implemented in the code below; you will need to add or fix the code below as necessary to meet these missing or failed
@@ -132,6 +139,7 @@ add_missing_requirements = Task(
 
 # Define functional test code generation task
 generate_tests = Task(
+    name="generate_tests",
     details=dedent(f"""Create a file called test.py (assume you are already in the corrent directory) which leverages the pytest framework
         for running tests to ensure that all the FUNCTIONAL requirements are working are met, and the code is working as 
         expected. Adhere to the points below:
@@ -173,6 +181,7 @@ generate_tests = Task(
 
 # Define task for determining result of running test.py
 analyze_test_run = Task(
+    name="analyze_test_run",
     details=dedent("""
         The script \"test.py\" has been run, and it's output is included below. Analyze the output to determine if the test.py file 
         ran successfully, or if an error was encountered while running the file. Note that failing tests (or errors produced by running 
@@ -189,6 +198,7 @@ analyze_test_run = Task(
 
 # Define task for analyzing test errors and producing a fixed test.py file
 analyze_test_error = Task(
+    name="analyze_test_error",
     details=dedent("""
         The script test.py failed with the below error message. Analyze the error and produce a fixed test.py file.
                    
@@ -201,6 +211,7 @@ analyze_test_error = Task(
 
 # Define task for examining successful test output and updating source code if necessary
 examine_test_output = Task(
+    name="examine_test_output",
     details=dedent("""
         The script test.py ran successfully. Examine the output below, and respond with each test ID, a status of "pass" or "fail" 
         for each test, and - if the test failed - the necessary commands or code revisions required to fix the code so that the 
@@ -218,6 +229,7 @@ examine_test_output = Task(
 
 # Define task for breaking down code into segments with detailed descriptions
 index_code_semantically = Task(
+    name="index_code_semantically",
     details=dedent("""
         Take the provided source code files and break them down into semantically similar segments. Each segment should consist of:
         
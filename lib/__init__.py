@@ -2,10 +2,17 @@ from .agent import Agent
 from .element import Element, ToolElem, DataElem, ManyOptional
 from .handler import Handler
 from .task import Task
+from .venv_cache import VenvCache
 from .shell import Shell
 from .phase import Phase
 from .versioning import Repo
 from .config import config
 from .environment import Env
+from .usage import Budget, BudgetExceededError, Usage, usage_tracker
+from .retry import RetryPolicy, CircuitBreaker, CircuitOpenError
+from .store import RecordStore
+from .state import ProjectState
+from .executor import CommandExecutor, CommandResult
+from .sandbox import Sandbox, SandboxManager
 
-__all__ = ['Agent', 'Element', 'ManyOptional', 'ToolElem', 'DataElem', 'Handler', 'Task', 'models', 'Shell', 'Phase', 'Repo', 'Env', 'config']
+__all__ = ['Agent', 'Element', 'ManyOptional', 'ToolElem', 'DataElem', 'Handler', 'Task', 'models', 'Shell', 'VenvCache', 'Phase', 'Repo', 'Env', 'config', 'Budget', 'BudgetExceededError', 'Usage', 'usage_tracker', 'RetryPolicy', 'CircuitBreaker', 'CircuitOpenError', 'RecordStore', 'ProjectState', 'CommandExecutor', 'CommandResult', 'Sandbox', 'SandboxManager']
@@ -1,14 +1,18 @@
+import asyncio
+import hashlib
+import json
 import logging
-import requests
 logger = logging.getLogger(__name__)
 logger.propagate = True
-from typing import List, Dict, Any, Optional, Callable, Union
+from typing import List, Dict, Any, Optional, Callable, Set, Tuple, Union
 from lib.task import Task, TaskValidationError
 from lib.element import Element
 from lib.environment import Env
 from lib.config import config
-from lib.models import Model, Response
-import pydantic_core
+from lib.models import Model, Response, gather_or_cancel, run_sync
+from lib.retry import CircuitBreaker, RetryPolicy
+from lib.usage import Budget, usage_tracker
+from dataclasses import replace
 import traceback
 
 class Agent:
@@ -20,53 +24,176 @@ class Agent:
             self, 
             model: Model, 
             role: str, 
-            system_prompt: str
+            system_prompt: str,
+            budget: Union[None, Budget] = None,
+            retry_policy: Union[None, RetryPolicy] = None
     ):
         logger.debug(f"Initializing Agent with model: {model}, role: {role}")
         self.model = model
         self.role = role
         self.system_prompt = system_prompt
+        self.budget = budget
+        self.retry_policy = retry_policy or RetryPolicy()
         self.conversation_list: List[Dict[str, Any]] = []
         self.current_task = None
 
+    # Build the system prompt for a task. Ordered from most to least widely shared, so that 
+    # consecutive requests share the longest possible prefix for server-side prefix caching:
+    # role prompt (all tasks for this agent) -> environment (whole run) -> task-type instructions
+    def get_system_prompt(self, task: Task):
+        return self.system_prompt + Env.summary() + task.get_instructions(self.uses_structured_output(task))
+
+    # Identifies a run of a task for checkpointing: the prompts cover the task definition and its inputs
+    def get_run_key(self, task: Task, system_prompt: str, prompt_text: str) -> Dict[str, str]:
+        prompts = json.dumps({'system_prompt': system_prompt, 'prompt': prompt_text})
+        return {
+            'task': task.name,
+            'agent': self.role,
+            'model': self.model.model_name,
+            'input_hash': hashlib.sha256(prompts.encode('utf-8')).hexdigest()
+        }
+
+    # Whether to request schema-constrained JSON (rather than XML tags) for a task
+    def uses_structured_output(self, task: Task) -> bool:
+        if not task.expected_elements or not self.model.structured_output:
+            return False
+        return config.structured_output if task.structured_output is None else task.structured_output
+
     def perform_task(
             self, 
             task: Task, 
             inputs: Dict[str, any],
-            max_attempts: int = 3
+            max_attempts: Union[None, int] = None
+    ):
+        return run_sync(self.async_perform_task(task, inputs, max_attempts))
+
+    def perform_tasks(
+            self,
+            jobs: List[Tuple[Task, Dict[str, any]]],
+            max_attempts: Union[None, int] = None,
+            max_concurrency: int = None
+    ):
+        return run_sync(self.async_perform_tasks(jobs, max_attempts, max_concurrency))
+
+    # Run several (task, inputs) jobs concurrently; results are returned in job order. If one
+    # fails, the others are cancelled rather than left running on the shared event loop
+    async def async_perform_tasks(
+            self,
+            jobs: List[Tuple[Task, Dict[str, any]]],
+            max_attempts: Union[None, int] = None,
+            max_concurrency: int = None
+    ):
+        limit = max_concurrency or config.max_concurrency
+        semaphore = asyncio.Semaphore(limit)
+        logger.info(f"Performing {len(jobs)} tasks with max_concurrency: {limit}")
+
+        async def bounded_task(task, inputs):
+            async with semaphore:
+                return await self.async_perform_task(task, inputs, max_attempts, render=False)
+
+        return await gather_or_cancel(*[bounded_task(task, inputs) for task, inputs in jobs])
+
+    async def async_perform_task(
+            self, 
+            task: Task, 
+            inputs: Dict[str, any],
+            max_attempts: Union[None, int] = None,
+            render: bool = True
     ):
         logger.info(f"Performing task: {task} with inputs: {inputs}")
         self.current_task = task
+        system_prompt = self.get_system_prompt(task)
         prompt_text = task.get_prompt(**inputs)
         return_val = None
-        for i in range(max_attempts):
-            logger.debug(f"Attempt {i+1} of {max_attempts} for task: {task}")
-            logger.debug(f"Prompting model with text: {prompt_text}")
-            try:
-                resp = self.model.prompt(Env.summary() + prompt_text)
-                logger.debug(f"Model response: {resp}")
-                if resp.props:
-                    return_val = self._process_elements(task, resp)
-                else:
-                    logger.debug("No elements to process")
-                    return_val = resp.raw_text
-                break            
-            
-            # If an error occurs, try again until max_retries exceeded
-            except Exception as e:
-                if isinstance(e, requests.exceptions.RequestException):
-                    error_str = "Network"
-                elif isinstance(e, TaskValidationError):
-                    error_str = "Task Validation"   
-                elif isinstance(e, pydantic_core._pydantic_core.ValidationError):
-                    error_str = "Element Validation"
-                else:
-                    raise e
-                logger.error(f"{error_str}: {e}\n" + f"Retrying for attempt {i + 1}/{max_attempts}" \
-                    if i + 1 <= max_attempts else f"{error_str}: Max attempts exceeded - shutting down...")
-                logger.error(traceback.format_exc())
-                
-        
+
+        # Task-level policy overrides the agent's; an explicit max_attempts overrides the format retry budget
+        policy = task.retry_policy or self.retry_policy
+        if max_attempts is not None:
+            policy = replace(policy, format_attempts=max_attempts)
+        breaker = CircuitBreaker.for_endpoint(self.model.endpoint_id)
+        failures = {'transport': 0, 'format': 0}
+
+        # Replay the task from its checkpoint if it completed with exactly these prompts in an earlier session
+        state = config.get_state() if config.checkpoints else None
+        replayed = False
+        if state:
+            run_key = self.get_run_key(task, system_prompt, prompt_text)
+            checkpoint = state.find_task_run(**run_key)
+            if checkpoint is not None:
+                try:
+                    return_val = await self._replay(task, checkpoint)
+                    replayed = True
+
+                # A checkpoint that no longer validates (or predates this format) just means running the task
+                except Exception as e:
+                    if policy.classify(e) != 'format' and not isinstance(e, (ValueError, KeyError, TypeError)):
+                        raise
+                    logger.warning(f"Unable to replay task {task} from checkpoint, running it instead: {e}")
+            if not replayed:
+                run_id = state.start_task_run(**run_key)
+
+        try:
+            # Attribute model usage to this agent and task, and enforce their budgets (no attempts when replaying).
+            # Tasks are shared, so each run is charged to its own copy of the task's budget
+            task_budget = task.budget.fresh() if task.budget else None
+            with usage_tracker.scope('agent', self.role, self.budget), usage_tracker.scope('task', task.name, task_budget):
+                while not replayed:
+                    logger.debug(f"Attempt {sum(failures.values()) + 1} for task: {task} (failures so far: {failures})")
+                    logger.debug(f"Prompting model with text: {prompt_text}")
+
+                    # Fails fast with CircuitOpenError while the endpoint is known to be down
+                    breaker.before_request()
+                    try:
+
+                        # Retries after a bad response must be fresh generations, not the cached bad response
+                        use_cache = failures['format'] == 0
+                        if task.hedge_samples > 1:
+                            resp = await self._hedged_attempt(task, prompt_text, system_prompt, render, use_cache=use_cache)
+                        else:
+                            resp = await self._attempt(task, prompt_text, system_prompt, render, use_cache=use_cache)
+                        breaker.record_success()
+                        logger.debug(f"Model response: {resp}")
+                        checkpoint = self._checkpoint(task, resp)
+
+                        # Handlers block (file writes, commands), so they run off the event loop to not stall other jobs
+                        if resp.props:
+                            return_val = await asyncio.to_thread(self._process_elements, task, resp)
+                        else:
+                            logger.debug("No elements to process")
+                            return_val = resp.raw_text
+                        break
+
+                    # Retry transport and format errors separately, each until its own budget is exhausted
+                    except Exception as e:
+                        kind = policy.classify(e)
+                        if kind is None:
+                            raise
+
+                        # A malformed response still means the endpoint is up
+                        if kind == 'transport':
+                            breaker.record_failure()
+                        else:
+                            breaker.record_success()
+                        failures[kind] += 1
+                        limit = policy.max_attempts(kind)
+                        if failures[kind] >= limit:
+                            logger.error(f"{kind.capitalize()} error: {e}\nMax {kind} attempts ({limit}) exceeded for task: {task}")
+                            raise
+
+                        # Usage charged by the failed attempt may have used up a budget - stop before retrying
+                        usage_tracker.check_budgets()
+                        delay = policy.get_delay(kind, failures[kind])
+                        logger.error(f"{kind.capitalize()} error: {e}\nRetrying in {delay:.1f}s (attempt {failures[kind] + 1}/{limit})")
+                        logger.debug(traceback.format_exc())
+                        if delay:
+                            await asyncio.sleep(delay)
+        except BaseException:
+            if state:
+                state.finish_task_run(run_id, 'failed')
+            raise
+        if state and not replayed:
+            state.finish_task_run(run_id, 'complete', checkpoint)
+
         # Run optional callback if set on task completion
         if Agent.on_task_complete and return_val:
             logger.debug(f"Running on_task_complete callback: {Agent.on_task_complete}")
@@ -74,6 +201,143 @@ class Agent:
         
         return return_val
 
+    # The raw response is checkpointed rather than the task's result, so that replaying it runs its
+    # handlers again (e.g. rewriting files lost in a crash - FileHandler skips those left unchanged)
+    def _checkpoint(self, task: Task, resp: Response) -> str:
+        return json.dumps({'response': str(resp.buffer, 'utf-8'), 'structured': self.uses_structured_output(task)}, ensure_ascii=False)
+
+    # Validate and process a checkpointed response as if the model had just returned it
+    async def _replay(self, task: Task, checkpoint: str):
+        data = json.loads(checkpoint)
+        text = data['response']
+        if data['structured']:
+            resp = Response(text, props=Response._extract_json_content(text))
+        else:
+            resp = Response(text, tags=task.get_valid_tags(), strip_fences=True)
+        logger.info(f"Replaying task {task} from checkpoint")
+        if not resp.props:
+            return resp.raw_text
+        self._validate_elements(task, resp, resp.validated)
+        return await asyncio.to_thread(self._process_elements, task, resp)
+
+    # Prompt the model once and validate the response, without processing it
+    async def _attempt(
+            self,
+            task: Task,
+            prompt_text: str,
+            system_prompt: str,
+            render: bool = True,
+            use_cache: bool = True
+    ) -> Response:
+        validated: Set[str] = set()
+
+        # Structured output is constrained to the task's schema, so there is nothing to check while streaming
+        if self.uses_structured_output(task):
+            try:
+                resp = await self.model.async_prompt(
+                    prompt_text,
+                    render=render,
+                    system_prompt=system_prompt,
+                    use_cache=use_cache,
+                    json_schema=task.get_output_schema()
+                )
+            except json.JSONDecodeError as e:
+                raise TaskValidationError(f"Validation Error: Structured response is not valid JSON: {e}") from e
+        else:
+            on_open, on_element = self._stream_validators(task, validated)
+            resp = await self.model.async_prompt(
+                prompt_text, 
+                render=render, 
+                system_prompt=system_prompt, 
+                use_cache=use_cache,
+                on_open=on_open,
+                on_element=on_element,
+                tags=task.get_valid_tags()
+            )
+
+        # Items were already validated as they streamed in if validators were used
+        if resp.props:
+            self._validate_elements(task, resp, validated)
+        resp.validated = validated
+        return resp
+
+    # Callbacks that validate the response while it streams, so that the request is aborted
+    # (and retried) as soon as it goes wrong rather than after the full response is generated.
+    # Tags validated this way are added to validated. The Element objects themselves aren't kept, since 
+    # they would hold a second copy of every value in the response
+    def _stream_validators(self, task: Task, validated: Set[str]):
+        expected = task.get_expected_elements()
+        if not expected:
+            return None, None
+
+        def on_open(tag):
+            if tag not in expected:
+                logger.debug(f"Unexpected element <{tag}> in streamed response; aborting generation")
+                raise TaskValidationError(f"Validation Error: Unexpected element <{tag}> contained within LLM/model response")
+
+        def on_element(tag, value):
+            handler = config.handlers.get(tag) if config.handlers else None
+            if handler:
+                handler.element.model_validate(value)
+                validated.add(tag)
+
+        return on_open, on_element
+
+    # Run several attempts in parallel (optionally staggered) and return the first valid response
+    async def _hedged_attempt(
+            self,
+            task: Task,
+            prompt_text: str,
+            system_prompt: str,
+            render: bool = True,
+            use_cache: bool = True
+    ) -> Response:
+        logger.debug(f"Hedging task {task} with {task.hedge_samples} samples, delay: {task.hedge_delay}")
+
+        async def sample(n):
+            if task.hedge_delay:
+                await asyncio.sleep(n * task.hedge_delay)
+
+            # Only the first sample renders (or reads the cache) - the rest must be fresh generations
+            return await self._attempt(task, prompt_text, system_prompt, render and n == 0, use_cache and n == 0)
+
+        pending = {asyncio.ensure_future(sample(n)) for n in range(task.hedge_samples)}
+        error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for future in done:
+                    if future.exception() is None:
+                        logger.debug(f"Hedged sample succeeded; cancelling {len(pending)} remaining samples")
+                        return future.result()
+                    error = future.exception()
+                    logger.debug(f"Hedged sample failed: {error}")
+        finally:
+            for future in pending:
+                future.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+        raise error
+
+    # Check that the response only contains expected elements, and validate each item not already 
+    # validated - every item is validated exactly once, in one batch per tag
+    def _validate_elements(
+            self, 
+            task: Task,
+            resp: Response,
+            validated: Set[str]
+    ):
+        elements = list(resp.props.keys())
+        if not set(task.get_expected_elements()) >= set(elements):
+            logger.debug(f"Validation failed on returned elements: {elements}")
+            raise TaskValidationError("Validation Error: Unexpected elements contained within LLM/model response")
+        for key in elements:
+            handler = config.handlers.get(key) if config.handlers else None
+            if handler and key not in validated:
+                handler.element.validate_many(resp.props[key])
+                validated.add(key)
+
+    # Hand validated elements off to their handlers (which may have side effects, e.g. writing files)
     def _process_elements(
             self, 
             task: Task,
@@ -83,28 +347,19 @@ class Agent:
         # Used to return values back from the agent
         data = {}
         elements = list(resp.props.keys())
+        logger.debug(f"Processing returned elements: {elements}")
         
-        # Ensure the right elements have been returned
-        if set(task.get_expected_elements()) >= set(elements):
+        # If response contains elements
+        for key in elements:
+            items = resp.props[key]
 
-            logger.debug(f"Processing returned elements: {elements}")
-            
-            # If response contains elements
-            data = {}
-            for key in elements:
-                items = resp.props[key]
-
-                try:
-                    handler = config.handlers[key]
-                    logger.debug(f"Processing element with key: {key}, items: {len(items)}, handler: {handler}")
-                    data = handler.process(items) | data
-                except KeyError as e:
-                    logger.debug("No handler configured/mapped for element \"key\"; storing data and proceeding...")
-                    data = {key: items} | data
-        
-        else:
-            logger.debug(f"Validation failed on returned elements: {elements}")
-            raise TaskValidationError("Validation Error: Unexpected elements contained within LLM/model response")
+            try:
+                handler = config.handlers[key]
+                logger.debug(f"Processing element with key: {key}, items: {len(items)}, handler: {handler}")
+                data = handler.process(items, validated=key in resp.validated) | data
+            except KeyError as e:
+                logger.debug("No handler configured/mapped for element \"key\"; storing data and proceeding...")
+                data = {key: items} | data
 
         logger.debug(f"Returning processed elements: {list(data.keys())}")
         return data
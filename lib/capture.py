@@ -0,0 +1,79 @@
+import logging
+logger = logging.getLogger(__name__)
+logger.propagate = True
+import os
+import time
+import uuid
+from typing import Union
+
+
+# Bounded in-memory capture of a command's output, spilling the full stream to a log file
+class OutputCapture:
+    """
+    Keeps the first quarter of max_bytes (head) and the most recent three quarters (tail) in
+    memory, so memory per command is fixed however much it prints - the end of the output,
+    where errors usually are, gets the larger share. Until the output outgrows max_bytes
+    nothing is written to disk; from then on the whole stream (including what was already
+    captured) goes to a log file in log_dir, whose path is log_path. text is the view to show
+    to a model: the output itself if it fit, otherwise head and tail around a note of what was
+    left out and where to find it.
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024, log_dir: Union[None, str] = None, name: str = 'command'):
+        self.max_bytes = max_bytes
+        self.log_dir = log_dir
+        self.name = name
+        self.head_bytes = max_bytes // 4
+        self.tail_bytes = max_bytes - self.head_bytes
+        self.head = bytearray()
+        self.tail = bytearray()
+        self.total_bytes = 0
+        self.log_path: Union[None, str] = None
+        self._log = None
+
+    def write(self, data: bytes):
+        if not data:
+            return
+        self.total_bytes += len(data)
+        if self._log:
+            self._log.write(data)
+        elif self.total_bytes > self.max_bytes and self.log_dir:
+            self._spill(data)
+
+        # Fill the head first, then keep only the most recent tail_bytes
+        if len(self.head) < self.head_bytes:
+            take = self.head_bytes - len(self.head)
+            self.head += data[:take]
+            data = data[take:]
+        self.tail += data
+        if len(self.tail) > self.tail_bytes:
+            del self.tail[:len(self.tail) - self.tail_bytes]
+
+    # Everything written so far is still in head and tail at this point, as nothing has been dropped yet
+    def _spill(self, data: bytes):
+        os.makedirs(self.log_dir, exist_ok=True)
+        self.log_path = os.path.join(self.log_dir, f"{self.name}-{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}.log")
+        self._log = open(self.log_path, 'wb')
+        self._log.write(self.head)
+        self._log.write(self.tail)
+        self._log.write(data)
+        logger.debug(f"Command output exceeded {self.max_bytes} bytes, spilling to {self.log_path}")
+
+    @property
+    def truncated(self) -> bool:
+        return self.total_bytes > len(self.head) + len(self.tail)
+
+    @property
+    def text(self) -> str:
+        if not self.truncated:
+            return (self.head + self.tail).decode('utf-8', errors='replace')
+        omitted = self.total_bytes - len(self.head) - len(self.tail)
+        where = f"full output in {self.log_path}" if self.log_path else "full output was not saved"
+        return self.head.decode('utf-8', errors='replace') \
+            + f"\n... [{omitted} bytes of output omitted - {where}] ...\n" \
+            + self.tail.decode('utf-8', errors='replace')
+
+    def close(self):
+        if self._log:
+            self._log.close()
+            self._log = None
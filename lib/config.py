@@ -1,7 +1,9 @@
+import os
 from typing import List, Dict, Any, Optional
 from dataclasses import dataclass
 from lib.handler import Handler
 from lib.element import Element
+from lib.state import ProjectState
 
 @dataclass
 class Config:
@@ -15,9 +17,49 @@ class Config:
 
     current_phase: str = 'planning'
 
+    # On-disk model response cache (see lib/models/cache.py)
+    cache_dir: str = '.cache/responses'
+    cache_max_bytes: int = 512 * 1024 * 1024
+    cache_max_age_days: float = 30
+
+    # Cache of venv templates that project venvs are cloned from (see lib/venv_cache.py)
+    venv_cache_dir: str = '.cache/venvs'
+    venv_cache_max_templates: int = 8
+
+    # Request schema-constrained JSON output instead of XML tags from models that support it
+    # (see Model.structured_output) - can be overridden per Task
+    structured_output: bool = True
+
+    # Where DataHandlers store element items: 'sqlite' for the project state database (see
+    # lib/state.py), or 'jsonl' for one JSON Lines file per handler (see lib/store.py)
+    state_backend: str = 'sqlite'
+    state_file: str = 'state.db'
+
+    # Record every completed Agent task in the state store, and replay it instead of re-running
+    # it when it is performed again with the same inputs (e.g. after a crash)
+    checkpoints: bool = True
+
+    # Maximum number of commands from a single response run at once (see lib/executor.py)
+    command_workers: int = 4
+
+    # Maximum number of sandboxes (copies of the src tree) test suites are run in at once (see lib/sandbox.py)
+    max_sandboxes: int = 4
+
+    # Output kept in memory per shell command - longer output is truncated to its start and end,
+    # with the full output saved to a log file in command_log_dir (see lib/capture.py)
+    command_output_max_bytes: int = 64 * 1024
+    command_log_dir: str = 'logs/commands'
+
+    # Maximum number of tasks an Agent will run concurrently via perform_tasks()
+    max_concurrency: int = 4
+
     # Element handler assignments
     handlers: Dict[str, Handler] = None
 
+    # The state store for the current project
+    def get_state(self) -> ProjectState:
+        return ProjectState.open(os.path.join(self.project_root, self.state_file))
+
     def set_project_name(self, project_name: str):
         self.project_name = project_name
         self.project_root = f'projects/{project_name}'
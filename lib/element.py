@@ -3,7 +3,7 @@ from textwrap import dedent
 from typing import Dict, Any, Optional, List, get_type_hints
 from typing import get_args, get_origin, Optional, List, Union
 import typing
-from pydantic import BaseModel
+from pydantic import BaseModel, TypeAdapter
 import logging
 logger = logging.getLogger(__name__)
 logger.propagate = True
@@ -12,18 +12,36 @@ logger.propagate = True
 T = typing.TypeVar('T')
 ManyOptional = Optional[Union[List[T], T, None]]
 
+# Element instructions are static per Element subclass, so are only generated once per class
+_instructions_cache: Dict[type, str] = {}
+_json_instructions_cache: Dict[type, str] = {}
+_tags_cache: Dict[type, frozenset] = {}
+
+# Building a validator is expensive, so each Element subclass's list validator is built once
+_adapter_cache: Dict[type, TypeAdapter] = {}
+
 # Generic Base class for Products 
 class Element(BaseModel):
 
     # Private attribute - will include the JSON string of the model
     _json_schema: str = ""
 
+    # Per-instance JSON representation - only built if the element is printed
+    _json_string: Optional[str] = None
+
+    # Validates a list of items (e.g. all items of one tag in a response) in a single pass
+    @classmethod
+    def validate_many(cls, items: List[Any]) -> List['Element']:
+        adapter = _adapter_cache.get(cls)
+        if adapter is None:
+            adapter = TypeAdapter(List[cls])
+            _adapter_cache[cls] = adapter
+        return adapter.validate_python(items)
+
     # Generates Pydantic elements and does validation all in one
-    @staticmethod
-    def create_elements(elem_list):
-        obj_list = []
-        for elem in elem_list:
-            obj_list.append(Element.model_validate(elem))
+    @classmethod
+    def create_elements(cls, elem_list):
+        obj_list = cls.validate_many(elem_list)
         logger.info(f"Successfully created Pydantic elements from list of Dicts.")
         return obj_list
     
@@ -57,19 +75,20 @@ class Element(BaseModel):
 
     # Generates example XML string for formatting hints to the agent(s)
     @classmethod
-    def generate_xml_formatting_hints(cls, formatting_rules="", lvl=1):
+    def generate_xml_formatting_hints(cls, formatting_rules="", lvl=1, tag_format="<{}>"):
         logger.debug(f"Generating XML formatting rules for {cls}")
         field_types = get_type_hints(cls)
         for field_name, field in cls.model_fields.items():
             if field.alias:
-                formatting_rules += "\n" + ('\t' * (lvl-1)) + f"- <{field.alias}>: "
+                formatting_rules += "\n" + ('\t' * (lvl-1)) + f"- {tag_format.format(field.alias)}: "
                 field_type = field_types[field_name]
                 child_elem = Element.is_subclass_of_element(field_type)
                 if child_elem:
                     formatting_rules += "is composed of the following child elements:"
                     formatting_rules = child_elem.generate_xml_formatting_hints(
                         formatting_rules=formatting_rules, 
-                        lvl=lvl+1
+                        lvl=lvl+1,
+                        tag_format=tag_format
                     )
                 else:
                     formatting_rules += "contains " \
@@ -78,29 +97,61 @@ class Element(BaseModel):
  
         return formatting_rules
     
-    # Generates example XML string for formatting hints to the agent(s)
+    # Generates example XML string for formatting hints to the agent(s) - memoized per subclass
     @classmethod
     def print_element_instructions(cls):
-        logger.debug(f"Generating element instructions for {cls}")
-        inst = f"Use the below XML structure {cls._purpose.default}:\n"
-        inst += cls.generate_xml_schema()
-        inst += "\n\nWhere the XML elements are populated with the following data:"
-        inst += cls.generate_xml_formatting_hints()
+        inst = _instructions_cache.get(cls)
+        if inst is None:
+            logger.debug(f"Generating element instructions for {cls}")
+            inst = "".join([
+                f"Use the below XML structure {cls._purpose.default}:\n",
+                cls.generate_xml_schema(),
+                "\n\nWhere the XML elements are populated with the following data:",
+                cls.generate_xml_formatting_hints()
+            ])
+            _instructions_cache[cls] = inst
         return inst
     
+    # Instructions for returning this element as JSON, for structured output - memoized per subclass
+    @classmethod
+    def print_json_instructions(cls):
+        inst = _json_instructions_cache.get(cls)
+        if inst is None:
+            logger.debug(f"Generating JSON element instructions for {cls}")
+            inst = "".join([
+                f"Use the \"{cls.get_tag()}\" list {cls._purpose.default}. Each item is an object with the following fields:",
+                cls.generate_xml_formatting_hints(tag_format='"{}"'),
+                "\n"
+            ])
+            _json_instructions_cache[cls] = inst
+        return inst
+
     @classmethod
     def get_tag(cls):
         return cls._element.default 
 
-    # Customize if required
-    def __init__(self, **data) -> None:
-        Element._json_string = json.dumps(data, indent=4)
-        super().__init__(**data)  
-      
+    # All tags that can appear in this element's XML - its own, its fields' aliases and those of child elements
+    @classmethod
+    def get_tags(cls):
+        tags = _tags_cache.get(cls)
+        if tags is None:
+            tags = {cls.get_tag()}
+            field_types = get_type_hints(cls)
+            for field_name, field in cls.model_fields.items():
+                if field.alias:
+                    tags.add(field.alias)
+                    child_elem = Element.is_subclass_of_element(field_types[field_name])
+                    if child_elem:
+                        tags |= child_elem.get_tags()
+            tags = frozenset(tags)
+            _tags_cache[cls] = tags
+        return tags
 
     # Control the exact string representation for convenience
     def __str__(self):
-        return Element._json_string
+        if self._json_string is None:
+            self._json_string = json.dumps(self.model_dump(mode='json', by_alias=True), indent=4)
+        return self._json_string
     
 ## DEFINE ELEMENT TYPES ##
 class DataElem(Element):
@@ -0,0 +1,232 @@
+import logging
+logger = logging.getLogger(__name__)
+logger.propagate = True
+import os
+import re
+import shlex
+import signal
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, List, Union
+from lib.capture import OutputCapture
+
+# Package installs, e.g. "pip install x", "python -m pip install x", "npm install"
+INSTALL_PATTERN = re.compile(
+    r'^\s*(?:\S*python[\d.]*(?:\.exe)?\s+-m\s+pip|py(?:\s+-[\d.]+)?\s+-m\s+pip|pip[\d.]*|npm|yarn|pnpm|poetry|conda|apt(?:-get)?|brew)\s+(?:install|add|i)\b'
+)
+
+# pip installs that can be merged into a single pip run: just package specs, no options
+PIP_INSTALL_PATTERN = re.compile(r'^\s*(?:\S*python[\d.]*(?:\.exe)?\s+-m\s+pip|py(?:\s+-[\d.]+)?\s+-m\s+pip|pip[\d.]*)\s+install((?:\s+[^\s&|;<>`$()-][^\s&|;<>`$()]*)+)\s*$')
+
+# File and environment setup, e.g. "mkdir data", "export DEBUG=1"
+SETUP_PATTERN = re.compile(r'^\s*(?:mkdir|md|touch|cp|copy|mv|move|ln|chmod|rm|del|echo|cd|pushd|export|set|source|\.|\S*activate(?:\.bat)?)(?:\s|$)')
+
+# Setup commands that only create things, so can run alongside each other
+PARALLEL_SETUP_PATTERN = re.compile(r'^\s*(?:mkdir|md|touch)\s[^&|;<>`]*$')
+
+# Setup commands that change the shell's state for the commands after them
+ENV_PATTERN = re.compile(r'^\s*(?:cd|pushd|export|set|source|\.|\S*activate(?:\.bat)?)(?:\s|$)')
+
+# How long output is still read for after a command's shell exits
+OUTPUT_GRACE_SECONDS = 1.0
+
+
+@dataclass
+class CommandResult:
+    command: str
+    kind: str
+    output: str
+    exit_code: Union[None, int]
+    seconds: float
+    timed_out: bool = False
+
+    # Full output, if it was too long to keep in memory (see OutputCapture)
+    log_path: Union[None, str] = None
+
+
+# Runs a list of commands from the model as fast as their ordering allows
+class CommandExecutor:
+    """
+    Commands are classified as 'install', 'setup' or 'run' and executed in stages, in the
+    order they were given: a stage is either one command, a run of consecutive mkdir/touch
+    commands, which run in parallel worker shells, or a run of consecutive plain pip installs,
+    which are merged into one pip run (concurrent pip runs in the same environment can corrupt
+    it). Commands that change the shell's state (cd, export, activate, ...) are also prepended
+    to every later command, as a single shell would keep it.
+    """
+
+    def __init__(
+            self,
+            cwd: str,
+            venv_path: Union[None, str] = None,
+            max_workers: int = 4,
+            timeouts: Union[None, Dict[str, float]] = None,
+            max_output_bytes: int = 64 * 1024,
+            log_dir: Union[None, str] = None,
+            env: Union[None, Dict[str, str]] = None
+    ):
+        self.cwd = cwd
+        self.venv_path = venv_path
+        self.max_workers = max_workers
+        self.max_output_bytes = max_output_bytes
+        self.log_dir = log_dir
+
+        # Extra environment variables for the commands
+        self.env = env or {}
+        self.timeouts = {'install': 600, 'setup': 60, 'run': 300} | (timeouts or {})
+
+    @staticmethod
+    def classify(command: str) -> str:
+        if INSTALL_PATTERN.match(command):
+            return 'install'
+        if SETUP_PATTERN.match(command):
+            return 'setup'
+        return 'run'
+
+    # Whether a command can share a stage with the same kind of command next to it. Of installs, only
+    # plain pip installs can, as they are merged into one pip run - package managers aren't safe to
+    # run concurrently (npm in one node_modules, apt-get against the dpkg lock), so any other install
+    # (including a pip install with options, e.g. -r or --upgrade) runs in a stage of its own
+    @staticmethod
+    def is_parallel(command: str, kind: str) -> bool:
+        if kind == 'install':
+            return PIP_INSTALL_PATTERN.match(command) is not None
+        return kind == 'setup' and PARALLEL_SETUP_PATTERN.match(command) is not None
+
+    def plan(self, commands: List[str]) -> List[List[int]]:
+        """Indexes of the commands in each stage, in execution order."""
+        stages = []
+        group = None
+        for i, command in enumerate(commands):
+            kind = self.classify(command)
+            parallel = self.is_parallel(command, kind)
+            if parallel and group == kind:
+                stages[-1].append(i)
+            else:
+                stages.append([i])
+            group = kind if parallel else None
+        return stages
+
+    def run(self, commands: List[str]) -> List[CommandResult]:
+        """Run the commands, returning their results in the same order."""
+        results: List[CommandResult] = [None] * len(commands)
+        prelude = []
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            for stage in self.plan(commands):
+                logger.debug(f"Running stage: {[commands[i] for i in stage]}")
+                jobs = self._merge_pip_installs(stage, commands)
+                futures = [(indexes, pool.submit(self._run_one, command, kind, list(prelude))) for indexes, command, kind in jobs]
+                for indexes, future in futures:
+                    result = future.result()
+                    for i in indexes:
+                        results[i] = CommandResult(
+                            commands[i], result.kind, result.output, result.exit_code, result.seconds, result.timed_out, result.log_path
+                        )
+                for i in stage:
+                    if ENV_PATTERN.match(commands[i]) and results[i].exit_code == 0:
+                        prelude.append(commands[i])
+        return results
+
+    def _merge_pip_installs(self, stage: List[int], commands: List[str]) -> List[tuple]:
+        """(command indexes, command, kind) jobs for a stage, with its pip installs merged into one."""
+        jobs = []
+        pip_args = []
+        pip_indexes = []
+        for i in stage:
+            match = PIP_INSTALL_PATTERN.match(commands[i]) if len(stage) > 1 else None
+            if match:
+                pip_args.append(match.group(1).strip())
+                pip_indexes.append(i)
+            else:
+                jobs.append(([i], commands[i], self.classify(commands[i])))
+        if len(pip_indexes) == 1:
+            jobs.append((pip_indexes, commands[pip_indexes[0]], 'install'))
+        elif pip_indexes:
+            jobs.append((pip_indexes, f"{self._python()} -m pip install {' '.join(pip_args)}", 'install'))
+        return jobs
+
+    def _python(self) -> str:
+        if self.venv_path:
+            python = os.path.join(self.venv_path, 'Scripts' if os.name == 'nt' else 'bin', 'python')
+        else:
+            python = sys.executable
+        return subprocess.list2cmdline([python]) if os.name == 'nt' else shlex.quote(python)
+
+    # Environment with the project's venv activated, if there is one
+    def _env(self) -> Dict[str, str]:
+        env = dict(os.environ) | self.env
+        if self.venv_path and os.path.exists(self.venv_path):
+            env['VIRTUAL_ENV'] = os.path.abspath(self.venv_path)
+            bin_dir = os.path.join(env['VIRTUAL_ENV'], 'Scripts' if os.name == 'nt' else 'bin')
+            env['PATH'] = bin_dir + os.pathsep + env.get('PATH', '')
+            env.pop('PYTHONHOME', None)
+        return env
+
+    def _run_one(self, command: str, kind: str, prelude: List[str]) -> CommandResult:
+        full_command = " && ".join(prelude + [command])
+        timeout = self.timeouts[kind]
+        logger.debug(f"Running {kind} command: {full_command}, timeout: {timeout}")
+        start_time = time.monotonic()
+
+        # Each command gets its own process group, so that a timeout kills everything it started
+        proc = subprocess.Popen(
+            full_command,
+            shell=True,
+            cwd=self.cwd,
+            env=self._env(),
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            start_new_session=os.name != 'nt',
+            creationflags=subprocess.CREATE_NEW_PROCESS_GROUP if os.name == 'nt' else 0
+        )
+
+        # Read the output as it arrives, so that memory use is bounded however much the command prints
+        capture = OutputCapture(self.max_output_bytes, self.log_dir)
+        reader = threading.Thread(target=self._read_output, args=(proc, capture), daemon=True)
+        reader.start()
+        try:
+            proc.wait(timeout=timeout)
+            timed_out = False
+        except subprocess.TimeoutExpired:
+            self._kill(proc)
+            proc.wait()
+            timed_out = True
+
+        # Background processes the command started (e.g. 'python app.py &') hold the output pipe open
+        # after the shell exits: give them a moment to finish writing, then kill them rather than wait
+        reader.join(timeout=OUTPUT_GRACE_SECONDS)
+        background_killed = reader.is_alive()
+        if background_killed:
+            logger.warning(f"Killing background processes still holding the output of: {command}")
+            self._kill(proc)
+            reader.join(timeout=OUTPUT_GRACE_SECONDS)
+        capture.close()
+        output = capture.text
+        if timed_out:
+            output += f"\n USER: Command did not complete in under {timeout} seconds and was terminated."
+        elif background_killed:
+            output += "\n USER: Background processes started by the command were terminated when it finished."
+        seconds = time.monotonic() - start_time
+        logger.debug(f"Command completed in {seconds:.1f}s with exit code {proc.returncode}: {command}")
+        return CommandResult(command, kind, output, None if timed_out else proc.returncode, seconds, timed_out, capture.log_path)
+
+    @staticmethod
+    def _read_output(proc: subprocess.Popen, capture: OutputCapture):
+        with proc.stdout:
+            for chunk in iter(lambda: proc.stdout.read1(65536), b''):
+                capture.write(chunk)
+
+    @staticmethod
+    def _kill(proc: subprocess.Popen):
+        if os.name == 'nt':
+            subprocess.run(['taskkill', '/F', '/T', '/PID', str(proc.pid)], capture_output=True)
+        else:
+            try:
+                os.killpg(proc.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
@@ -0,0 +1,72 @@
+import logging
+logger = logging.getLogger(__name__)
+logger.propagate = True
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from typing import Iterable, Union
+
+# Written files get the usual permissions, rather than mkstemp's owner-only ones
+_umask = os.umask(0)
+os.umask(_umask)
+_FILE_MODE = 0o666 & ~_umask
+
+# Whether cp can clone copy-on-write here - cleared the first time a filesystem doesn't support it
+_reflink = sys.platform.startswith('linux') or sys.platform == 'darwin'
+
+
+def clone_tree(source: str, target: str, exclude: Iterable[str] = ()) -> str:
+    """
+    Copy a directory tree to target (which must not exist) as cheaply as the filesystem allows:
+    copy-on-write where it's supported, otherwise with hardlinks (or plain copies across
+    filesystems). Names in exclude are skipped at the top level of the tree. Returns the method
+    used: 'reflink' or 'hardlink'.
+
+    Hardlinked files share their content with the source, so a clone's files must be replaced
+    (e.g. written to a temporary file and renamed) rather than modified in place.
+    """
+    global _reflink
+    source = os.path.abspath(source)
+    exclude = set(exclude)
+    names = [name for name in os.listdir(source) if name not in exclude]
+    if _reflink:
+        os.makedirs(target)
+        args = ['cp', '-a', '--reflink=always'] if sys.platform.startswith('linux') else ['cp', '-c', '-R', '-p']
+        if not names or subprocess.run(args + [os.path.join(source, name) for name in names] + [target], capture_output=True).returncode == 0:
+            return 'reflink'
+        logger.debug(f"Copy-on-write cloning is unavailable for {source}, using hardlinks")
+        _reflink = False
+        shutil.rmtree(target, ignore_errors=True)
+    shutil.copytree(
+        source, target, symlinks=True, copy_function=_link_or_copy,
+        ignore=lambda path, _: exclude if os.path.abspath(path) == source else ()
+    )
+    return 'hardlink'
+
+
+def _link_or_copy(source: str, target: str):
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copy2(source, target)
+
+
+def atomic_write(file_path: str, pieces: Iterable[Union[bytes, memoryview]]):
+    """
+    Write a file by writing a temporary file beside it and renaming that into place, so a crash
+    never leaves a partial file - and a hardlinked copy of the old file is replaced, not modified.
+    """
+    dir_path = os.path.dirname(file_path) or '.'
+    os.makedirs(dir_path, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=dir_path, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as fout:
+            for piece in pieces:
+                fout.write(piece)
+        os.chmod(tmp_path, _FILE_MODE)
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
@@ -12,12 +12,13 @@ class Handler(ABC):
     ):
         self.element = element
 
+    # Validated is True if the caller already validated the items (e.g. while streaming)
     @abstractmethod
-    def process(data):
+    def process(self, items, validated: bool = False):
         pass
 
     # Convert data to Pydantic Element Objects and validate
     def validate(self, data) -> List[Element]:
-        return [type(obj) for obj in self.element.create_elements(data)]
+        return self.element.validate_many(data)
 
 
@@ -1,12 +1,16 @@
 import logging
 logger = logging.getLogger(__name__)
 logger.propagate = True
-from .base import Model, Response
+from .base import Model, Response, gather_or_cancel, run_sync
+from .cache import ResponseCache
+from .parser import ElementDict, Span, StreamParser, json_default
+from .render import StreamRenderer, ConsoleRenderer, NullRenderer
 from .claude import Claude
 from .gemini import Gemini
 from .gpt import GPT
 from .o1 import O1
 from .ollama import Ollama
 from .vllm import VLLM
+from .pool import ModelPool
 
-__all__ = ['Model', 'Claude', 'Gemini', 'GPT', 'O1', 'Ollama', 'VLLM', 'Response']
+__all__ = ['Model', 'Claude', 'Gemini', 'GPT', 'O1', 'Ollama', 'VLLM', 'ModelPool', 'Response', 'ResponseCache', 'StreamParser', 'ElementDict', 'Span', 'json_default', 'StreamRenderer', 'ConsoleRenderer', 'NullRenderer', 'gather_or_cancel', 'run_sync']
@@ -1,3 +1,5 @@
+import asyncio
+import json
 import logging
 import os
 import sys
@@ -5,67 +7,125 @@ import time
 logger = logging.getLogger(__name__)
 logger.propagate = True
 from abc import ABC, abstractmethod
-import re
 from rich.console import Console
-from rich.segment import ControlType
-from rich.control import Control
-from typing import AsyncGenerator, Generator, Iterator
+from typing import Any, AsyncGenerator, Callable, Coroutine, Dict, Generator, Iterator, List, Set, Type, Union
 from pydantic import BaseModel
-from rich.syntax import Syntax
+from .cache import ResponseCache
+from .parser import FENCE_PATTERN, StreamParser
+from .render import StreamRenderer, ConsoleRenderer, NullRenderer
+from lib.usage import BudgetExceededError, Usage, usage_tracker
 
 # Class for storing and parsing LLM responses    
 class Response:
 
-    def __init__(self, resp):
-        self.raw_text = resp
+    # Marker for "props not supplied" since None is a valid parse result
+    _UNPARSED = object()
 
-        # Extract properties from 
-        self.props = Response._extract_tagged_content(resp)
+    def __init__(self, resp, props=_UNPARSED, tags: Union[None, Set[str]] = None, strip_fences: bool = False):
+
+        # Extract properties from response text, unless already parsed while streaming
+        if props is Response._UNPARSED:
+            parser = StreamParser(strip_fences=strip_fences, tags=tags)
+            parser.feed(resp)
+            props = parser.close()
+            resp = parser.buffer
+        elif isinstance(resp, str):
+            resp = resp.encode('utf-8')
+
+        # The response as UTF-8 - the only copy of it; parsed values are spans of this buffer
+        self.buffer = resp
+        self.strip_fences = strip_fences
+        self.props = props
+
+        # Tags whose items have been validated - filled in by the Agent
+        self.validated: Set[str] = set()
         if self.props:
             logger.debug(f"Response instance initialized with props: {list(self.props.keys())}")
         else:
             logger.debug(f"No tagged content found in LLM/model response; returning None...")
 
+    # Decoded on each access rather than kept, so the response isn't held twice
+    @property
+    def raw_text(self) -> str:
+        return str(FENCE_PATTERN.sub(b'', self.buffer) if self.strip_fences else self.buffer, 'utf-8')
+
     def get_returned_elements(self):
         logger.debug(f"Getting returned elements: {self.props.keys()}")
         return set(self.props.keys())
 
-    def _extract_tagged_content(content, top_level=True):
+    @staticmethod
+    def _extract_tagged_content(content: str, tags: Union[None, Set[str]] = None):
         """
-        Extract content from XML-style tags, optionally returning attributes if present.
-        Finds all occurrences of the specified tag in the content.
+        Extract content from XML-style tags (optionally only the given tag names) in a single pass.
+        Returns a dict of top-level tag -> list of values, or None if there is no tagged content.
         """
-        results = {}
-        result = {}
+        parser = StreamParser(tags=tags)
+        parser.feed(content)
+        return parser.close()
+
+    @staticmethod
+    def _extract_json_content(content: str):
+        """
+        Extract content from a structured (JSON) response of the form {tag: [item, ...], ...} into the
+        same shape as _extract_tagged_content. Raises json.JSONDecodeError if it isn't a JSON object.
+        """
+        data = json.loads(content)
+        if not isinstance(data, dict):
+            raise json.JSONDecodeError("Structured response is not a JSON object", content, 0)
+        props = {}
+        for tag, items in data.items():
+            if items:
+                props[tag.lower().strip()] = items if isinstance(items, list) else [items]
+        return props if props else None
+
+
+# JSON schemas are static per class, and costly to generate on every request
+_json_schemas: Dict[type, dict] = {}
+
+def get_json_schema(schema_class: type[BaseModel]) -> dict:
+    """The JSON schema of a pydantic model class, generated once per class."""
+    schema = _json_schemas.get(schema_class)
+    if schema is None:
+        schema = schema_class.model_json_schema()
+        _json_schemas[schema_class] = schema
+    return schema
+
+
+# Single long-lived event loop shared by all synchronous callers. The async provider 
+# clients keep connection pools bound to the loop they were first used on, so a fresh
+# loop per call (i.e. asyncio.run) would leave them pointing at a closed loop.
+_event_loop: asyncio.AbstractEventLoop = None
+
+def run_sync(coro: Coroutine):
+    """Run a coroutine to completion from synchronous code on the shared event loop."""
+    global _event_loop
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        pass
+    else:
+        coro.close()
+        raise RuntimeError("run_sync() cannot be called from a running event loop; await the async method instead")
+    if _event_loop is None or _event_loop.is_closed():
+        _event_loop = asyncio.new_event_loop()
+    return _event_loop.run_until_complete(coro)
 
-        # Search for specific tags 
-        pattern = r'<([\w]+)>(.*?)<\/(\1)>'
-        matches = list(re.finditer(pattern, content, re.DOTALL))
-        
-        if len(matches) > 0:
-            for match in matches:
-                
-                # Get properties of match
-                tag_name = match.group(1).lower().strip()
-                tag_content = match.group(2)
-                
-                # Recursively call method and store results in nested struct
-                if top_level:
-                    if tag_name not in results:
-                        results[tag_name] = []
-                    results[tag_name].append(Response._extract_tagged_content(tag_content, top_level=False))
-                else:
-                    result[tag_name] = Response._extract_tagged_content(tag_content, top_level=False)
-                
-            # Return list of all matching elements
-            return results if top_level else result
-
-        # Reached end of recursive document parsing
-        else:
-            if top_level:
-                return None
-            else:
-                return content
+
+async def gather_or_cancel(*aws) -> list:
+    """
+    Like asyncio.gather, but if one of the awaitables fails the others are cancelled (and awaited)
+    before the error is raised - on the shared event loop they would otherwise carry on in the
+    background, resuming during whatever run_sync call comes next.
+    """
+    futures = [asyncio.ensure_future(aw) for aw in aws]
+    try:
+        return await asyncio.gather(*futures)
+    finally:
+        pending = [future for future in futures if not future.done()]
+        for future in pending:
+            future.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
 
 
 class Model(ABC):
@@ -74,10 +134,37 @@ class Model(ABC):
     
     # Class variable to track total API costs across all instances
     total_api_cost = 0.0    
+
+    # Default limit on in-flight requests for prompt_many()
+    max_concurrency: int = 4
+
+    # Optional on-disk response cache shared by all models (see main.py)
+    cache: ResponseCache = None
+
+    # Whether the provider can constrain decoding to a JSON schema (see async_prompt's json_schema)
+    structured_output: bool = False
+
+    # Renderer used for streamed responses; set to NullRenderer to run headless
+    renderer: Type[StreamRenderer] = ConsoleRenderer
+
+    # All model instances, for end-of-run reporting
+    instances: List['Model'] = []
     
     def __init__(self):
+        Model.instances.append(self)
         self.system_prompt = None
         self.json_schema = None
+        self.model_name = None
+
+        # Sampling parameters passed through to the provider; part of the response cache key
+        self.sampling_params = {}
+
+        # Time-to-first-token of streamed (uncached) requests
+        self.ttft_count = 0
+        self.ttft_total = 0.0
+
+        # Server-side prefix cache counters at the start of the run (see start_prefix_cache_stats)
+        self._prefix_cache_start: Union[None, dict] = None
         self.api_costs = {
             'prompt_tokens': 0.0,
             'completion_tokens': 0.0
@@ -96,52 +183,195 @@ class Model(ABC):
         self.json_schema = schema_class
         logger.debug(f"Json schema set: {self.json_schema}")
     
-    def prompt(self, prompt_text: str, console_overlay: bool=False, remove_sections: bool=True) -> Response:
-        if console_overlay:
-            print("\033[?1049h\033[22;0;0t\033[0;0H", end="")
-
-        full_response = ""
-        max_lines = 1
-        Model.console.print("[bold green]=== [Agent]: [/bold green]", end="")
-        for text in self.sync_prompt(prompt_text):
-            full_response += text
-            lines = full_response.split("\n")
-            line_count = len(lines)
-            if line_count > max_lines:
-                syntax = Syntax(lines[-2], "xml")
-                Model.console.print(syntax)
-                max_lines = line_count
-        syntax = Syntax(lines[-1], "xml")
-        Model.console.print(syntax)
-
-
-        if console_overlay:
-            print("\033[?1049l\033[23;0;0t", end="")
-        else:
-            
-            with Model.console.status("[bold green]Prompt Response Complete! Processing...[/bold green]", spinner="dots"):
-                time.sleep(0.5)
-            
-            """
-            for i in range(max_lines):
-                Model.console.control(
-                    Control(
-                        (ControlType.CURSOR_UP, 1),
-                        (ControlType.ERASE_IN_LINE, 2)
-                    )
-                )
-                time.sleep(0.02)
-            """
-
-        logger.debug(f"Prompt response complete: {full_response}")
-
-        if remove_sections:
-            full_response = re.sub('\`\`\`[a-zA-Z0-9]*', '', full_response)
-        return Response(full_response)
+    def prompt(self, prompt_text: str, console_overlay: bool=False, remove_sections: bool=True, system_prompt: str=None) -> Response:
+        """Synchronous wrapper around async_prompt for callers outside of an event loop."""
+        return run_sync(self.async_prompt(prompt_text, console_overlay, remove_sections, system_prompt=system_prompt))
+
+    async def async_prompt(
+            self, 
+            prompt_text: str, 
+            console_overlay: bool=False, 
+            remove_sections: bool=True, 
+            render: bool=True,
+            on_element: Union[None, Callable[[str, Any], None]] = None,
+            system_prompt: str = None,
+            use_cache: bool = True,
+            on_open: Union[None, Callable[[str], None]] = None,
+            tags: Union[None, Set[str]] = None,
+            json_schema: type[BaseModel] = None
+    ) -> Response:
+        """
+        Prompt the model and stream the response. If json_schema is given, the response is generated
+        as JSON against the schema (see structured_output) and parsed as such, rather than as tags.
+        """
+        system_prompt = system_prompt or self.system_prompt
+
+        # Serve byte-identical prompts from the response cache if enabled - only responses cached by
+        # earlier runs, so a prompt repeated within a run gets a fresh sample. Callers retrying after
+        # a bad response pass use_cache=False to get a fresh sample (which replaces it)
+        cache_key = None
+        cached_response = None
+        if Model.cache:
+            cache_key = ResponseCache.make_key(**self._cache_fields(prompt_text, system_prompt, json_schema))
+            if use_cache:
+                cached_response = Model.cache.get(cache_key)
+
+        # Elements are parsed as they stream in, rather than after the response completes
+        # Either callback may raise to abort the request early - the stream is then closed
+        # so the server stops generating output that would be thrown away
+        # Only tags in the tags whitelist (if given) are parsed; any others are just text
+        parser = StreamParser(on_element=on_element, strip_fences=remove_sections, on_open=on_open, tags=tags) if not json_schema else None
+        renderer = Model.renderer(console=Model.console, overlay=console_overlay, lexer="json" if json_schema else "xml") if render else NullRenderer()
+
+        # The response is only held once: in the parser's buffer, or as UTF-8 here for JSON
+        buffer = parser.buffer if parser else bytearray()
+
+        def feed(text: str):
+            if parser:
+                parser.feed(text)
+            else:
+                buffer.extend(text.encode('utf-8'))
+
+        # The renderer is finished however the stream ends, so an aborted one doesn't leave the console overlay up
+        renderer.start()
+        try:
+            if cached_response is not None:
+                feed(cached_response)
+                cached_response = None  # now in the buffer
+                renderer.write("(cached response)")
+            else:
+                chunk_count = 0
+                start_time = time.monotonic()
+                stream = self.stream_prompt(prompt_text, use_json_schema=json_schema is not None, system_prompt=system_prompt, json_schema=json_schema)
+                with usage_tracker.request() as usage:
+                    try:
+                        async for text in stream:
+                            if not chunk_count:
+                                self._record_ttft(time.monotonic() - start_time)
+                            chunk_count += 1
+                            feed(text)
+                            renderer.write(text)
+                    except BaseException as e:
+
+                        # Aborted requests never receive the final usage chunk; the tokens were still 
+                        # generated though, so approximate them with one token per streamed chunk
+                        await stream.aclose()
+                        usage.completion_tokens = usage.completion_tokens or chunk_count
+
+                        # The usage is still charged, but a budget it exceeds mustn't hide why the request
+                        # failed (callers decide whether to retry from that) - it's enforced before any retry
+                        try:
+                            self._record_usage(usage, start_time)
+                        except BudgetExceededError as budget_error:
+                            if isinstance(e, BudgetExceededError):
+                                raise
+                            logger.warning(f"{budget_error} (while handling: {e!r})")
+                        raise
+
+                # Only complete streams are cached
+                if Model.cache:
+                    Model.cache.put(cache_key, str(buffer, 'utf-8'), **self._cache_fields(prompt_text, system_prompt, json_schema))
+                self._record_usage(usage, start_time)
+        finally:
+            renderer.finish()
+
+        logger.debug(f"Prompt response complete: {len(buffer)} bytes")
+
+        if json_schema:
+            return Response(buffer, props=Response._extract_json_content(str(buffer, 'utf-8')))
+        return Response(buffer, props=parser.close(), strip_fences=remove_sections)
+
+    def prompt_many(self, prompt_texts: List[str], max_concurrency: int = None) -> List[Response]:
+        """Synchronous wrapper around async_prompt_many."""
+        return run_sync(self.async_prompt_many(prompt_texts, max_concurrency))
+
+    async def async_prompt_many(self, prompt_texts: List[str], max_concurrency: int = None) -> List[Response]:
+        """
+        Send many prompts to the model concurrently, with at most max_concurrency
+        requests in flight at once. Responses are returned in the same order as the prompts.
+        """
+        limit = max_concurrency or self.max_concurrency
+        semaphore = asyncio.Semaphore(limit)
+        logger.debug(f"Prompting model with {len(prompt_texts)} prompts, max_concurrency: {limit}")
+
+        # Streamed output from concurrent prompts would interleave on the console, so don't render it
+        async def bounded_prompt(prompt_text):
+            async with semaphore:
+                return await self.async_prompt(prompt_text, render=False)
+        
+        return await gather_or_cancel(*[bounded_prompt(p) for p in prompt_texts])
+    
+    def _record_usage(self, usage: Usage, start_time: float):
+        """Attribute tokens, cost and latency to the running agent/task/phase (and enforce budgets)."""
+        usage.latency = time.monotonic() - start_time
+        usage.cost = self.calculate_usage_costs(usage.prompt_tokens, usage.completion_tokens)
+        usage_tracker.record(usage, self.model_name)
+
+    def _record_ttft(self, seconds: float):
+        self.ttft_count += 1
+        self.ttft_total += seconds
+        logger.debug(f"Time to first token: {seconds:.3f}s")
+
+    @property
+    def endpoint_id(self) -> str:
+        """Identifies the server this model sends requests to (e.g. for per-endpoint circuit breakers)."""
+        return getattr(self, 'host', None) or f"{type(self).__name__}:{self.model_name}"
+
+    def get_latency_stats(self) -> dict:
+        return {
+            'requests': self.ttft_count,
+            'avg_ttft': self.ttft_total / self.ttft_count if self.ttft_count else None
+        }
+
+    def servers(self) -> List['Model']:
+        """The models that talk to a server directly - just this one, unless it routes to others (see ModelPool)."""
+        return [self]
+
+    def start_prefix_cache_stats(self):
+        """Read the server's prefix cache counters, so that get_prefix_cache_stats reports only what follows."""
+        self._prefix_cache_start = run_sync(self.async_get_prefix_cache_stats())
+        logger.debug(f"Prefix cache stats at start of run for {self.endpoint_id}: {self._prefix_cache_start}")
+
+    def get_prefix_cache_stats(self) -> Union[None, dict]:
+        """
+        Server-side prefix cache statistics since start_prefix_cache_stats. since_start is False if
+        they're the server's totals instead - when it only exposes a hit-rate gauge, or wasn't read
+        at the start (or has restarted since).
+        """
+        stats = run_sync(self.async_get_prefix_cache_stats())
+        start = self._prefix_cache_start
+        if not stats:
+            return None
+        if not start or 'queried_tokens' not in stats or 'queried_tokens' not in start or stats['queried_tokens'] < start['queried_tokens']:
+            return stats | {'since_start': False}
+        queried = stats['queried_tokens'] - start['queried_tokens']
+        hits = stats['hit_tokens'] - start['hit_tokens']
+        return {'queried_tokens': queried, 'hit_tokens': hits, 'hit_rate': hits / queried if queried else None, 'since_start': True}
+
+    async def async_health_check(self) -> bool:
+        """Whether the model endpoint is reachable. Overridden by model-specific child class."""
+        return True
+
+    async def async_get_prefix_cache_stats(self) -> Union[None, dict]:
+        """Server-side prefix cache statistics (totals since the server started), where the provider exposes them. Overridden by model-specific child class."""
+        return None
+
+    def _cache_fields(self, prompt_text: str, system_prompt: str, json_schema: type[BaseModel] = None) -> dict:
+        """Everything that determines the model's response to a prompt."""
+        json_schema = json_schema or self.json_schema
+        return {
+            'provider': type(self).__name__,
+            'model_name': self.model_name,
+            'system_prompt': system_prompt,
+            'json_schema': json.dumps(get_json_schema(json_schema), sort_keys=True) if json_schema else None,
+            'prompt': prompt_text,
+            'sampling_params': self.sampling_params
+        }
     
-    def prompt_sync(self, prompt_text: str) -> Iterator[str]:
-        """Send a prompt to the model and return the complete response. Overridden by model-specific child class."""
-        yield "This method should be overridden by a model-specific child class!"
+    @abstractmethod
+    def stream_prompt(self, prompt_text: str, use_json_schema: bool = False, system_prompt: str = None, json_schema: type[BaseModel] = None) -> AsyncGenerator[str, None]:
+        """Stream the response to a prompt from the model. Overridden by model-specific child class."""
+        pass
     
     def calculate_usage_costs(self, prompt_tokens: int, completion_tokens: int):
         """Calculate and track API usage costs."""
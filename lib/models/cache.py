@@ -0,0 +1,162 @@
+import logging
+logger = logging.getLogger(__name__)
+logger.propagate = True
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from typing import Any, Dict, Set, Union
+
+
+# Persistent, content-addressed cache of raw model responses
+class ResponseCache:
+    """
+    Entries are only served to later runs: a response cached by this process is never returned
+    to it, so calling code that repeats a prompt within a run (e.g. to retry) gets a new sample.
+    """
+
+    def __init__(
+            self,
+            path: str = '.cache/responses',
+            max_bytes: int = 512 * 1024 * 1024,
+            max_age: Union[None, float] = 30 * 24 * 60 * 60,
+            read_only: bool = False
+    ):
+        logger.debug(f"Initializing ResponseCache with path: {path}, max_bytes: {max_bytes}, max_age: {max_age}, read_only: {read_only}")
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.read_only = read_only
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        # Keys written by this process, which aren't served back to it
+        self._written: Set[str] = set()
+        os.makedirs(self.path, exist_ok=True)
+        self._total_bytes = sum(os.path.getsize(p) for p in self._entries())
+        self.evict()
+        logger.debug(f"ResponseCache initialized with {self._total_bytes} bytes on disk")
+
+    @staticmethod
+    def make_key(**fields: Any) -> str:
+        """Hash the fields that fully determine a model response into a cache key."""
+        encoded = json.dumps(fields, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Union[None, str]:
+        """Return the cached response text for a key, or None on a miss (including entries written by this run)."""
+        if key in self._written:
+            logger.debug(f"Cache entry written by this run, not serving: {key}")
+            self._record(hit=False)
+            return None
+        file_path = self._file_path(key)
+        try:
+            with open(file_path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            self._record(hit=False)
+            return None
+
+        # Expired entries are treated as misses and dropped (unless read-only)
+        if self.max_age is not None and time.time() - entry['created'] > self.max_age:
+            logger.debug(f"Cache entry expired: {key}")
+            if not self.read_only:
+                self._remove(file_path)
+            self._record(hit=False)
+            return None
+
+        # Touch the entry so that size-based eviction drops least recently used entries first
+        if not self.read_only:
+            try:
+                os.utime(file_path)
+            except OSError:
+                pass
+        self._record(hit=True)
+        logger.debug(f"Cache hit: {key}")
+        return entry['response']
+
+    def put(self, key: str, response: str, **fields: Any):
+        """Store a response under a key. Does nothing in read-only mode."""
+        if self.read_only:
+            return
+        with self._lock:
+            self._written.add(key)
+        file_path = self._file_path(key)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        entry = {
+            'created': time.time(),
+            'fields': fields,
+            'response': response
+        }
+
+        # Write atomically so that a crash mid-write never leaves a corrupt entry behind
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(file_path), suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(entry, f)
+        with self._lock:
+            if os.path.exists(file_path):
+                self._total_bytes -= os.path.getsize(file_path)
+            os.replace(tmp_path, file_path)
+            self._total_bytes += os.path.getsize(file_path)
+        logger.debug(f"Cached response: {key}")
+
+        # Expired entries are otherwise dropped lazily on read, so only sweep when over budget
+        if self._total_bytes > self.max_bytes:
+            self.evict()
+
+    def evict(self):
+        """Drop entries unused for longer than max_age, then least recently used entries until under max_bytes."""
+        if self.read_only:
+            return
+        with self._lock:
+            now = time.time()
+            entries = []
+            for file_path in self._entries():
+                try:
+                    stat = os.stat(file_path)
+                except OSError:
+                    continue
+                if self.max_age is not None and now - stat.st_mtime > self.max_age:
+                    self._total_bytes -= stat.st_size
+                    self._remove(file_path)
+                else:
+                    entries.append((stat.st_mtime, stat.st_size, file_path))
+            entries.sort()
+            while self._total_bytes > self.max_bytes and entries:
+                _, size, file_path = entries.pop(0)
+                self._total_bytes -= size
+                self._remove(file_path)
+                logger.debug(f"Evicted cache entry: {file_path}")
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'bytes': self._total_bytes
+        }
+
+    def _record(self, hit: bool):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def _file_path(self, key: str) -> str:
+        return os.path.join(self.path, key[:2], f"{key}.json")
+
+    def _entries(self):
+        for root, _, files in os.walk(self.path):
+            for name in files:
+                if name.endswith('.json'):
+                    yield os.path.join(root, name)
+
+    @staticmethod
+    def _remove(file_path: str):
+        try:
+            os.remove(file_path)
+        except OSError:
+            pass
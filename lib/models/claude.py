@@ -1,18 +1,21 @@
 import logging
 logger = logging.getLogger(__name__)
 logger.propagate = True
-from anthropic import Anthropic
+from anthropic import AsyncAnthropic
 import os
 from typing import AsyncGenerator
+from pydantic import BaseModel
 from .base import Model, Response
+from lib.usage import usage_tracker
 
 class Claude(Model):
 
     def __init__(self, model_name: str = "claude-3-sonnet-20240229"):
         logger.debug(f"Initializing Claude instance with model_name: {model_name}")
         super().__init__()
-        self.client = Anthropic()
+        self.client = AsyncAnthropic()
         self.model_name = model_name
+        self.sampling_params = {'max_tokens': 4096}
         
         # Set API costs based on model
         if "claude-3" in model_name:
@@ -22,39 +25,42 @@ class Claude(Model):
             }
         logger.debug(f"Claude instance initialized with api_costs: {self.api_costs}")
     
-    async def prompt(self, prompt_text: str, use_json_schema: bool = False, ) -> str:
-        """Send a prompt to Claude and return the complete response."""
-        logger.debug(f"Prompting Claude with text: {prompt_text}, use_json_schema: {use_json_schema}")
-        full_response = ""
-        async for chunk in self.stream_prompt(prompt_text, use_json_schema):
-            print(f"{chunk} ", end="")
-            full_response += chunk
-        logger.debug(f"Claude response: {full_response}")
-        return Response(full_response)
-
-    async def stream_prompt(self, prompt_text: str, use_json_schema: bool = False) -> AsyncGenerator[str, None]:
+    async def stream_prompt(self, prompt_text: str, use_json_schema: bool = False, system_prompt: str = None, json_schema: type[BaseModel] = None) -> AsyncGenerator[str, None]:
         """Stream responses from Claude."""
         logger.debug(f"Streaming prompt to Claude with text: {prompt_text}, use_json_schema: {use_json_schema}")
-        # Add system prompt if set
-        if self.system_prompt:
-            prompt_text = f"{self.system_prompt}\n\n{prompt_text}"
-        
+        system_prompt = system_prompt or self.system_prompt
         # Add JSON schema if requested
-        if use_json_schema and self.json_schema:
-            prompt_text = f"{prompt_text}\n\nPlease format your response according to this JSON schema:\n{self.json_schema.schema_json()}"
+        json_schema = json_schema or self.json_schema
+        if use_json_schema and json_schema:
+            prompt_text = f"{prompt_text}\n\nPlease format your response according to this JSON schema:\n{json_schema.schema_json()}"
         
-        stream = await self.client.messages.create(
-            model=self.model_name,
-            max_tokens=4096,
-            messages=[{"role": "user", "content": prompt_text}],
-            stream=True
-        )
-        logger.debug(f"Claude stream created: {stream}")
-        
-        async for chunk in stream:
-            if chunk.content:
-                yield chunk.content[0].text
-        logger.debug(f"Claude stream completed")
+        # Anthropic takes the system prompt as a separate parameter rather than a message
+        kwargs = {}
+        if system_prompt:
+            kwargs['system'] = system_prompt
+
+        try:
+            stream = await self.client.messages.create(
+                model=self.model_name,
+                messages=[{"role": "user", "content": prompt_text}],
+                stream=True,
+                **self.sampling_params,
+                **kwargs
+            )
+            logger.debug(f"Claude stream created: {stream}")
+            
+            # Closing the stream (e.g. when the caller aborts early) cancels the request on the server
+            async with stream:
+                async for event in stream:
+                    if event.type == "content_block_delta" and event.delta.type == "text_delta":
+                        yield event.delta.text
 
-        # Note: Usage information is not available in streaming mode
-        # We might need to implement token counting separately if needed
+                    # Input tokens are reported when the message starts, output tokens as it completes
+                    elif event.type == "message_start":
+                        usage_tracker.report_tokens(event.message.usage.input_tokens, event.message.usage.output_tokens)
+                    elif event.type == "message_delta":
+                        usage_tracker.report_tokens(completion_tokens=event.usage.output_tokens)
+            logger.debug(f"Claude stream completed")
+        except Exception as e:
+            logger.error(f"Error during Claude API call: {e}")
+            raise
@@ -4,7 +4,9 @@ logger.propagate = True
 import google.generativeai as genai
 import os
 from typing import AsyncGenerator
+from pydantic import BaseModel
 from .base import Model, Response
+from lib.usage import usage_tracker
 
 class Gemini(Model):
 
@@ -22,33 +24,38 @@ class Gemini(Model):
         }
         logger.debug(f"Gemini instance initialized with api_costs: {self.api_costs}")
     
-    async def prompt(self, prompt_text: str, use_json_schema: bool = False) -> str:
-        """Send a prompt to Gemini and return the complete response."""
-        logger.debug(f"Prompting Gemini with text: {prompt_text}, use_json_schema: {use_json_schema}")
-        full_response = ""
-        async for chunk in self.stream_prompt(prompt_text, use_json_schema):
-            full_response += chunk
-        logger.debug(f"Gemini response: {full_response}")
-        return Response(full_response)
-
-    async def stream_prompt(self, prompt_text: str, use_json_schema: bool = False) -> AsyncGenerator[str, None]:
+    async def stream_prompt(self, prompt_text: str, use_json_schema: bool = False, system_prompt: str = None, json_schema: type[BaseModel] = None) -> AsyncGenerator[str, None]:
         """Stream responses from Gemini."""
         logger.debug(f"Streaming prompt to Gemini with text: {prompt_text}, use_json_schema: {use_json_schema}")
+        system_prompt = system_prompt or self.system_prompt
         # Add system prompt if set
-        if self.system_prompt:
-            prompt_text = f"{self.system_prompt}\n\n{prompt_text}"
+        if system_prompt:
+            prompt_text = f"{system_prompt}\n\n{prompt_text}"
         
         # Add JSON schema if requested
-        if use_json_schema and self.json_schema:
-            prompt_text = f"{prompt_text}\n\nPlease format your response according to this JSON schema:\n{self.json_schema.schema_json()}"
+        json_schema = json_schema or self.json_schema
+        if use_json_schema and json_schema:
+            prompt_text = f"{prompt_text}\n\nPlease format your response according to this JSON schema:\n{json_schema.schema_json()}"
         
-        response = await self.model.generate_content(
-            prompt_text,
-            stream=True
-        )
-        logger.debug(f"Gemini stream created: {response}")
+        try:
+            response = await self.model.generate_content_async(
+                prompt_text,
+                stream=True,
+                generation_config=self.sampling_params or None
+            )
+            logger.debug(f"Gemini stream created: {response}")
+
+            async for chunk in response:
+                if chunk.text:
+                    yield chunk.text
 
-        async for chunk in response:
-            if chunk.text:
-                yield chunk.text
-        logger.debug(f"Gemini stream completed")
+                # Usage metadata is cumulative, so the last chunk's counts are the totals
+                if chunk.usage_metadata:
+                    usage_tracker.report_tokens(
+                        chunk.usage_metadata.prompt_token_count,
+                        chunk.usage_metadata.candidates_token_count
+                    )
+            logger.debug(f"Gemini stream completed")
+        except Exception as e:
+            logger.error(f"Error during Gemini API call: {e}")
+            raise
@@ -1,16 +1,18 @@
 import logging
 logger = logging.getLogger(__name__)
 logger.propagate = True
-from openai import OpenAI
+from openai import AsyncOpenAI
 import os
 from typing import AsyncGenerator
+from pydantic import BaseModel
 from .base import Model, Response
+from lib.usage import usage_tracker
 
 class GPT(Model):
     def __init__(self, model_name: str = "gpt-4"):
         logger.debug(f"Initializing GPT model with model_name: {model_name}")
         super().__init__()
-        self.client = OpenAI()
+        self.client = AsyncOpenAI()
         self.model_name = model_name
         
         # Set API costs based on model
@@ -26,28 +28,21 @@ class GPT(Model):
             }
         logger.debug(f"GPT model initialized with model_name: {model_name}, api_costs: {self.api_costs}")
     
-    async def prompt(self, prompt_text: str, use_json_schema: bool = False) -> str:
-        """Send a prompt to GPT and return the complete response."""
-        logger.debug(f"Starting prompt with prompt_text: {prompt_text}, use_json_schema: {use_json_schema}")
-        full_response = ""
-        async for chunk in self.stream_prompt(prompt_text, use_json_schema):
-            full_response += chunk
-        logger.debug(f"Finished prompt with full_response: {full_response}")
-        return Response(full_response)
-
-    async def stream_prompt(self, prompt_text: str, use_json_schema: bool = False) -> AsyncGenerator[str, None]:
+    async def stream_prompt(self, prompt_text: str, use_json_schema: bool = False, system_prompt: str = None, json_schema: type[BaseModel] = None) -> AsyncGenerator[str, None]:
         """Stream responses from GPT."""
         logger.debug(f"Starting stream_prompt with prompt_text: {prompt_text}, use_json_schema: {use_json_schema}")
+        system_prompt = system_prompt or self.system_prompt
         messages = []
         
         # Add system prompt if set
-        if self.system_prompt:
-            messages.append({"role": "system", "content": self.system_prompt})
-            logger.debug(f"Added system prompt: {self.system_prompt}")
+        if system_prompt:
+            messages.append({"role": "system", "content": system_prompt})
+            logger.debug(f"Added system prompt: {system_prompt}")
         
         # Add JSON schema if requested
-        if use_json_schema and self.json_schema:
-            prompt_text = f"{prompt_text}\n\nPlease format your response according to this JSON schema:\n{self.json_schema.schema_json()}"
+        json_schema = json_schema or self.json_schema
+        if use_json_schema and json_schema:
+            prompt_text = f"{prompt_text}\n\nPlease format your response according to this JSON schema:\n{json_schema.schema_json()}"
             logger.debug(f"Added JSON schema to prompt_text: {prompt_text}")
         
         messages.append({"role": "user", "content": prompt_text})
@@ -57,16 +52,21 @@ class GPT(Model):
             stream = await self.client.chat.completions.create(
                 model=self.model_name,
                 messages=messages,
-                stream=True
+                stream=True,
+                stream_options={'include_usage': True},
+                **self.sampling_params
             )
             
-            async for chunk in stream:
-                if chunk.choices[0].delta.content is not None:
-                    yield chunk.choices[0].delta.content
+            # Closing the stream (e.g. when the caller aborts early) cancels the request on the server
+            async with stream:
+                async for chunk in stream:
+                    if chunk.choices and chunk.choices[0].delta.content is not None:
+                        yield chunk.choices[0].delta.content
+
+                    # Token usage arrives on a final chunk with no choices
+                    if chunk.usage:
+                        usage_tracker.report_tokens(chunk.usage.prompt_tokens, chunk.usage.completion_tokens)
             logger.debug("Finished streaming from GPT")
         except Exception as e:
             logger.error(f"Error during GPT API call: {e}")
             raise
-        
-        # Note: Usage information is not available in streaming mode
-        # We might need to implement token counting separately if needed
@@ -1,14 +1,23 @@
 import logging
 logger = logging.getLogger(__name__)
 logger.propagate = True
-from ollama import Client
-from .base import Model, Response
+from typing import AsyncGenerator
+import httpx
+from ollama import AsyncClient
+from pydantic import BaseModel
+from .base import Model, Response, get_json_schema
+from lib.usage import usage_tracker
 
 class Ollama(Model):
-    def __init__(self, model_name: str = "qwen2.5-coder:32b-instruct-q4_K_M"):
-        logger.debug(f"Initializing Ollama model with model_name: {model_name}")
+
+    # Supports constrained decoding against a JSON schema
+    structured_output: bool = True
+
+    def __init__(self, model_name: str = "qwen2.5-coder:32b-instruct-q4_K_M", host: str = 'http://10.243.243.236:11434'):
+        logger.debug(f"Initializing Ollama model with model_name: {model_name}, host: {host}")
         super().__init__()
-        self.client = Client(host='http://10.243.243.236:11434')
+        self.host = host
+        self.client = AsyncClient(host=host)
         self.model_name = model_name
         
         # Set API costs - Ollama is typically free/local so setting to 0
@@ -18,41 +27,58 @@ class Ollama(Model):
         }
         logger.debug(f"Ollama model initialized with model_name: {model_name}, api_costs: {self.api_costs}")
     
-    def prompt(self, prompt_text: str, use_json_schema: bool = False) -> str:
-        """Send a prompt to Ollama and return the complete response."""
+    async def stream_prompt(self, prompt_text: str, use_json_schema: bool = False, system_prompt: str = None, json_schema: type[BaseModel] = None) -> AsyncGenerator[str, None]:
+        """Stream responses from Ollama."""
         logger.debug(f"Starting prompt with prompt_text: {prompt_text}, use_json_schema: {use_json_schema}")
-        full_response = ""
+        system_prompt = system_prompt or self.system_prompt
         messages = []
         
         # Add system prompt if set
-        if self.system_prompt:
-            messages.append({"role": "system", "content": self.system_prompt})
-            logger.debug(f"Added system prompt: {self.system_prompt}")
+        if system_prompt:
+            messages.append({"role": "system", "content": system_prompt})
+            logger.debug(f"Added system prompt: {system_prompt}")
         
-        # Add JSON schema if requested
-        if use_json_schema and self.json_schema:
-            prompt_text = f"{prompt_text}\n\nPlease format your response according to this JSON schema:\n{self.json_schema.schema_json()}"
-            logger.debug(f"Added JSON schema to prompt_text: {prompt_text}")
+        # Constrained decoding - the server only samples tokens that keep the output valid against the schema
+        json_schema = json_schema or self.json_schema
+        output_format = None
+        if use_json_schema and json_schema:
+            output_format = get_json_schema(json_schema)
+            logger.debug(f"Using structured output with JSON schema: {json_schema.__name__}")
         
         messages.append({"role": "user", "content": prompt_text})
         logger.debug(f"Sending messages to Ollama: {messages}")
         
         # Stream the response from Ollama
         try:
-            stream = self.client.chat(
+            stream = await self.client.chat(
                 model=self.model_name,
                 messages=messages,
-                stream=True
+                stream=True,
+                format=output_format,
+                options=self.sampling_params or None
             )
 
-            for chunk in stream:
-                if chunk['message']['content'] is not None:
-                    text = chunk['message']['content']
-                    print(text, end="")
-                    full_response += text
-            logger.debug(f"Finished prompt with full_response: {full_response}")
+            # Closing the stream (e.g. when the caller aborts early) cancels the request on the server
+            try:
+                async for chunk in stream:
+                    if chunk['message']['content'] is not None:
+                        yield chunk['message']['content']
+
+                    # Eval counts are only included on the final chunk
+                    if chunk.get('done'):
+                        usage_tracker.report_tokens(chunk.get('prompt_eval_count'), chunk.get('eval_count'))
+            finally:
+                await stream.aclose()
+            logger.debug(f"Finished streaming from Ollama")
         except Exception as e:
             logger.error(f"Error during Ollama API call: {e}")
             raise
 
-        return Response(full_response)
+    async def async_health_check(self) -> bool:
+        try:
+            async with httpx.AsyncClient(timeout=5) as client:
+                resp = await client.get(self.host.rstrip('/') + '/api/tags')
+            return resp.status_code == 200
+        except httpx.HTTPError as e:
+            logger.debug(f"Ollama health check failed for {self.host}: {e}")
+            return False
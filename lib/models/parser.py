@@ -0,0 +1,242 @@
+import logging
+logger = logging.getLogger(__name__)
+logger.propagate = True
+import re
+from collections.abc import MutableMapping, Sequence
+from typing import Any, BinaryIO, Callable, Dict, Iterator, List, Set, Tuple, Union
+
+# Matches a complete opening or closing tag, e.g. <file> or </file>
+TAG_PATTERN = re.compile(rb'<(/?)(\w+)>')
+
+# Matches a possibly incomplete tag at the very end of the buffer, e.g. "<fi" or "</"
+PARTIAL_TAG_PATTERN = re.compile(rb'</?\w*\Z')
+
+# Markdown code fences that models like to wrap code in
+FENCE_PATTERN = re.compile(rb'\`\`\`[a-zA-Z0-9]*')
+
+
+# The text of a leaf element: one or more (start, end) byte ranges of the response buffer 
+# (several if code fences were stripped out of it). Nothing is copied until it is accessed
+class Span:
+
+    __slots__ = ('buffer', 'pieces')
+
+    def __init__(self, buffer: bytearray, pieces: List[Tuple[int, int]]):
+        self.buffer = buffer
+        self.pieces = pieces
+
+    def __len__(self) -> int:
+        return sum(end - start for start, end in self.pieces)
+
+    def text(self) -> str:
+        """Decode the span straight out of the buffer."""
+        with memoryview(self.buffer) as view:
+            return "".join(str(view[start:end], 'utf-8') for start, end in self.pieces)
+
+    def views(self) -> List[memoryview]:
+        """
+        The span's (UTF-8) bytes as memoryviews of the buffer, e.g. to hash or write them without copying.
+        Only for complete responses - the buffer can't grow while views of it exist.
+        """
+        view = memoryview(self.buffer)
+        return [view[start:end] for start, end in self.pieces]
+
+    def write_to(self, f: BinaryIO):
+        """Write the span's (UTF-8) bytes to a binary file, without copying them out of the buffer first."""
+        for piece in self.views():
+            f.write(piece)
+
+
+# The child elements of a parsed element, by tag. Leaf values are Spans of the response
+# buffer, decoded each time they are accessed; assigned values are stored as they are
+class ElementDict(MutableMapping):
+
+    __slots__ = ('_fields',)
+
+    def __init__(self, fields: Dict[str, Any]):
+        self._fields = fields
+
+    def __getitem__(self, key: str) -> Any:
+        value = self._fields[key]
+        return value.text() if type(value) is Span else value
+
+    def __setitem__(self, key: str, value: Any):
+        self._fields[key] = value
+
+    def __delitem__(self, key: str):
+        del self._fields[key]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._fields)
+
+    def __len__(self) -> int:
+        return len(self._fields)
+
+    def __repr__(self) -> str:
+        return repr(self.to_dict())
+
+    def span(self, key: str) -> Union[None, Span]:
+        """The unread Span of a leaf value (e.g. to write it to a file directly), or None if it isn't one."""
+        value = self._fields.get(key)
+        return value if type(value) is Span else None
+
+    def to_dict(self) -> dict:
+        """Materialize into plain (nested) dicts of strings."""
+        return {
+            key: value.to_dict() if isinstance(value, ElementDict) else self[key]
+            for key, value in self._fields.items()
+        }
+
+
+def json_default(value: Any) -> Any:
+    """Use as json.dump(s)' default= to serialize parsed elements (and lazy sequences of items, e.g. lib.state.Rows)."""
+    if isinstance(value, ElementDict):
+        return value.to_dict()
+    if isinstance(value, Sequence):
+        return list(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+# An element that has been opened but not yet closed
+class _Frame:
+
+    __slots__ = ('raw_name', 'name', 'children', 'start')
+
+    def __init__(self, raw_name: str, name: str, start: int):
+        self.raw_name = raw_name
+        self.name = name
+
+        # (tag, value) pairs of completed child elements - kept in order, with repeats, since the
+        # children of an element that is never closed are promoted to its parent
+        self.children: List[Tuple[str, Any]] = []
+
+        # Offset of the element's content within the buffer
+        self.start = start
+
+
+# Push-based parser for XML-style tagged content in streamed LLM/model responses
+class StreamParser:
+    """
+    Incrementally parses tagged content as it is streamed from the model, in a single
+    linear pass with a stack of open tags. Produces a dict mapping each top-level tag to a
+    list of values, where a value is either an ElementDict of child tags or (for elements
+    without child tags) the element's raw text. The response is kept once, as UTF-8 in
+    buffer, and child values are Spans of it - decoded only when accessed. If tags is given,
+    only those tag names are recognized - any other tag (e.g. HTML inside generated file
+    content) is treated as text. Tag names are ASCII.
+    """
+
+    def __init__(
+            self,
+            on_element: Union[None, Callable[[str, Any], None]] = None,
+            strip_fences: bool = False,
+            on_open: Union[None, Callable[[str], None]] = None,
+            tags: Union[None, Set[str]] = None
+    ):
+        self.on_element = on_element
+        self.on_open = on_open
+        self.strip_fences = strip_fences
+        self.tags = tags
+        self.results: Dict[str, List[Any]] = {}
+        self._stack: List[_Frame] = []
+
+        # The whole response so far
+        self.buffer = bytearray()
+
+        # Where the next scan starts: the end of the buffer, or a partial tag held back at its end
+        self._scan_from = 0
+
+    def feed(self, chunk: str) -> List[Tuple[str, Any]]:
+        """Feed the next chunk of the response. Returns top-level elements completed by this chunk."""
+        completed = []
+        if not chunk:
+            return completed
+        self.buffer += chunk.encode('utf-8')
+        self._scan(completed)
+        return completed
+
+    def close(self) -> Union[None, Dict[str, List[Any]]]:
+        """Signal the end of the stream and return the parsed props (None if no tagged content)."""
+
+        # Unclosed elements are just text, but any complete elements inside them still count
+        while self._stack:
+            frame = self._stack.pop()
+            if self._stack:
+                self._stack[-1].children.extend(frame.children)
+            else:
+                for name, value in frame.children:
+                    self._emit(name, value, [])
+        return self.results if self.results else None
+
+    def _scan(self, completed: List[Tuple[str, Any]]):
+        pos = self._scan_from
+        for match in TAG_PATTERN.finditer(self.buffer, pos):
+            self._tag(match.group(1), match.group(2), match.start(), match.end(), completed)
+            pos = match.end()
+
+        # Hold back a trailing partial tag until the next chunk completes it (or shows it isn't one)
+        partial = PARTIAL_TAG_PATTERN.search(self.buffer, pos)
+        self._scan_from = partial.start() if partial else len(self.buffer)
+
+    def _tag(self, closing: bytes, raw_name: bytes, tag_start: int, tag_end: int, completed: List[Tuple[str, Any]]):
+        raw_name = raw_name.decode('ascii')
+        name = raw_name.lower()
+        if self.tags is not None and name not in self.tags:
+            return
+        if closing:
+            self._close_tag(raw_name, tag_start, completed)
+        else:
+            self._open_tag(raw_name, name, tag_end)
+
+    def _open_tag(self, raw_name: str, name: str, content_start: int):
+        if not self._stack and self.on_open:
+            self.on_open(name)
+        self._stack.append(_Frame(raw_name, name, content_start))
+
+    def _close_tag(self, raw_name: str, content_end: int, completed: List[Tuple[str, Any]]):
+
+        # Find the matching open element - a stray closing tag is just text
+        for i in range(len(self._stack) - 1, -1, -1):
+            if self._stack[i].raw_name == raw_name:
+                break
+        else:
+            return
+
+        # Any elements left open inside this one were never closed; keep their complete children
+        frame = self._stack[i]
+        for unclosed in self._stack[i + 1:]:
+            frame.children.extend(unclosed.children)
+        del self._stack[i:]
+
+        # Repeated child tags are not lists - the last one wins
+        if frame.children:
+            value = ElementDict(dict(frame.children))
+        else:
+            value = self._span(frame.start, content_end)
+
+        if self._stack:
+            self._stack[-1].children.append((frame.name, value))
+        else:
+            self._emit(frame.name, value, completed)
+
+    def _span(self, start: int, end: int) -> Span:
+        """The buffer between two offsets, minus any code fences if they are being stripped."""
+        pieces = []
+        if self.strip_fences:
+            for fence in FENCE_PATTERN.finditer(self.buffer, start, end):
+                if fence.start() > start:
+                    pieces.append((start, fence.start()))
+                start = fence.end()
+        if end > start or not pieces:
+            pieces.append((start, end))
+        return Span(self.buffer, pieces)
+
+    # Top-level leaf values are decoded here, so props only ever hold strings and ElementDicts
+    def _emit(self, name: str, value: Any, completed: List[Tuple[str, Any]]):
+        if type(value) is Span:
+            value = value.text()
+        self.results.setdefault(name, []).append(value)
+        completed.append((name, value))
+        logger.debug(f"Completed top-level element: {name}")
+        if self.on_element:
+            self.on_element(name, value)
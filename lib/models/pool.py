@@ -0,0 +1,180 @@
+import logging
+logger = logging.getLogger(__name__)
+logger.propagate = True
+import asyncio
+import copy
+import time
+from typing import AsyncGenerator, Dict, List, Union
+from pydantic import BaseModel
+from .base import Model
+
+
+# Routing state for one endpoint in the pool
+class _Endpoint:
+
+    def __init__(self, model: Model):
+        self.model = model
+        self.outstanding = 0
+        self.ttft: Union[None, float] = None
+        self.failures = 0
+        self.ejected_until: Union[None, float] = None
+
+    @property
+    def name(self):
+        return getattr(self.model, 'host', None) or self.model.model_name
+
+    def score(self, default_ttft: float) -> float:
+        """Lower is better - expected wait given the current queue depth and recent TTFT."""
+        return (self.outstanding + 1) * (self.ttft if self.ttft is not None else default_ttft)
+
+
+# Routes requests across several equivalent model endpoints (e.g. a set of VLLM/Ollama hosts)
+class ModelPool(Model):
+    """
+    Dispatches each request to the least loaded healthy endpoint, ejecting endpoints
+    that fail repeatedly and re-admitting them once a health check passes. Use bind()
+    to get a per-agent view of the pool that sticks to one endpoint while it is healthy
+    and not overloaded, so the server's prefix cache for that agent stays warm.
+    """
+
+    def __init__(
+            self,
+            endpoints: List[Model],
+            max_failures: int = 3,
+            cooldown: float = 30.0,
+            affinity_slack: int = 2,
+            ttft_smoothing: float = 0.3
+    ):
+        logger.debug(f"Initializing ModelPool with endpoints: {[e.model_name for e in endpoints]}")
+        super().__init__()
+        if not endpoints:
+            raise ValueError("ModelPool requires at least one endpoint")
+        self.model_name = endpoints[0].model_name
+        self.sampling_params = endpoints[0].sampling_params
+        self.api_costs = endpoints[0].api_costs
+        self.max_concurrency = sum(e.max_concurrency for e in endpoints)
+        self.structured_output = all(e.structured_output for e in endpoints)
+        self.max_failures = max_failures
+        self.cooldown = cooldown
+        self.affinity_slack = affinity_slack
+        self.ttft_smoothing = ttft_smoothing
+        self.affinity: Union[None, str] = None
+
+        # Shared between the pool and all of its bound views
+        self._endpoints = [_Endpoint(model) for model in endpoints]
+        self._assignments: Dict[str, _Endpoint] = {}
+        logger.debug(f"ModelPool initialized with {len(self._endpoints)} endpoints")
+
+    def bind(self, affinity: str) -> 'ModelPool':
+        """Return a view of this pool whose requests prefer the same endpoint (e.g. one per Agent)."""
+        bound = copy.copy(self)
+        bound.affinity = affinity
+        bound.ttft_count = 0
+        bound.ttft_total = 0.0
+        Model.instances.append(bound)
+        return bound
+
+    async def stream_prompt(self, prompt_text: str, use_json_schema: bool = False, system_prompt: str = None, json_schema: type[BaseModel] = None) -> AsyncGenerator[str, None]:
+        """Stream the response from the best available endpoint, failing over if it errors before producing output."""
+        system_prompt = system_prompt or self.system_prompt
+        tried = set()
+        while True:
+            endpoint = await self._select(exclude=tried)
+            if endpoint is None:
+                raise ConnectionError(f"No healthy endpoints available in ModelPool for {self.model_name}")
+            tried.add(endpoint)
+            logger.debug(f"Routing request to endpoint: {endpoint.name} (affinity: {self.affinity})")
+
+            endpoint.outstanding += 1
+            start_time = time.monotonic()
+            started = False
+            stream = endpoint.model.stream_prompt(prompt_text, use_json_schema, system_prompt=system_prompt, json_schema=json_schema or self.json_schema)
+            try:
+                async for text in stream:
+                    if not started:
+                        started = True
+                        self._update_ttft(endpoint, time.monotonic() - start_time)
+                    yield text
+                endpoint.failures = 0
+                return
+            except Exception as e:
+
+                # Only connection and server errors say anything about the endpoint's health - an
+                # invalid request would fail on any endpoint, so is neither counted nor failed over
+                # (lib.retry imports lib.task, which imports this package, hence the late import)
+                from lib.retry import RetryPolicy
+                if RetryPolicy.classify(e) != 'transport':
+                    raise
+                self._record_failure(endpoint, e)
+
+                # Output already streamed to the caller can't be taken back, so only fail over before the first token
+                if started:
+                    raise
+                logger.warning(f"Endpoint {endpoint.name} failed before responding; failing over: {e}")
+            finally:
+                await stream.aclose()
+                endpoint.outstanding -= 1
+
+    async def async_health_check(self) -> bool:
+        results = await asyncio.gather(*[e.model.async_health_check() for e in self._endpoints])
+        return any(results)
+
+    def servers(self) -> List[Model]:
+        return [endpoint.model for endpoint in self._endpoints]
+
+    async def async_get_prefix_cache_stats(self) -> Union[None, dict]:
+        """Combine prefix cache counters across all endpoints that expose them."""
+        stats = [s for s in await asyncio.gather(*[e.model.async_get_prefix_cache_stats() for e in self._endpoints]) if s]
+        if not stats:
+            return None
+        queried = sum(s.get('queried_tokens', 0.0) for s in stats)
+        hits = sum(s.get('hit_tokens', 0.0) for s in stats)
+        if queried:
+            return {'queried_tokens': queried, 'hit_tokens': hits, 'hit_rate': hits / queried}
+        return {'hit_rate': sum(s['hit_rate'] for s in stats) / len(stats)}
+
+    async def _select(self, exclude: set) -> Union[None, _Endpoint]:
+        now = time.monotonic()
+        candidates = []
+        for endpoint in self._endpoints:
+            if endpoint in exclude:
+                continue
+
+            # Re-admit ejected endpoints once their cooldown has passed and they pass a health check
+            if endpoint.ejected_until is not None:
+                if now < endpoint.ejected_until:
+                    continue
+                if await endpoint.model.async_health_check():
+                    logger.info(f"Re-admitting endpoint to pool: {endpoint.name}")
+                    endpoint.ejected_until = None
+                    endpoint.failures = 0
+                else:
+                    endpoint.ejected_until = now + self.cooldown
+                    continue
+            candidates.append(endpoint)
+        if not candidates:
+            return None
+
+        known_ttfts = [e.ttft for e in candidates if e.ttft is not None]
+        default_ttft = sum(known_ttfts) / len(known_ttfts) if known_ttfts else 1.0
+        best = min(candidates, key=lambda e: e.score(default_ttft))
+
+        # Stay on the assigned endpoint unless it is notably busier than the least loaded one
+        if self.affinity is not None:
+            assigned = self._assignments.get(self.affinity)
+            if assigned in candidates and assigned.outstanding <= best.outstanding + self.affinity_slack:
+                return assigned
+            self._assignments[self.affinity] = best
+        return best
+
+    def _update_ttft(self, endpoint: _Endpoint, seconds: float):
+        if endpoint.ttft is None:
+            endpoint.ttft = seconds
+        else:
+            endpoint.ttft += self.ttft_smoothing * (seconds - endpoint.ttft)
+
+    def _record_failure(self, endpoint: _Endpoint, error: Exception):
+        endpoint.failures += 1
+        if endpoint.failures >= self.max_failures and endpoint.ejected_until is None:
+            endpoint.ejected_until = time.monotonic() + self.cooldown
+            logger.warning(f"Ejecting endpoint from pool after {endpoint.failures} consecutive failures: {endpoint.name} ({error})")
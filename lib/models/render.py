@@ -0,0 +1,94 @@
+import logging
+logger = logging.getLogger(__name__)
+logger.propagate = True
+import time
+from abc import ABC, abstractmethod
+from typing import List
+from rich.console import Console
+from rich.syntax import Syntax
+
+
+# Base class for displaying a model response as it is streamed
+class StreamRenderer(ABC):
+
+    @abstractmethod
+    def start(self):
+        pass
+
+    @abstractmethod
+    def write(self, text: str):
+        pass
+
+    @abstractmethod
+    def finish(self):
+        pass
+
+
+# Headless renderer - discards all output
+class NullRenderer(StreamRenderer):
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def start(self):
+        pass
+
+    def write(self, text: str):
+        pass
+
+    def finish(self):
+        pass
+
+
+# Renders completed lines to the console, batching redraws to at most max_fps per second
+class ConsoleRenderer(StreamRenderer):
+    """
+    Line-buffered renderer: only complete lines are highlighted and printed, and lines are
+    accumulated between redraws so the per-chunk cost is a newline search over the chunk itself.
+    """
+
+    def __init__(
+            self,
+            console: Console = None,
+            max_fps: float = 10,
+            overlay: bool = False,
+            lexer: str = "xml"
+    ):
+        self.console = console or Console()
+        self.min_interval = 1.0 / max_fps if max_fps else 0
+        self.overlay = overlay
+        self.lexer = lexer
+        self._partial_line = ""
+        self._ready: List[str] = []
+        self._last_flush = 0.0
+
+    def start(self):
+        if self.overlay:
+            print("\033[?1049h\033[22;0;0t\033[0;0H", end="")
+        self.console.print("[bold green]=== [Agent]: [/bold green]", end="")
+
+    def write(self, text: str):
+        newline = text.rfind("\n")
+        if newline == -1:
+            self._partial_line += text
+            return
+        self._ready.append(self._partial_line + text[:newline])
+        self._partial_line = text[newline + 1:]
+        now = time.monotonic()
+        if now - self._last_flush >= self.min_interval:
+            self._flush()
+            self._last_flush = now
+
+    def finish(self):
+        if self._partial_line:
+            self._ready.append(self._partial_line)
+            self._partial_line = ""
+        self._flush()
+        if self.overlay:
+            print("\033[?1049l\033[23;0;0t", end="")
+
+    def _flush(self):
+        if not self._ready:
+            return
+        self.console.print(Syntax("\n".join(self._ready), self.lexer))
+        self._ready = []
@@ -2,58 +2,127 @@ import logging
 logger = logging.getLogger(__name__)
 logger.propagate = True
 import sys
+import httpx
 from rich.console import Console
-from openai import OpenAI
+from openai import AsyncOpenAI
 import os
-from typing import AsyncGenerator, Iterator
-from .base import Model, Response
+from typing import AsyncGenerator, Dict, Iterator, Union
+from pydantic import BaseModel
+from .base import Model, Response, get_json_schema
+from lib.usage import usage_tracker
 
 class VLLM(Model):
 
     console = Console()
 
+    # vLLM batches concurrent requests well, so allow more in flight than the default
+    max_concurrency: int = 16
+
+    # Supports constrained decoding against a JSON schema
+    structured_output: bool = True
+
     def __init__(self, model_name: str = "Qwen/Qwen2.5-Coder-14B-Instruct-GPTQ-Int4", host: str = 'http://0.0.0.0:11434/v1'):
         logger.debug(f"Initializing VLLM model with model_name: {model_name}")
         super().__init__()
-        self.client = OpenAI(base_url=host, api_key="sk-xxxxxxxxxxxxxxx")
+        self.host = host
+        self.client = AsyncOpenAI(base_url=host, api_key="sk-xxxxxxxxxxxxxxx")
         self.model_name = model_name
+        self.sampling_params = {'max_tokens': 5000}
         logger.debug(f"VLLM model initialized with model_name: {model_name}")
     
-    def sync_prompt(self, prompt_text: str, use_json_schema: bool = False) -> Iterator[str]:
-        """Send a prompt to Ollama and return the complete response."""
+    async def stream_prompt(self, prompt_text: str, use_json_schema: bool = False, system_prompt: str = None, json_schema: type[BaseModel] = None) -> AsyncGenerator[str, None]:
+        """Stream responses from VLLM."""
         logger.debug(f"Starting prompt with prompt_text: {prompt_text}, use_json_schema: {use_json_schema}")
+        system_prompt = system_prompt or self.system_prompt
         messages = []
         
         # Add system prompt if set
-        if self.system_prompt:
-            messages.append({"role": "system", "content": self.system_prompt})
-            logger.debug(f"Added system prompt: {self.system_prompt}")
+        if system_prompt:
+            messages.append({"role": "system", "content": system_prompt})
+            logger.debug(f"Added system prompt: {system_prompt}")
         
-        # Add JSON schema if requested
-        if use_json_schema and self.json_schema:
-            prompt_text = f"{prompt_text}\n\nPlease format your response according to this JSON schema:\n{self.json_schema.schema_json()}"
-            logger.debug(f"Added JSON schema to prompt_text: {prompt_text}")
+        # Constrained decoding - the server only samples tokens that keep the output valid against the schema
+        request_params = dict(self.sampling_params)
+        json_schema = json_schema or self.json_schema
+        if use_json_schema and json_schema:
+            request_params['response_format'] = {
+                'type': 'json_schema',
+                'json_schema': {'name': json_schema.__name__, 'schema': get_json_schema(json_schema)}
+            }
+            logger.debug(f"Using structured output with JSON schema: {json_schema.__name__}")
         
         messages.append({"role": "user", "content": prompt_text})
         logger.debug(f"Sending messages to VLLM: {messages}")
         
-        # Stream the response from Ollama
+        # Stream the response from VLLM
         try:
             
-            stream = self.client.chat.completions.create(
+            stream = await self.client.chat.completions.create(
                 model=self.model_name,
                 messages=messages,
-                max_tokens=5000,
-                stream=True
+                stream=True,
+                stream_options={'include_usage': True},
+                **request_params
             )
            
-            for chunk in stream:
-                if chunk.choices[0].delta.content is not None:
-                    text = chunk.choices[0].delta.content
-                    yield text
+            # Closing the stream (e.g. when the caller aborts early) cancels the request on the server
+            async with stream:
+                async for chunk in stream:
+                    if chunk.choices and chunk.choices[0].delta.content is not None:
+                        text = chunk.choices[0].delta.content
+                        yield text
+
+                    # Token usage arrives on a final chunk with no choices
+                    if chunk.usage:
+                        usage_tracker.report_tokens(chunk.usage.prompt_tokens, chunk.usage.completion_tokens)
         
         except Exception as e:
             logger.error(f"Error during VLLM API call: {e}")
             raise
 
-        
+    async def async_health_check(self) -> bool:
+        health_url = self.host.rstrip('/').removesuffix('/v1') + '/health'
+        try:
+            async with httpx.AsyncClient(timeout=5) as client:
+                resp = await client.get(health_url)
+            return resp.status_code == 200
+        except httpx.HTTPError as e:
+            logger.debug(f"VLLM health check failed for {health_url}: {e}")
+            return False
+
+    async def async_get_prefix_cache_stats(self) -> Union[None, dict]:
+        """Read automatic prefix caching counters from the server's Prometheus metrics endpoint."""
+        metrics_url = self.host.rstrip('/').removesuffix('/v1') + '/metrics'
+        try:
+            async with httpx.AsyncClient(timeout=5) as client:
+                resp = await client.get(metrics_url)
+                resp.raise_for_status()
+        except httpx.HTTPError as e:
+            logger.warning(f"Unable to read VLLM metrics from {metrics_url}: {e}")
+            return None
+        metrics = VLLM._parse_metrics(resp.text)
+
+        # V1 engine exposes token counters; the older engine only exposes a hit-rate gauge
+        queries = metrics.get('vllm:prefix_cache_queries_total')
+        hits = metrics.get('vllm:prefix_cache_hits_total')
+        if queries:
+            return {'queried_tokens': queries, 'hit_tokens': hits or 0.0, 'hit_rate': (hits or 0.0) / queries}
+        if 'vllm:gpu_prefix_cache_hit_rate' in metrics:
+            return {'hit_rate': metrics['vllm:gpu_prefix_cache_hit_rate']}
+        return None
+
+    @staticmethod
+    def _parse_metrics(text: str) -> Dict[str, float]:
+        """Sum each metric in Prometheus text format across all of its label sets."""
+        metrics = {}
+        for line in text.splitlines():
+            if not line or line.startswith('#'):
+                continue
+            try:
+                name_part, value = line.rsplit(' ', 1)
+                value = float(value)
+            except ValueError:
+                continue
+            name = name_part.split('{', 1)[0]
+            metrics[name] = metrics.get(name, 0.0) + value
+        return metrics
@@ -5,6 +5,7 @@ from textwrap import dedent
 from typing import List, Dict, Any, Optional, Callable, Union
 from datetime import datetime
 from pydantic import BaseModel, Field
+from lib.usage import usage_tracker
 
 # Represents a discrete, high-level section of the agents workflow
 class Phase(BaseModel):
@@ -50,12 +51,22 @@ class Phase(BaseModel):
             Pointer to a data loading/restoring function which loads the
             files that were written during a previous execution of this phase.
     """))
+    budget: Union[None, Any] = Field(
+        description=dedent("""
+            Optional lib.usage.Budget with hard token, cost and wall time
+            limits for all model requests made during this phase.
+        """),
+        default=None
+    )
 
     # Execute the phase
     def run(self, **kwargs):
         logger.info(f"Starting phase: {self.title} with kwargs: {kwargs}")
         self._start_time = datetime.now()
-        self._data = self.phase_func(**kwargs)
+        if self.budget:
+            self.budget.reset()
+        with usage_tracker.scope('phase', self.title, self.budget):
+            self._data = self.phase_func(**kwargs)
         logger.info(f"Phase {self.title} function completed")
         self._validation_status = self.validation_func()
         self._end_time = datetime.now()
@@ -0,0 +1,148 @@
+import logging
+logger = logging.getLogger(__name__)
+logger.propagate = True
+import asyncio
+import random
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, Union
+import anthropic
+import httpx
+import openai
+import pydantic_core
+import requests
+from lib.task import TaskValidationError
+
+# Errors caused by the connection to, or overload of, the model server
+TRANSPORT_ERRORS = (
+    requests.exceptions.RequestException,
+    httpx.TransportError,
+    openai.APIConnectionError,
+    openai.RateLimitError,
+    openai.InternalServerError,
+    anthropic.APIConnectionError,
+    anthropic.RateLimitError,
+    anthropic.InternalServerError,
+    ConnectionError,
+    TimeoutError,
+    asyncio.TimeoutError
+)
+
+# Errors caused by the model returning a response in the wrong format
+FORMAT_ERRORS = (
+    TaskValidationError,
+    pydantic_core.ValidationError
+)
+
+
+# Retry behaviour for Agent tasks - configurable per Agent, and overridable per Task
+@dataclass
+class RetryPolicy:
+    transport_attempts: int = 5
+    format_attempts: int = 3
+    base_delay: float = 1.0
+    max_delay: float = 30.0
+    multiplier: float = 2.0
+
+    # Format errors are the model's fault rather than the server's, so by default retry them immediately
+    format_delay: float = 0.0
+
+    @staticmethod
+    def classify(error: Exception) -> Union[None, str]:
+        """Return 'transport', 'format' or None (not retryable) for an error."""
+        if isinstance(error, FORMAT_ERRORS):
+            return 'format'
+        if isinstance(error, TRANSPORT_ERRORS):
+            return 'transport'
+
+        # e.g. ollama.ResponseError - retry on overload/server errors only
+        status_code = getattr(error, 'status_code', None)
+        if isinstance(status_code, int) and (status_code == 429 or status_code >= 500):
+            return 'transport'
+        return None
+
+    def max_attempts(self, kind: str) -> int:
+        return self.transport_attempts if kind == 'transport' else self.format_attempts
+
+    def get_delay(self, kind: str, failures: int) -> float:
+        """Exponential backoff with full jitter, based on the number of failures so far of this kind."""
+        if kind == 'format':
+            return self.format_delay
+        cap = min(self.max_delay, self.base_delay * self.multiplier ** (failures - 1))
+        return random.uniform(0, cap)
+
+
+# Raised instead of sending a request to an endpoint whose circuit is open
+class CircuitOpenError(Exception):
+    """Exception raised when a model endpoint has failed repeatedly and is not currently accepting requests."""
+    def __init__(self, message="Circuit open: model endpoint is failing and not accepting requests."):
+        self.message = message
+        super().__init__(self.message)
+
+
+# Per-endpoint circuit breaker, shared by every Agent using that endpoint
+class CircuitBreaker:
+    """
+    Opens after failure_threshold consecutive transport failures, failing requests fast
+    for reset_timeout seconds. After that a single trial request is let through (half-open);
+    success closes the circuit again, failure re-opens it.
+    """
+
+    _breakers: Dict[str, 'CircuitBreaker'] = {}
+    _registry_lock = threading.Lock()
+
+    def __init__(self, endpoint: str, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.endpoint = endpoint
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Union[None, float] = None
+        self.trial_started: Union[None, float] = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def for_endpoint(cls, endpoint: str) -> 'CircuitBreaker':
+        with cls._registry_lock:
+            if endpoint not in cls._breakers:
+                cls._breakers[endpoint] = cls(endpoint)
+            return cls._breakers[endpoint]
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return 'half-open'
+        return 'open'
+
+    def before_request(self):
+        """Raise CircuitOpenError unless a request to this endpoint may be sent now."""
+        with self._lock:
+            state = self.state
+            if state == 'closed':
+                return
+            # Only one trial at a time - unless the last one never reported back (e.g. it was cancelled)
+            now = time.monotonic()
+            if state == 'half-open' and (self.trial_started is None or now - self.trial_started >= self.reset_timeout):
+                logger.info(f"Circuit half-open for endpoint {self.endpoint}; sending trial request")
+                self.trial_started = now
+                return
+        raise CircuitOpenError(f"Circuit open for model endpoint {self.endpoint} after {self.failures} consecutive failures")
+
+    def record_success(self):
+        with self._lock:
+            if self.opened_at is not None:
+                logger.info(f"Circuit closed for endpoint {self.endpoint}")
+            self.failures = 0
+            self.opened_at = None
+            self.trial_started = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self.trial_started = None
+            if self.failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    logger.warning(f"Circuit opened for endpoint {self.endpoint} after {self.failures} consecutive failures")
+                self.opened_at = time.monotonic()
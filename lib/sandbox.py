@@ -0,0 +1,104 @@
+import logging
+logger = logging.getLogger(__name__)
+logger.propagate = True
+import os
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Tuple, Union
+from lib.files import atomic_write, clone_tree
+from lib.executor import CommandExecutor, CommandResult
+
+
+# Throwaway copy of a project tree to run commands in
+class Sandbox:
+
+    def __init__(self, manager: 'SandboxManager', path: str):
+        self.manager = manager
+        self.path = path
+
+    def __enter__(self) -> 'Sandbox':
+        return self
+
+    def __exit__(self, *exc):
+        self.remove()
+
+    def write_file(self, file_name: str, content: str):
+        """Write a file into the sandbox, replacing rather than modifying any (hardlinked) copy of it."""
+        atomic_write(os.path.join(self.path, file_name), [content.encode('utf-8')])
+
+    def run(self, commands: List[str]) -> List[CommandResult]:
+        """Run commands in the sandbox, with the project's venv (see CommandExecutor.run)."""
+        return self.manager.executor(self.path).run(commands)
+
+    def remove(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+# Snapshots a project tree into sandboxes and runs commands (e.g. test suites) in them concurrently
+class SandboxManager:
+    """
+    Each sandbox is a clone of the source tree (see lib.files.clone_tree) in its own directory
+    under root, so candidate fixes can be written and tested side by side without touching the
+    source or each other. The venv is left out of the clones: every sandbox runs with the source
+    tree's venv, which is shared read-only (bytecode isn't written into it, and nothing should be
+    installed from a sandbox). root defaults to a directory beside the source, so that hardlinks
+    work when copy-on-write isn't available.
+    """
+
+    def __init__(
+            self,
+            source: str,
+            venv_path: Union[None, str] = None,
+            root: Union[None, str] = None,
+            max_sandboxes: int = 4,
+            exclude: Iterable[str] = ('venv', '.git'),
+            timeouts: Union[None, Dict[str, float]] = None,
+            max_output_bytes: int = 64 * 1024,
+            log_dir: Union[None, str] = None
+    ):
+        logger.debug(f"Initializing SandboxManager with source: {source}, max_sandboxes: {max_sandboxes}")
+        self.source = os.path.abspath(source)
+        self.venv_path = venv_path
+        self.root = root or os.path.join(os.path.dirname(self.source), '.sandboxes')
+        self.max_sandboxes = max_sandboxes
+        self.exclude = tuple(exclude)
+        self.timeouts = timeouts
+        self.max_output_bytes = max_output_bytes
+        self.log_dir = log_dir
+
+    def snapshot(self) -> Sandbox:
+        """A new sandbox holding the source tree as it is now. Remove it (or use it as a context manager) when done."""
+        os.makedirs(self.root, exist_ok=True)
+        path = tempfile.mkdtemp(dir=self.root, prefix='sandbox-')
+        os.rmdir(path)
+        method = clone_tree(self.source, path, exclude=self.exclude)
+        logger.debug(f"Created sandbox {path} ({method})")
+        return Sandbox(self, path)
+
+    # Bytecode isn't written, to keep the shared venv read-only
+    def executor(self, cwd: str) -> CommandExecutor:
+        return CommandExecutor(
+            cwd=cwd,
+            venv_path=self.venv_path,
+            timeouts=self.timeouts,
+            max_output_bytes=self.max_output_bytes,
+            log_dir=self.log_dir,
+            env={'PYTHONDONTWRITEBYTECODE': '1'}
+        )
+
+    def run_many(self, jobs: Iterable[Tuple[Union[None, Dict[str, str]], List[str]]]) -> List[List[CommandResult]]:
+        """
+        Run jobs concurrently, up to max_sandboxes at once, each in a fresh sandbox. A job is the
+        files to write into the sandbox first (file name -> content, or None) and the commands to
+        run. Returns each job's command results, in the order of the jobs.
+        """
+        def run_job(job: Tuple[Union[None, Dict[str, str]], List[str]]) -> List[CommandResult]:
+            files, commands = job
+            with self.snapshot() as sandbox:
+                for file_name, content in (files or {}).items():
+                    sandbox.write_file(file_name, content)
+                return sandbox.run(commands)
+
+        with ThreadPoolExecutor(max_workers=self.max_sandboxes) as pool:
+            return list(pool.map(run_job, jobs))
@@ -3,22 +3,33 @@ logger = logging.getLogger(__name__)
 logger.propagate = True
 import os
 import queue
+import re
+import selectors
+import shlex
+import signal
 import subprocess
 import sys
 import tempfile
 import time
 import shutil
 import threading
+import uuid
 from queue import Queue
+from typing import Tuple, Union
+from lib.capture import OutputCapture
+from lib.venv_cache import VenvCache
 
 # py -3.9 main.py --name "api_test" --phase "developing"
 
 class ShellThread(threading.Thread):
 
-    def __init__(self):
+    def __init__(self, max_output_bytes: int = 64 * 1024, log_dir: Union[None, str] = None):
         logger.debug("Initializing ShellThread instance")
         super().__init__()
         self.daemon=True
+        self.max_output_bytes = max_output_bytes
+        self.log_dir = log_dir
+        self.last_log_path = None
         self.input_queue = Queue()
         self.output_queue = Queue()
         self.finished = threading.Event()
@@ -39,7 +50,7 @@ class ShellThread(threading.Thread):
             logger.debug(f"ShellThread received command: {command}")
             if command is None:
                 continue
-            output = ""
+            capture = OutputCapture(self.max_output_bytes, self.log_dir)
             with tempfile.NamedTemporaryFile(suffix='.bat', delete=False) as bat:
                 bat.write(b'@ECHO OFF\n')
                 bat.write(bytes(command, encoding='utf-8'))
@@ -52,30 +63,170 @@ class ShellThread(threading.Thread):
                 logger.debug(f"ShellThread executing command: {command}")
                 while not self.terminate.is_set():
                     line = self.shell.stdout.readline()
-                    output += line
                     if "__COMMAND_EXECUTION_COMPLETE__" in line:
                         time.sleep(0.5)
-                        output = output.replace("__COMMAND_EXECUTION_COMPLETE__", "")
+                        capture.write(line.replace("__COMMAND_EXECUTION_COMPLETE__", "").encode('utf-8'))
+                        capture.close()
                         os.remove(bat_path)
-                        self.output_queue.put(output)
+                        self.last_log_path = capture.log_path
+                        self.output_queue.put(capture.text)
                         self.finished.set()
                         logger.debug(f"ShellThread command completed: {command}")
                         break
+                    capture.write(line.encode('utf-8'))
                     time.sleep(0.2)
             except Exception as e:
                 logger.error(f"Error during shell command execution: {e}")
         self.shell.terminate()
         logger.debug("ShellThread run method finished")
 
+# Persistent bash process for POSIX hosts - the counterpart of ShellThread, without its polling
+class BashSession:
+    """
+    Commands are eval'd in one long-lived bash, so cd, export and venv activation carry over
+    between them. Each is followed by a unique sentinel line carrying its exit code, and the
+    output is read with a selector until that sentinel arrives - there are no fixed sleeps, and
+    no thread per session, so a process can hold many sessions and run them concurrently (one
+    command at a time per session). A command that times out kills the session's process
+    group; the next command starts a fresh bash.
+    """
+
+    def __init__(
+            self,
+            cwd: Union[None, str] = None,
+            env: Union[None, dict] = None,
+            max_output_bytes: int = 64 * 1024,
+            log_dir: Union[None, str] = None
+    ):
+        logger.debug(f"Initializing BashSession with cwd: {cwd}")
+        self.cwd = cwd
+        self.env = env
+        self.max_output_bytes = max_output_bytes
+        self.log_dir = log_dir
+        self.proc = None
+        self._lock = threading.Lock()
+        self._start()
+
+    def _start(self):
+        self.proc = subprocess.Popen(
+            ['bash', '--noprofile', '--norc'],
+            cwd=self.cwd,
+            env=self.env,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            start_new_session=True
+        )
+        os.set_blocking(self.proc.stdout.fileno(), False)
+        logger.debug(f"BashSession started bash with pid: {self.proc.pid}")
+
+    def run(self, command: str, timeout: float = 20) -> Tuple[str, Union[None, int], Union[None, str]]:
+        """
+        Run a command, returning its output (truncated to max_output_bytes - see OutputCapture),
+        its exit code (None if it timed out) and the path of its full output log (None if it fit).
+        """
+        with self._lock:
+            if self.proc is None or self.proc.poll() is not None:
+                self._start()
+            sentinel = f"__COMMAND_COMPLETE_{uuid.uuid4().hex}__"
+            pattern = re.compile(rb'\n' + sentinel.encode() + rb':(\d+)\n')
+
+            # Output is held back from the capture only until it can no longer contain the start of the sentinel
+            hold = len(sentinel) + 16
+            capture = OutputCapture(self.max_output_bytes, self.log_dir)
+
+            # eval keeps quoting mistakes in the command from swallowing the sentinel, and stdin is
+            # closed to the command so it can't read the commands after it
+            script = f"eval {shlex.quote(command)} < /dev/null\nprintf '\\n%s:%d\\n' {sentinel} $?\n"
+            try:
+                self.proc.stdin.write(script.encode('utf-8'))
+                self.proc.stdin.flush()
+            except BrokenPipeError:
+                self.close()
+                return "\n USER: Shell exited unexpectedly.", None, None
+            pending = bytearray()
+            exit_code = None
+            timed_out = False
+            deadline = time.monotonic() + timeout
+            with selectors.DefaultSelector() as selector:
+                selector.register(self.proc.stdout, selectors.EVENT_READ)
+                while True:
+                    match = pattern.search(pending)
+                    if match:
+                        capture.write(pending[:match.start()])
+                        exit_code = int(match.group(1))
+                        break
+                    capture.write(pending[:-hold])
+                    del pending[:-hold]
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0 or not selector.select(remaining):
+                        timed_out = True
+                        break
+                    chunk = os.read(self.proc.stdout.fileno(), 65536)
+                    if not chunk:
+
+                        # The command exited the shell itself (e.g. 'exit 1')
+                        capture.write(pending)
+                        exit_code = self.proc.wait()
+                        self.close()
+                        break
+                    pending += chunk
+            if timed_out:
+                capture.write(pending)
+                self.close()
+            capture.close()
+            output = capture.text
+            if timed_out:
+                output += f"\n USER: Command did not complete in under {timeout} seconds and was terminated. " \
+                          + "See output above for evidence."
+            return output, exit_code, capture.log_path
+
+    def close(self):
+        """Kill the shell and anything still running in it."""
+        if self.proc is None:
+            return
+        try:
+            os.killpg(self.proc.pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            pass
+        self.proc.wait()
+        for stream in (self.proc.stdin, self.proc.stdout):
+            try:
+                stream.close()
+            except OSError:
+                pass
+        self.proc = None
+
+
 class Shell:
     logger.debug("Initializing Shell class")
-    def __init__(self, venv_path, python):
+    def __init__(
+            self,
+            venv_path,
+            python,
+            venv_cache: Union[None, VenvCache] = None,
+            max_output_bytes: int = 64 * 1024,
+            log_dir: Union[None, str] = None
+    ):
         logger.debug(f"Initializing Shell instance with venv_path: {venv_path}, python: {python}")
         self.proj_src = venv_path
         self.venv_path = os.path.join(self.proj_src, "venv")
         self.interpreter = python
+        self.venv_cache = venv_cache
+
+        # Output kept in memory per command; the rest goes to a log file in log_dir (see OutputCapture)
+        self.max_output_bytes = max_output_bytes
+        self.log_dir = log_dir
         self.shell_thread = None
-        if os.path.exists(self.venv_path):
+        self.session = None
+        self.last_exit_code = None
+        self.last_log_path = None
+
+        # A venv cloned from the template for the current interpreter and requirements is kept across
+        # starts; any other is rebuilt
+        requirements = VenvCache.read_requirements(os.path.join(self.proj_src, 'requirements.txt'))
+        keep = self.venv_cache is not None and self.venv_cache.is_current(self.venv_path, python, requirements)
+        if os.path.exists(self.venv_path) and not keep:
             shutil.rmtree(self.venv_path)
             print(f"Deleted existing virtual environment at {self.venv_path}")
         self._init_shell()
@@ -84,16 +235,26 @@ class Shell:
 
     def _init_shell(self):
         logger.debug("Initializing shell")
-        self.shell_thread = ShellThread()
-        self.shell_thread.start()
+        if os.name == 'nt':
+            self.shell_thread = ShellThread(self.max_output_bytes, self.log_dir)
+            self.shell_thread.start()
+        else:
+            os.makedirs(self.proj_src, exist_ok=True)
+            self.session = BashSession(cwd=self.proj_src, max_output_bytes=self.max_output_bytes, log_dir=self.log_dir)
         self._create_venv()
         self._activate_venv()
         logger.debug("Shell initialized")
 
+    # Clone the venv from a cached template (with the project's requirements.txt installed) if there
+    # is a cache, rather than building it from scratch
     def _create_venv(self):
         logger.debug("Creating virtual environment")
         if not os.path.exists(self.venv_path):
-            self.run_shell_command(f"{self.interpreter} -m venv {self.venv_path}")
+            if self.venv_cache:
+                requirements = VenvCache.read_requirements(os.path.join(self.proj_src, 'requirements.txt'))
+                self.venv_cache.create(self.venv_path, self.interpreter, requirements)
+            else:
+                self.run_shell_command(f"{self.interpreter} -m venv {self.venv_path}")
             print(f"Virtual environment created at {self.venv_path}")
         else:
             print(f"Virtual environment already exists at {self.venv_path}")
@@ -110,7 +271,10 @@ class Shell:
 
     def _activate_venv(self):
         logger.debug("Activating virtual environment")
-        self.run_shell_command("venv/Scripts/activate.bat")
+        if self.session:
+            self.run_shell_command(f"source {shlex.quote(os.path.join(self.venv_path, 'bin', 'activate'))}")
+        else:
+            self.run_shell_command("venv/Scripts/activate.bat")
         print(f"Virtual environment activated at {self.venv_path}")
         logger.debug("Virtual environment activated")
 
@@ -120,13 +284,23 @@ class Shell:
         logger.debug("Virtual environment deactivated")
 
     def kill_shell(self):
+        if self.session:
+            self.session.close()
+            logger.debug("Shell killed")
+            return
         self.shell_thread.terminate.set()
         self.shell_thread.input_queue.put("echo DIE MOFO!")
         self.shell_thread.join(timeout=5)
         logger.debug("Shell killed")
 
+    # Returns the command's output, truncated if it was longer than max_output_bytes - the full
+    # output is then in the file at last_log_path
     def run_shell_command(self, command, timeout=20):
         logger.debug(f"Running shell command: {command}, timeout: {timeout}")
+        if self.session:
+            output, self.last_exit_code, self.last_log_path = self.session.run(command, timeout)
+            logger.debug(f"Shell command completed: {command}, exit code: {self.last_exit_code}, output: {output}")
+            return output
         self.shell_thread.finished.clear()
         self.shell_thread.input_queue.put(command)
         logger.debug(f"Command put into queue: {command}")
@@ -147,6 +321,7 @@ class Shell:
                 break
             try:
                 output += self.shell_thread.output_queue.get(timeout=0.2)
+                self.last_log_path = self.shell_thread.last_log_path
             except queue.Empty:
                 continue
         logger.debug(f"Shell command completed: {command}, output: {output}")
@@ -156,6 +331,6 @@ class Shell:
         logger.debug("Generating requirements file")
         requirements_file = 'requirements.txt'
         with open(requirements_file, 'w') as fout:
-            fout.write(self.run_shell_command("venv/Scripts/pip freeze"))
+            fout.write(self.run_shell_command("venv/bin/pip freeze" if self.session else "venv/Scripts/pip freeze"))
         print(f"requirements file generated: {requirements_file}")
         logger.debug(f"requirements file generated: {requirements_file}")
@@ -0,0 +1,330 @@
+import logging
+logger = logging.getLogger(__name__)
+logger.propagate = True
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from array import array
+from collections.abc import Sequence
+from typing import Any, Dict, Iterable, Iterator, List, Tuple, Union
+from lib.models import json_default
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS specs (
+    id INTEGER PRIMARY KEY,
+    content TEXT NOT NULL,
+    created REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS requirements (
+    req_id INTEGER PRIMARY KEY,
+    req_details TEXT,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS tests (
+    test_id INTEGER PRIMARY KEY,
+    req_id INTEGER REFERENCES requirements (req_id),
+    test_title TEXT,
+    test_details TEXT,
+    exp_result TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS tests_req_id ON tests (req_id);
+CREATE TABLE IF NOT EXISTS implementations (
+    req_id INTEGER PRIMARY KEY REFERENCES requirements (req_id),
+    is_complete TEXT,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS code_segments (
+    id INTEGER PRIMARY KEY,
+    file_name TEXT,
+    segment_description TEXT,
+    segment_content TEXT,
+    embedding BLOB,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS code_segments_file_name ON code_segments (file_name);
+CREATE TABLE IF NOT EXISTS files (
+    file_name TEXT PRIMARY KEY,
+    sha256 TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS task_runs (
+    id INTEGER PRIMARY KEY,
+    task TEXT NOT NULL,
+    agent TEXT,
+    model TEXT,
+    input_hash TEXT NOT NULL,
+    session TEXT,
+    status TEXT NOT NULL,
+    started REAL NOT NULL,
+    finished REAL,
+    output TEXT
+);
+CREATE INDEX IF NOT EXISTS task_runs_lookup ON task_runs (task, input_hash, agent, model);
+"""
+
+# Tables of element items: the key column (None for tables that are replaced as a whole, keyed
+# by row id) and the item fields (by alias) that get their own column. Each row also holds the
+# whole item as JSON, so items read back exactly as they were written
+ITEM_TABLES: Dict[str, Tuple[Union[None, str], Tuple[str, ...]]] = {
+    'requirements': ('req_id', ('req_id', 'req_details')),
+    'tests': ('test_id', ('test_id', 'req_id', 'test_title', 'test_details', 'exp_result')),
+    'implementations': ('req_id', ('req_id', 'is_complete')),
+    'code_segments': (None, ('file_name', 'segment_description', 'segment_content'))
+}
+
+
+# Embedded SQLite store of everything generated for a project
+class ProjectState:
+    """
+    One database file per project, in WAL mode so that several worker processes can read
+    while one writes. Each thread gets its own connection. Foreign keys are enforced, so e.g.
+    a test can only refer to a requirement that exists.
+    """
+
+    # Shared instances, by database path
+    _instances: Dict[str, 'ProjectState'] = {}
+    _instances_lock = threading.Lock()
+
+    def __init__(self, path: str):
+        logger.debug(f"Initializing ProjectState with path: {path}")
+        self.path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+
+        # Databases created before task runs recorded their session
+        if 'session' not in [row[1] for row in self.conn.execute("PRAGMA table_info(task_runs)")]:
+            self.conn.execute("ALTER TABLE task_runs ADD COLUMN session TEXT")
+        self._tables: Dict[str, StateTable] = {}
+
+        # Identifies this process's task runs, which are never replayed within the same process
+        self.session_id = uuid.uuid4().hex
+
+    @classmethod
+    def open(cls, path: str) -> 'ProjectState':
+        """The state store for a database path, shared by all callers."""
+        path = os.path.abspath(path)
+        with cls._instances_lock:
+            state = cls._instances.get(path)
+            if state is None:
+                state = cls(path)
+                cls._instances[path] = state
+            return state
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        """This thread's connection to the database."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA foreign_keys=ON")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def table(self, name: str) -> 'StateTable':
+        """One of the ITEM_TABLES, with the same interface as lib.store.RecordStore."""
+        table = self._tables.get(name)
+        if table is None:
+            key, columns = ITEM_TABLES[name]
+            table = StateTable(self, name, key, columns)
+            self._tables[name] = table
+        return table
+
+    def save_spec(self, content: str):
+        """Record the user specs, unless they are unchanged since they were last recorded."""
+        if self.latest_spec() == content:
+            return
+        with self.conn:
+            self.conn.execute("INSERT INTO specs (content, created) VALUES (?, ?)", (content, time.time()))
+
+    def latest_spec(self) -> Union[None, str]:
+        row = self.conn.execute("SELECT content FROM specs ORDER BY id DESC LIMIT 1").fetchone()
+        return row[0] if row else None
+
+    def record_files(self, files: Iterable[Tuple[str, str, int]]):
+        """Record the (file_name, sha256, size) of written files."""
+        now = time.time()
+        with self.conn:
+            self.conn.executemany(
+                "INSERT INTO files (file_name, sha256, size, updated) VALUES (?, ?, ?, ?) "
+                + "ON CONFLICT (file_name) DO UPDATE SET sha256 = excluded.sha256, size = excluded.size, updated = excluded.updated",
+                [(file_name, sha256, size, now) for file_name, sha256, size in files]
+            )
+
+    def file_hash(self, file_name: str) -> Union[None, str]:
+        row = self.conn.execute("SELECT sha256 FROM files WHERE file_name = ?", (file_name,)).fetchone()
+        return row[0] if row else None
+
+    def code_segments(self) -> List[Tuple[int, dict, Union[None, List[float]]]]:
+        """(id, item, embedding) of every code segment - embedding is None until set_embedding."""
+        rows = self.conn.execute("SELECT id, data, embedding FROM code_segments ORDER BY id")
+        return [(id, json.loads(data), _unpack_vector(embedding)) for id, data, embedding in rows]
+
+    def set_embedding(self, segment_id: int, vector: List[float]):
+        with self.conn:
+            self.conn.execute("UPDATE code_segments SET embedding = ? WHERE id = ?", (_pack_vector(vector), segment_id))
+
+    def find_task_run(self, task: str, agent: str, model: str, input_hash: str) -> Union[None, str]:
+        """
+        The output (as JSON) of the latest completed run of a task with these inputs in an earlier
+        session, or None. Runs from this session aren't returned, so that a task repeated on purpose
+        (e.g. retried after its result failed a check) is run again rather than given the same result.
+        """
+        row = self.conn.execute(
+            "SELECT output FROM task_runs WHERE task = ? AND input_hash = ? AND agent = ? AND model = ? "
+            + "AND status = 'complete' AND (session IS NULL OR session != ?) ORDER BY id DESC LIMIT 1",
+            (task, input_hash, agent, model, self.session_id)
+        ).fetchone()
+        return row[0] if row else None
+
+    def start_task_run(self, task: str, agent: str, model: str, input_hash: str) -> int:
+        with self.conn:
+            return self.conn.execute(
+                "INSERT INTO task_runs (task, agent, model, input_hash, session, status, started) VALUES (?, ?, ?, ?, ?, 'running', ?)",
+                (task, agent, model, input_hash, self.session_id, time.time())
+            ).lastrowid
+
+    def finish_task_run(self, run_id: int, status: str, output: Union[None, str] = None):
+        """Mark a task run 'complete' (with its output as JSON) or 'failed'."""
+        with self.conn:
+            self.conn.execute(
+                "UPDATE task_runs SET status = ?, finished = ?, output = ? WHERE id = ?",
+                (status, time.time(), output, run_id)
+            )
+
+    def close(self):
+        """Close this thread's connection."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+# Embeddings are stored as packed 32-bit floats
+def _pack_vector(vector: List[float]) -> bytes:
+    return array('f', vector).tobytes()
+
+
+def _unpack_vector(blob: Union[None, bytes]) -> Union[None, List[float]]:
+    if blob is None:
+        return None
+    vector = array('f')
+    vector.frombytes(blob)
+    return vector.tolist()
+
+
+# A table of element items
+class StateTable:
+
+    def __init__(self, state: ProjectState, name: str, key: Union[None, str], columns: Tuple[str, ...]):
+        self.state = state
+        self.name = name
+        self.key = key
+        self.columns = columns
+        self._key_column = key or 'id'
+        names = ", ".join(columns + ('data',))
+        placeholders = ", ".join('?' * (len(columns) + 1))
+        self._insert = f"INSERT INTO {name} ({names}) VALUES ({placeholders})"
+        if key:
+            updates = ", ".join(f"{column} = excluded.{column}" for column in columns + ('data',) if column != key)
+            self._insert += f" ON CONFLICT ({key}) DO UPDATE SET {updates}"
+
+    def __len__(self) -> int:
+        return len(self.rows())
+
+    def __contains__(self, key: Any) -> bool:
+        return self.get(key) is not None
+
+    def keys(self) -> List[Any]:
+        return [row[0] for row in self.state.conn.execute(f"SELECT {self._key_column} FROM {self.name} ORDER BY {self._key_column}")]
+
+    def get(self, key: Any) -> Union[None, dict]:
+        """Read one item by key (row id for keyless tables), or None if there isn't one."""
+        row = self.state.conn.execute(f"SELECT data FROM {self.name} WHERE {self._key_column} = ?", (_normalize(key),)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def values(self) -> Iterator[dict]:
+        return iter(self.rows())
+
+    def rows(self, **where: Any) -> 'Rows':
+        """Lazy view of the items, optionally only those whose columns equal the given values."""
+        return Rows(self, where)
+
+    def upsert(self, records: Iterable[Any]) -> List[Any]:
+        """Insert items, replacing any with the same key. Returns their keys."""
+        with self.state.conn:
+            return self._write(records)
+
+    def replace(self, records: Iterable[Any]) -> List[Any]:
+        """Replace every item in the table with these ones, in one transaction."""
+        with self.state.conn:
+            self.state.conn.execute(f"DELETE FROM {self.name}")
+            return self._write(records)
+
+    def clear(self):
+        with self.state.conn:
+            self.state.conn.execute(f"DELETE FROM {self.name}")
+
+    def _write(self, records: Iterable[Any]) -> List[Any]:
+        keys = []
+        for record in records:
+            values = [_normalize(record.get(column)) for column in self.columns]
+            values.append(json.dumps(record, ensure_ascii=False, default=json_default))
+            cursor = self.state.conn.execute(self._insert, values)
+            keys.append(values[self.columns.index(self.key)] if self.key else cursor.lastrowid)
+        logger.debug(f"Wrote {len(keys)} items to {self.name}")
+        return keys
+
+
+# Key and column values as the model wrote them may be surrounded by whitespace
+def _normalize(value: Any) -> Any:
+    return value.strip() if isinstance(value, str) else value
+
+
+# Read-only sequence of the items in a table, queried when accessed rather than loaded up front
+class Rows(Sequence):
+
+    def __init__(self, table: StateTable, where: Dict[str, Any]):
+        self.table = table
+        self._where = ""
+        self._params = tuple(_normalize(value) for value in where.values())
+        if where:
+            self._where = " WHERE " + " AND ".join(f"{column} = ?" for column in where)
+
+    def _select(self, what: str, suffix: str = "", params: tuple = ()):
+        return self.table.state.conn.execute(
+            f"SELECT {what} FROM {self.table.name}{self._where}{suffix}", self._params + params
+        )
+
+    def __len__(self) -> int:
+        return self._select("COUNT(*)").fetchone()[0]
+
+    def __iter__(self) -> Iterator[dict]:
+        for (data,) in self._select("data", f" ORDER BY {self.table._key_column}"):
+            yield json.loads(data)
+
+    def __getitem__(self, index: Union[int, slice]) -> Union[dict, List[dict]]:
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                return list(self)[index]
+            if stop <= start:
+                return []
+            rows = self._select("data", f" ORDER BY {self.table._key_column} LIMIT ? OFFSET ?", (stop - start, start))
+            return [json.loads(data) for (data,) in rows]
+        if index < 0:
+            index += len(self)
+        row = self._select("data", f" ORDER BY {self.table._key_column} LIMIT 1 OFFSET ?", (index,)).fetchone() if index >= 0 else None
+        if row is None:
+            raise IndexError("Rows index out of range")
+        return json.loads(row[0])
+
+    def __repr__(self) -> str:
+        return repr(list(self))
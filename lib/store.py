@@ -0,0 +1,212 @@
+import logging
+logger = logging.getLogger(__name__)
+logger.propagate = True
+import json
+import os
+import threading
+from typing import Any, Dict, Iterable, Iterator, List, Tuple, Union
+from lib.files import atomic_write
+from lib.models import json_default
+
+
+# Append-only JSON Lines file of records, with an index of each record's latest offset by key
+class RecordStore:
+    """
+    Each line is {"key": ..., "record": {...}}. Upserting a record appends its new version
+    and repoints the in-memory index, so a write costs the size of the delta rather than of
+    the whole store, and get() reads a single line. Superseded lines are dropped by compact(),
+    which runs automatically once they outnumber the live records. The index is saved beside
+    the store (path + '.idx') whenever the store is rewritten; on load, lines appended since
+    are read from the store, and the index is rebuilt if it is missing or doesn't match.
+    """
+
+    def __init__(self, path: str, key: Union[None, str] = None):
+        logger.debug(f"Initializing RecordStore with path: {path}, key: {key}")
+        self.path = path
+        self.index_path = path + '.idx'
+
+        # The record field (by alias) that identifies a record; without one, records are numbered
+        self.key = key
+        self._lock = threading.Lock()
+
+        # Key -> (offset, length) of the record's latest line, in first-insertion order
+        self._offsets: Dict[str, Tuple[int, int]] = {}
+        self._size = 0
+        self._lines = 0
+        self._load_index()
+
+    def __len__(self) -> int:
+        return len(self._offsets)
+
+    def __contains__(self, key: Any) -> bool:
+        return str(key) in self._offsets
+
+    def keys(self) -> List[str]:
+        return list(self._offsets)
+
+    def get(self, key: Any) -> Union[None, dict]:
+        """Read the latest version of one record, or None if there isn't one."""
+        location = self._offsets.get(str(key))
+        if location is None:
+            return None
+        with open(self.path, 'rb') as f:
+            f.seek(location[0])
+            return json.loads(f.read(location[1]))['record']
+
+    def rows(self) -> List[dict]:
+        """Every record (loaded up front, unlike lib.state.Rows)."""
+        return list(self.values())
+
+    def values(self) -> Iterator[dict]:
+        """The latest version of every record, in the order they were first inserted."""
+        if not self._offsets:
+            return
+        with open(self.path, 'rb') as f:
+            for offset, length in list(self._offsets.values()):
+                f.seek(offset)
+                yield json.loads(f.read(length))['record']
+
+    def upsert(self, records: Iterable[Any]) -> List[str]:
+        """Append records (inserting new keys, superseding existing ones). Returns their keys."""
+        keys = []
+        with self._lock:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            with open(self.path, 'ab') as f:
+                offset = f.tell()
+                for record in records:
+                    key, line = self._encode(record, self._lines)
+                    f.write(line)
+                    self._offsets[key] = (offset, len(line))
+                    offset += len(line)
+                    self._lines += 1
+                    keys.append(key)
+            self._size = offset
+        logger.debug(f"Upserted {len(keys)} records into {self.path}")
+        if self._lines > 2 * len(self._offsets):
+            self.compact()
+        return keys
+
+    def replace(self, records: Iterable[Any]) -> List[str]:
+        """Replace the whole store with these records - all at once, so a failure part way leaves the old ones."""
+        keys = []
+        offsets = {}
+
+        def lines() -> Iterator[bytes]:
+            offset = 0
+            for record in records:
+                key, line = self._encode(record, len(keys))
+                offsets[key] = (offset, len(line))
+                offset += len(line)
+                keys.append(key)
+                yield line
+
+        with self._lock:
+            self._rewrite(lines())
+            self._offsets = offsets
+            self._size = sum(length for _, length in offsets.values())
+            self._lines = len(keys)
+            self._save_index()
+        logger.debug(f"Replaced {self.path} with {len(keys)} records")
+        return keys
+
+    def clear(self):
+        with self._lock:
+            for path in (self.path, self.index_path):
+                if os.path.exists(path):
+                    os.remove(path)
+            self._offsets = {}
+            self._size = 0
+            self._lines = 0
+
+    def compact(self):
+        """Rewrite the store with only the latest version of each record."""
+        offsets = {}
+
+        def lines(fin) -> Iterator[bytes]:
+            offset = 0
+            for key, (start, length) in self._offsets.items():
+                fin.seek(start)
+                offsets[key] = (offset, length)
+                offset += length
+                yield fin.read(length)
+
+        with self._lock:
+            with open(self.path, 'rb') as fin:
+                self._rewrite(lines(fin))
+            self._offsets = offsets
+            self._size = sum(length for _, length in offsets.values())
+            self._lines = len(offsets)
+            self._save_index()
+        logger.debug(f"Compacted {self.path} to {len(offsets)} records")
+
+    # Replace the store file with new lines. The saved index describes a prefix of the store (see
+    # _load_index), which the new file could seem to extend - so it's dropped first, and only put
+    # back (for the old file) if the rewrite fails. A crash in between leaves it to be rebuilt
+    def _rewrite(self, lines: Iterable[bytes]):
+        if os.path.exists(self.index_path):
+            os.remove(self.index_path)
+        try:
+            atomic_write(self.path, lines)
+        except BaseException:
+            self._save_index()
+            raise
+
+    # Key and store line for a record - records without a key field are numbered by line
+    def _encode(self, record: Any, number: int) -> Tuple[str, bytes]:
+        key = str(record[self.key]).strip() if self.key else str(number)
+        line = json.dumps({'key': key, 'record': record}, ensure_ascii=False, default=json_default)
+        return key, line.encode('utf-8') + b'\n'
+
+    # The index is saved when the store is rewritten rather than on every upsert, so it covers a prefix
+    # of the store: use it if it does, reading only the lines appended since (the whole store otherwise)
+    def _load_index(self):
+        if not os.path.exists(self.path):
+            return
+        size = os.path.getsize(self.path)
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                index = json.load(f)
+            if index['size'] <= size and self._is_line_start(index['size']):
+                self._offsets = {key: tuple(location) for key, location in index['offsets'].items()}
+                self._size = index['size']
+                self._lines = index['lines']
+                if size > self._size:
+                    logger.debug(f"Reading {size - self._size} bytes appended to {self.path} since its index was saved")
+                    self._scan()
+                return
+        except (OSError, ValueError, KeyError):
+            pass
+        logger.debug(f"Rebuilding index for {self.path}")
+        self._offsets = {}
+        self._size = 0
+        self._lines = 0
+        self._scan()
+
+    def _is_line_start(self, offset: int) -> bool:
+        if offset == 0:
+            return True
+        with open(self.path, 'rb') as f:
+            f.seek(offset - 1)
+            return f.read(1) == b'\n'
+
+    # Index the lines from _size to the end of the store, and save the index
+    def _scan(self):
+        offset = self._size
+        with open(self.path, 'rb+') as f:
+            f.seek(offset)
+            for line in f:
+
+                # A line without a newline was cut off mid-write - drop it
+                if not line.endswith(b'\n'):
+                    f.truncate(offset)
+                    break
+                key = json.loads(line)['key']
+                self._offsets[key] = (offset, len(line))
+                offset += len(line)
+                self._lines += 1
+        self._size = offset
+        self._save_index()
+
+    def _save_index(self):
+        index = json.dumps({'size': self._size, 'lines': self._lines, 'offsets': self._offsets})
+        atomic_write(self.index_path, [index.encode('utf-8')])
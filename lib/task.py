@@ -2,9 +2,48 @@ import logging
 logger = logging.getLogger(__name__)
 logger.propagate = True
 from textwrap import dedent
-from typing import List
+from typing import Dict, List, Union, TYPE_CHECKING
+from pydantic import BaseModel, ConfigDict, create_model
 from lib.element import Element
 from lib.environment import Env
+from lib.usage import Budget
+if TYPE_CHECKING:
+    from lib.retry import RetryPolicy
+
+# Static parts of every task's instructions and prompt - built once at import
+TASK_INSTRUCTIONS_HEADER = dedent("""
+                    <instructions>
+                    When completing the task you are given, if any of the below listed XML elements apply to data you are trying to return, 
+                    tools you are trying to call, or actions you are trying to take, use them to return the applicable items - 
+                    ensuring you include the data intended for each element or sub-element. For example, if you are including 3 
+                    different examples in your response, and you have a tag <ex> that can be used to include the title of an 
+                    example, then you should return 3 <ex>EXAMPLE</ex> elements - where EXAMPLE is replaced with the details of 
+                    each example. DO NOT use any tags what-so-ever that are not listed below - including an enclosing parent tag. 
+                    For instance, from the previous example, you would  NOT enclose the <ex></ex> elements inside of an <examples> 
+                    parent tag.
+                    </instructions>
+                    <valid_xml_tags>
+                    See the below list of valid XML elements/tags that can be used in your response:
+                    """)
+TASK_INSTRUCTIONS_FOOTER = dedent("""
+        </valid_xml_tags>
+        """)
+TASK_JSON_INSTRUCTIONS_HEADER = dedent("""
+                    <instructions>
+                    When completing the task you are given, return your response as a single JSON object. Each of the keys 
+                    listed below holds a list of items of one kind - use them to return data you are trying to return, tools 
+                    you are trying to call, or actions you are trying to take, ensuring you include the data intended for each 
+                    field. Use an empty list for any kind of item that does not apply.
+                    </instructions>
+                    <valid_json_keys>
+                    See the below list of valid keys that can be used in your response:
+                    """)
+TASK_JSON_INSTRUCTIONS_FOOTER = dedent("""
+        </valid_json_keys>
+        """)
+TASK_PROMPT_PREFIX = "\n<task>\nPlease complete the following task - paying " \
+                    + "as much attention to detail as possible: \n"
+TASK_PROMPT_SUFFIX = "\n</task>"
 
 
 class Task:
@@ -12,44 +51,86 @@ class Task:
     def __init__(
             self, 
             details: str,
-            expected_elements: List[Element] = []
+            expected_elements: List[Element] = [],
+            name: str = None,
+            budget: Union[None, Budget] = None,
+            hedge_samples: int = 1,
+            hedge_delay: Union[None, float] = None,
+            retry_policy: Union[None, 'RetryPolicy'] = None,
+            structured_output: Union[None, bool] = None
     ):
         self.details = details
         self.expected_elements = expected_elements
+        self.name = name or "unnamed_task"
+
+        # Limits for each run of the task (every run is charged to a fresh copy, see Budget.fresh)
+        self.budget = budget
+
+        # Hedged mode: run up to hedge_samples generations in parallel (launched hedge_delay
+        # seconds apart, or all at once if None) and keep the first one that validates
+        self.hedge_samples = hedge_samples
+        self.hedge_delay = hedge_delay
+
+        # Overrides the retry policy of the Agent performing this task, if set
+        self.retry_policy = retry_policy
+
+        # Request the response as schema-constrained JSON rather than XML tags, where the model 
+        # supports it (None = use config.structured_output)
+        self.structured_output = structured_output
         self.result: str = None
 
+        # Built on first use - static for the lifetime of the task
+        self._expected_tags: Union[None, set] = None
+        self._valid_tags: Union[None, frozenset] = None
+        self._instructions: Dict[bool, str] = {}
+        self._output_schema: Union[None, type[BaseModel]] = None
+
+    def __str__(self):
+        return self.name
+
     def get_expected_elements(self):
-        logger.debug(f"Getting expected elements: {self.expected_elements}")
-        return set([elem.get_tag() for elem in self.expected_elements])
+        if self._expected_tags is None:
+            logger.debug(f"Getting expected elements: {self.expected_elements}")
+            self._expected_tags = set([elem.get_tag() for elem in self.expected_elements])
+        return self._expected_tags
+
+    # Every tag the expected elements can contain, at any level - None if the task has no elements,
+    # in which case any tag in the response is parsed
+    def get_valid_tags(self):
+        if self._valid_tags is None and self.expected_elements:
+            self._valid_tags = frozenset().union(*[elem.get_tags() for elem in self.expected_elements])
+        return self._valid_tags
 
+    # Static, task-type specific instructions - identical for every call of this task, so 
+    # they belong in the (cacheable) prompt prefix rather than alongside the inputs
+    def get_instructions(self, structured: bool = False):
+        if structured in self._instructions:
+            return self._instructions[structured]
+        if len(self.expected_elements) == 0:
+            self._instructions[structured] = ""
+            return ""
+        if structured:
+            inst_prompt = [TASK_JSON_INSTRUCTIONS_HEADER]
+            inst_prompt += [elem.print_json_instructions() for elem in self.expected_elements]
+            inst_prompt.append(TASK_JSON_INSTRUCTIONS_FOOTER)
+        else:
+            inst_prompt = [TASK_INSTRUCTIONS_HEADER]
+            inst_prompt += [elem.print_element_instructions() for elem in self.expected_elements]
+            inst_prompt.append(TASK_INSTRUCTIONS_FOOTER)
+        self._instructions[structured] = "".join(inst_prompt)
+        return self._instructions[structured]
+
+    # Schema for structured output - a JSON object with a list of items for each expected element
+    def get_output_schema(self) -> type[BaseModel]:
+        if self._output_schema is None:
+            fields = {elem.get_tag(): (List[elem], ...) for elem in self.expected_elements}
+            self._output_schema = create_model(f"{self.name}_output", __config__=ConfigDict(extra='forbid'), **fields)
+        return self._output_schema
+
+    # Variable part of the prompt - the task details with the inputs substituted in
     def get_prompt(self, **inputs):
         logger.debug(f"Getting prompt with inputs: {inputs}")
-        main_prompt = "\n<task>\nPlease complete the following task - paying " \
-                    + "as much attention to detail as possible: \n"
-        main_prompt += self.details.format(**inputs)
-        main_prompt += "\n</task>"
-        if len(self.expected_elements) > 0:
-            inst_prompt = dedent("""
-                        <instructions>
-                        When completing the above task, if any of the below listed XML elements apply to data you are trying to return, 
-                        tools you are trying to call, or actions you are trying to take, use them to return the applicable items - 
-                        ensuring you include the data intended for each element or sub-element. For example, if you are including 3 
-                        different examples in your response, and you have a tag <ex> that can be used to include the title of an 
-                        example, then you should return 3 <ex>EXAMPLE</ex> elements - where EXAMPLE is replaced with the details of 
-                        each example. DO NOT use any tags what-so-ever that are not listed below - including an enclosing parent tag. 
-                        For instance, from the previous example, you would  NOT enclose the <ex></ex> elements inside of an <examples> 
-                        parent tag.
-                        </instructions>
-                        <valid_xml_tags>
-                        See the below list of valid XML elements/tags that can be used in your response:
-                        """)
-            for elem in self.expected_elements:
-                inst_prompt += elem.print_element_instructions()
-            main_prompt += inst_prompt
-            main_prompt += dedent("""
-            </valid_xml_tags>"
-            """)
-        return main_prompt
+        return TASK_PROMPT_PREFIX + self.details.format(**inputs) + TASK_PROMPT_SUFFIX
     
 
 # Custom exception for TaskValidationError
@@ -0,0 +1,168 @@
+import logging
+logger = logging.getLogger(__name__)
+logger.propagate = True
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Dict, Tuple, Union
+
+
+# Token, cost and latency totals for one or more model requests
+@dataclass
+class Usage:
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cost: float = 0.0
+    latency: float = 0.0
+    requests: int = 0
+
+    @property
+    def total_tokens(self):
+        return self.prompt_tokens + self.completion_tokens
+
+    def add(self, other: 'Usage'):
+        self.prompt_tokens += other.prompt_tokens
+        self.completion_tokens += other.completion_tokens
+        self.cost += other.cost
+        self.latency += other.latency
+        self.requests += other.requests
+
+
+# Raised when an Agent/Task/Phase runs past one of its hard limits
+class BudgetExceededError(Exception):
+    """Exception raised when the token, cost or wall time budget of a Task or Phase is exceeded."""
+    def __init__(self, message="Budget exceeded."):
+        self.message = message
+        super().__init__(self.message)
+
+
+# Hard limits on tokens, dollars and wall time - charged cumulatively until reset. Wall time is
+# the time spent within the budget's usage scopes, so that e.g. an Agent's clock doesn't run
+# between its tasks
+@dataclass
+class Budget:
+    max_tokens: Union[None, int] = None
+    max_cost: Union[None, float] = None
+    max_time: Union[None, float] = None
+    used: Usage = field(default_factory=Usage)
+
+    # Wall time from scopes already left, and the start of the current stretch within one (if any)
+    time_used: float = 0.0
+    start_time: Union[None, float] = None
+    depth: int = field(default=0, repr=False)
+
+    def reset(self):
+        self.used = Usage()
+        self.time_used = 0.0
+        self.start_time = time.monotonic() if self.depth else None
+
+    def fresh(self) -> 'Budget':
+        """A budget with the same limits and nothing used, e.g. for one run of a Task."""
+        return Budget(max_tokens=self.max_tokens, max_cost=self.max_cost, max_time=self.max_time)
+
+    # Scopes can nest or overlap (concurrent tasks of one agent), so the clock runs from the first entered to the last left
+    def enter(self):
+        if not self.depth:
+            self.start_time = time.monotonic()
+        self.depth += 1
+
+    def exit(self):
+        self.depth -= 1
+        if not self.depth:
+            self.time_used += time.monotonic() - self.start_time
+            self.start_time = None
+
+    @property
+    def elapsed(self) -> float:
+        return self.time_used + (time.monotonic() - self.start_time if self.start_time is not None else 0.0)
+
+    def charge(self, usage: Usage, name: str = ""):
+        self.used.add(usage)
+        self.check(name)
+
+    def check(self, name: str = ""):
+        """Raise BudgetExceededError if any limit has been passed."""
+        if self.max_tokens is not None and self.used.total_tokens > self.max_tokens:
+            raise BudgetExceededError(f"{name}: token budget exceeded ({self.used.total_tokens} > {self.max_tokens})")
+        if self.max_cost is not None and self.used.cost > self.max_cost:
+            raise BudgetExceededError(f"{name}: cost budget exceeded (${self.used.cost:.4f} > ${self.max_cost:.4f})")
+        elapsed = self.elapsed
+        if self.max_time is not None and elapsed > self.max_time:
+            raise BudgetExceededError(f"{name}: wall time budget exceeded ({elapsed:.0f}s > {self.max_time:.0f}s)")
+
+
+# Attributes model usage to the Agent, Task and Phase that are currently running
+class UsageTracker:
+
+    # Stack of (kind, name, budget) scopes for the running context. A ContextVar keeps
+    # attribution correct when several tasks run concurrently on the event loop.
+    _scopes: contextvars.ContextVar = contextvars.ContextVar('usage_scopes', default=())
+
+    # Usage for the model request currently streaming in this context
+    _request: contextvars.ContextVar = contextvars.ContextVar('usage_request', default=None)
+
+    def __init__(self):
+        self.totals: Dict[Tuple[str, str], Usage] = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def scope(self, kind: str, name: str, budget: Union[None, Budget] = None):
+        """Attribute all usage recorded within this block to the given agent/task/phase (whose budget's clock runs meanwhile)."""
+        token = UsageTracker._scopes.set(UsageTracker._scopes.get() + ((kind, name, budget),))
+        if budget:
+            budget.enter()
+        try:
+            yield
+        finally:
+            if budget:
+                budget.exit()
+            UsageTracker._scopes.reset(token)
+
+    @contextmanager
+    def request(self):
+        """Collect the usage reported by a provider while streaming a single request."""
+        usage = Usage(requests=1)
+        token = UsageTracker._request.set(usage)
+        try:
+            yield usage
+        finally:
+            UsageTracker._request.reset(token)
+
+    def report_tokens(self, prompt_tokens: int = None, completion_tokens: int = None):
+        """Called by providers when the stream reports token counts."""
+        usage = UsageTracker._request.get()
+        if usage is None:
+            return
+        if prompt_tokens is not None:
+            usage.prompt_tokens = prompt_tokens
+        if completion_tokens is not None:
+            usage.completion_tokens = completion_tokens
+
+    def record(self, usage: Usage, model_name: str = None):
+        """Add a completed request's usage to every enclosing scope and enforce their budgets."""
+        scopes = UsageTracker._scopes.get()
+        logger.debug(f"Recording usage: {usage} for scopes: {[(kind, name) for kind, name, _ in scopes]}")
+        with self._lock:
+            keys = [('model', model_name)] if model_name else []
+            keys += [(kind, name) for kind, name, _ in scopes]
+            for key in keys:
+                self.totals.setdefault(key, Usage()).add(usage)
+        for kind, name, budget in scopes:
+            if budget:
+                budget.charge(usage, f"{kind} '{name}'")
+
+    def check_budgets(self):
+        """Enforce the budgets of the enclosing scopes (e.g. wall time) without recording usage."""
+        for kind, name, budget in UsageTracker._scopes.get():
+            if budget:
+                budget.check(f"{kind} '{name}'")
+
+    def summary(self) -> Dict[Tuple[str, str], Usage]:
+        with self._lock:
+            return dict(self.totals)
+
+
+# Single tracker shared across the process
+usage_tracker = UsageTracker()
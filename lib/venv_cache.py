@@ -0,0 +1,248 @@
+import logging
+logger = logging.getLogger(__name__)
+logger.propagate = True
+import hashlib
+import json
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import time
+from typing import Dict, Iterable, List, Tuple, Union
+from lib.files import clone_tree
+
+# Name and the rest (extras, version specifiers, markers) of a requirement line
+REQUIREMENT_PATTERN = re.compile(r'^([A-Za-z0-9][A-Za-z0-9._-]*)(.*)$')
+
+# Written into each venv created from a template, holding the template's key
+TEMPLATE_KEY_FILE = '.template_key'
+
+
+# Cache of ready-made virtual environments, keyed by interpreter version and requirement set
+class VenvCache:
+    """
+    A project venv is created by cloning a template from the cache (see lib.files.clone_tree)
+    instead of running 'python -m venv' and reinstalling its packages - pip replaces files
+    rather than editing them in place, so installs into a hardlinked clone don't leak back into
+    its template. A missing template is built from the cached template of the same interpreter
+    with the largest subset of its requirements, topping up only the packages that one lacks.
+    Templates are never modified once built; the least recently used are evicted beyond
+    max_templates.
+    """
+
+    def __init__(self, path: str = '.cache/venvs', max_templates: int = 8):
+        logger.debug(f"Initializing VenvCache with path: {path}, max_templates: {max_templates}")
+        self.path = path
+        self.max_templates = max_templates
+        self._versions: Dict[str, str] = {}
+        os.makedirs(self.path, exist_ok=True)
+
+    @staticmethod
+    def normalize_requirements(lines: Iterable[str]) -> Tuple[str, ...]:
+        """Requirement lines with comments, options and formatting differences removed, sorted."""
+        requirements = set()
+        for line in lines:
+            line = line.split('#', 1)[0].strip()
+            if not line:
+                continue
+            if line.startswith('-'):
+                logger.debug(f"Ignoring requirement option: {line}")
+                continue
+            match = REQUIREMENT_PATTERN.match(line)
+            if not match:
+                requirements.add(line)
+                continue
+            name = re.sub(r'[-_.]+', '-', match.group(1)).lower()
+            requirements.add(name + re.sub(r'\s+', '', match.group(2)))
+        return tuple(sorted(requirements))
+
+    @staticmethod
+    def read_requirements(file_path: str) -> Tuple[str, ...]:
+        """Normalized requirements from a requirements file - none if it doesn't exist."""
+        try:
+            with open(file_path, 'r', encoding='utf-8') as f:
+                return VenvCache.normalize_requirements(f)
+        except FileNotFoundError:
+            return ()
+
+    @staticmethod
+    def make_key(version: str, requirements: Tuple[str, ...]) -> str:
+        encoded = json.dumps({'version': version, 'requirements': list(requirements)}, sort_keys=True)
+        return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+    def interpreter_version(self, python: str) -> str:
+        """Full version string of an interpreter command (e.g. 'python3.11' or 'py -3.9')."""
+        version = self._versions.get(python)
+        if version is None:
+            version = subprocess.run(
+                f'{python} -c "import sys; print(sys.implementation.name, sys.version)"',
+                shell=True, capture_output=True, text=True, check=True
+            ).stdout.strip()
+            self._versions[python] = version
+        return version
+
+    def create(self, target: str, python: str, requirements: Iterable[str] = ()):
+        """Create a venv at target (which must not exist) with the requirements installed."""
+        start_time = time.monotonic()
+        template = self.template(python, self.normalize_requirements(requirements))
+        self._clone(template, target)
+
+        # Record which template the venv came from, for is_current()
+        with open(os.path.join(target, TEMPLATE_KEY_FILE), 'w', encoding='utf-8') as f:
+            f.write(os.path.basename(template))
+        logger.info(f"Created venv at {target} from template {template} in {time.monotonic() - start_time:.1f}s")
+
+    def is_current(self, venv_path: str, python: str, requirements: Iterable[str] = ()) -> bool:
+        """Whether a venv was created from the template for this interpreter and these requirements."""
+        try:
+            with open(os.path.join(venv_path, TEMPLATE_KEY_FILE), 'r', encoding='utf-8') as f:
+                key = f.read().strip()
+        except OSError:
+            return False
+        return key == self.make_key(self.interpreter_version(python), self.normalize_requirements(requirements))
+
+    def template(self, python: str, requirements: Tuple[str, ...]) -> str:
+        """Path of the template for an interpreter and (normalized) requirements, building it if need be."""
+        version = self.interpreter_version(python)
+        template = os.path.join(self.path, self.make_key(version, requirements))
+        if os.path.exists(os.path.join(template, 'template.json')):
+            logger.debug(f"Venv template cache hit: {template}")
+            os.utime(os.path.join(template, 'template.json'))
+            return template
+
+        # Top up the closest template rather than starting from scratch; the bare venv is itself a template
+        base = self._find_base(version, requirements)
+        if base is None and requirements:
+            base = self.template(python, ())
+        try:
+            template = self._build(template, python, version, requirements, base)
+        except subprocess.CalledProcessError as e:
+            if base is None:
+                raise
+            logger.warning(f"Unable to install requirements {requirements} into a venv template, using {base}: {e.output}")
+            return base
+        self.evict()
+        return template
+
+    def templates(self) -> List[Tuple[str, dict]]:
+        """(path, metadata) of every template in the cache."""
+        templates = []
+        for name in os.listdir(self.path):
+            try:
+                with open(os.path.join(self.path, name, 'template.json'), 'r', encoding='utf-8') as f:
+                    templates.append((os.path.join(self.path, name), json.load(f)))
+            except (OSError, ValueError):
+                continue
+        return templates
+
+    def evict(self):
+        """Remove least recently used templates until there are no more than max_templates."""
+        templates = self.templates()
+        templates.sort(key=lambda t: os.path.getmtime(os.path.join(t[0], 'template.json')))
+        for template, _ in templates[:max(len(templates) - self.max_templates, 0)]:
+            logger.debug(f"Evicting venv template: {template}")
+            shutil.rmtree(template, ignore_errors=True)
+
+    def _find_base(self, version: str, requirements: Tuple[str, ...]) -> Union[None, str]:
+        wanted = set(requirements)
+        best, best_size = None, -1
+        for template, meta in self.templates():
+            have = set(meta['requirements'])
+            if meta['version'] == version and have <= wanted and len(have) > best_size:
+                best, best_size = template, len(have)
+        return best
+
+    # Build a template in a temporary directory, then move it into place in one step so that
+    # concurrent builds and crashes never leave a half-built template behind
+    def _build(self, template: str, python: str, version: str, requirements: Tuple[str, ...], base: Union[None, str]) -> str:
+        build_path = tempfile.mkdtemp(dir=self.path, suffix='.build')
+        try:
+            installed: Tuple[str, ...] = ()
+            if base:
+                os.rmdir(build_path)
+                self._clone(base, build_path)
+                with open(os.path.join(base, 'template.json'), 'r', encoding='utf-8') as f:
+                    installed = tuple(json.load(f)['requirements'])
+            else:
+                logger.info(f"Creating venv template with {python}")
+                subprocess.run(f'{python} -m venv "{build_path}"', shell=True, capture_output=True, text=True, check=True)
+            missing = [requirement for requirement in requirements if requirement not in installed]
+            if missing:
+                logger.info(f"Installing {missing} into venv template")
+                subprocess.run(
+                    [self._python(build_path), '-m', 'pip', 'install', '--disable-pip-version-check'] + missing,
+                    stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, check=True
+                )
+            with open(os.path.join(build_path, 'template.json'), 'w', encoding='utf-8') as f:
+                json.dump({'version': version, 'requirements': list(requirements), 'path': os.path.abspath(build_path)}, f)
+            try:
+                os.rename(build_path, template)
+            except OSError:
+                logger.debug(f"Venv template was built concurrently: {template}")
+                shutil.rmtree(build_path, ignore_errors=True)
+            return template
+        except BaseException:
+            shutil.rmtree(build_path, ignore_errors=True)
+            raise
+
+    @staticmethod
+    def _python(venv_path: str) -> str:
+        if os.name == 'nt':
+            return os.path.join(venv_path, 'Scripts', 'python.exe')
+        return os.path.join(venv_path, 'bin', 'python')
+
+    def _clone(self, template: str, target: str):
+        source = os.path.abspath(template)
+        with open(os.path.join(source, 'template.json'), 'r', encoding='utf-8') as f:
+            built_at = json.load(f)['path']
+        clone_tree(source, target, exclude=('template.json',))
+        self._relocate(target, built_at)
+
+    # Scripts and activation files in a venv refer to it by absolute path, so point a clone's at
+    # itself - writing new files, so that the template's (hardlinked) copies are left untouched
+    @staticmethod
+    def _relocate(target: str, built_at: str):
+        old, new = os.fsencode(built_at), os.fsencode(os.path.abspath(target))
+        bin_dir = os.path.join(target, 'Scripts' if os.name == 'nt' else 'bin')
+        for name in os.listdir(bin_dir):
+            file_path = os.path.join(bin_dir, name)
+            if os.path.islink(file_path) or not os.path.isfile(file_path):
+                continue
+            with open(file_path, 'rb') as f:
+                content = f.read()
+            if old not in content:
+                continue
+            if b'\0' in content:
+                content = VenvCache._relocate_launcher(content, old, new)
+                if content is None:
+                    logger.debug(f"Not relocating binary file in venv: {file_path}")
+                    continue
+            else:
+                content = content.replace(old, new)
+            mode = os.stat(file_path).st_mode
+            os.remove(file_path)
+            with open(file_path, 'wb') as f:
+                f.write(content)
+            os.chmod(file_path, mode)
+
+    # Script entry points on Windows (e.g. Scripts/pip.exe) are a launcher executable, a shebang line
+    # naming the venv's python and a zip archive of the script. The launcher finds the shebang just
+    # before the archive, whose offsets are relative to its own start, so the line can change length.
+    # None if there is no such shebang
+    @staticmethod
+    def _relocate_launcher(content: bytes, old: bytes, new: bytes) -> Union[None, bytes]:
+        for prefix in (b'#!"', b'#!'):
+            start = content.find(prefix + old)
+            if start != -1:
+                break
+        else:
+            return None
+        end = content.find(b'\n', start) + 1
+        if not end:
+            return None
+        line = content[start:end]
+        executable = line[2:].rstrip(b'\r\n').strip(b'"').replace(old, new)
+        if b' ' in executable:
+            executable = b'"' + executable + b'"'
+        return content[:start] + b'#!' + executable + line[len(line.rstrip(b'\r\n')):] + content[end:]
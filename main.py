@@ -9,7 +9,8 @@ from rich.console import Console
 from rich.logging import RichHandler
 from dotenv import load_dotenv
 from datetime import datetime
-from lib import Agent, config
+from lib import Agent, config, usage_tracker
+from lib.models import Model, ResponseCache, NullRenderer
 from configs.phases.planning import planning_phase
 from configs.phases.development import development_phase
 from configs.phases.testing import testing_phase
@@ -23,9 +24,63 @@ console = Console()
 # Load environment variables from .env file
 load_dotenv()
 
+# Report response cache, usage and model latency stats for the run
+def report_run_stats():
+    if Model.cache:
+        stats = Model.cache.stats()
+        console.print(f"[bold green]Response cache:[/bold green] {stats['hits']} hits, {stats['misses']} misses")
+        logger.info(f"Response cache stats: {stats}")
+
+    # Token usage, cost and latency attributed to each model/agent/task/phase
+    for (kind, name), usage in usage_tracker.summary().items():
+        console.print(f"[bold green]{kind} {name}:[/bold green] {usage.requests} requests, " \
+                      + f"{usage.prompt_tokens} prompt + {usage.completion_tokens} completion tokens, " \
+                      + f"${usage.cost:.4f}, {usage.latency:.1f}s")
+    logger.info(f"Total API cost: ${Model.total_api_cost:.4f}")
+
+    # Time-to-first-token per model (e.g. per Agent, for bound ModelPool views)
+    used = [model for model in Model.instances if model.get_latency_stats()['requests']]
+    for model in used:
+        latency = model.get_latency_stats()
+        console.print(f"[bold green]{model.model_name}:[/bold green] {latency['requests']} requests, avg TTFT {latency['avg_ttft']:.2f}s")
+        logger.info(f"Latency stats for {model.model_name}: {latency}")
+
+    # Server-side prefix cache hit rate during this run, once per server the used models talk to
+    for server in prefix_cache_servers(used):
+        try:
+            prefix = server.get_prefix_cache_stats()
+        except Exception as e:
+            logger.warning(f"Unable to read prefix cache stats for {server.endpoint_id}: {e}")
+            continue
+        if not prefix or prefix['hit_rate'] is None:
+            continue
+        scope = "this run" if prefix['since_start'] else "since the server started"
+        console.print(f"[bold green]{server.endpoint_id}:[/bold green] prefix cache hit rate {prefix['hit_rate']:.1%} ({scope})")
+        logger.info(f"Prefix cache stats for {server.endpoint_id}: {prefix}")
+
+
+# Models that talk to a server directly, one per server
+def prefix_cache_servers(models) -> list:
+    servers = {}
+    for model in models:
+        for server in model.servers():
+            servers.setdefault(server.endpoint_id, server)
+    return list(servers.values())
+
+
+# Read the servers' prefix cache counters, so that the run's stats exclude earlier traffic
+def start_prefix_cache_stats():
+    for server in prefix_cache_servers(Model.instances):
+        try:
+            server.start_prefix_cache_stats()
+        except Exception as e:
+            logger.warning(f"Unable to read prefix cache stats for {server.endpoint_id}: {e}")
+
+
 # Terminate execution nicely
 def terminate_and_cleanup(signum=None, frame=None):
     print("Ctrl+C detected. Performing cleanup...")
+    report_run_stats()
     if config.handlers['cmd'].venv:
         config.handlers['cmd'].venv.kill_shell()
     sys.exit(0)
@@ -79,6 +134,14 @@ def init_project():
                       help='Output log to console in addition to log file')
     parser.add_argument('--log-level', type=str, required=False, default="INFO",
                       help='Used to set the logger level')    
+    parser.add_argument('--headless', action='store_true', default=False,
+                      help='Do not render streamed model responses to the console')
+    parser.add_argument('--no-cache', action='store_true', default=False,
+                      help='Disable the on-disk model response cache')
+    parser.add_argument('--cache-read-only', action='store_true', default=False,
+                      help='Serve cached model responses but never write new ones')
+    parser.add_argument('--no-checkpoints', action='store_true', default=False,
+                      help='Re-run every task rather than replaying tasks completed in a previous run')
     args = parser.parse_args()
 
     init_logging(args)
@@ -88,6 +151,26 @@ def init_project():
     # Update project name config
     config.set_project_name(args.name)
 
+    # Skip rendering streamed responses entirely when running unattended
+    if args.headless:
+        Model.renderer = NullRenderer
+
+    # Enable model response cache so identical prompts are not re-run after a crash
+    if not args.no_cache:
+        Model.cache = ResponseCache(
+            path=config.cache_dir,
+            max_bytes=config.cache_max_bytes,
+            max_age=config.cache_max_age_days * 24 * 60 * 60,
+            read_only=args.cache_read_only
+        )
+        logger.debug(f"Response cache enabled at: {config.cache_dir}")
+
+    # Completed tasks are replayed from their checkpoints unless disabled
+    config.checkpoints = not args.no_checkpoints
+
+    # Prefix cache hit rates are reported for this run only
+    start_prefix_cache_stats()
+
     # Update starting phase config
     config.current_phase = args.phase.lower()
 
@@ -132,6 +215,8 @@ if __name__=='__main__':
         with open("user_specs_test.txt", 'r') as f:
             user_specs = f.read()
         data['specs'] = user_specs
+        if config.state_backend == 'sqlite':
+            config.get_state().save_spec(user_specs)
 
         logger.debug(f"User specs read. See below --- \n{user_specs}")
 
@@ -168,4 +253,5 @@ if __name__=='__main__':
         logger.error(f"An unexpected error occurred: {error_msg}")
         terminate_and_cleanup()
 
+    report_run_stats()
     logger.info("Script execution finished.")
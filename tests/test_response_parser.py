@@ -0,0 +1,214 @@
+import random
+import re
+import pytest
+from lib.models.base import Response
+from lib.models.parser import StreamParser
+
+
+# The recursive regex parser that Response._extract_tagged_content used before the
+# single-pass StreamParser replaced it - kept here as the reference for parity tests
+def old_extract_tagged_content(content, top_level=True):
+    results = {}
+    result = {}
+    pattern = r'<([\w]+)>(.*?)<\/(\1)>'
+    matches = list(re.finditer(pattern, content, re.DOTALL))
+    if len(matches) > 0:
+        for match in matches:
+            tag_name = match.group(1).lower().strip()
+            tag_content = match.group(2)
+            if top_level:
+                if tag_name not in results:
+                    results[tag_name] = []
+                results[tag_name].append(old_extract_tagged_content(tag_content, top_level=False))
+            else:
+                result[tag_name] = old_extract_tagged_content(tag_content, top_level=False)
+        return results if top_level else result
+    else:
+        if top_level:
+            return None
+        else:
+            return content
+
+
+def remove_sections(text):
+    return re.sub(r'\`\`\`[a-zA-Z0-9]*', '', text)
+
+
+def feed_in_chunks(parser, text, rng, max_chunk=7):
+    i = 0
+    while i < len(text):
+        n = rng.randint(1, max_chunk)
+        parser.feed(text[i:i + n])
+        i += n
+    return parser.close()
+
+
+DOCUMENTS = [
+    "",
+    "no tags at all",
+    "<req><req_id>1</req_id><req_details>Do the thing</req_details></req>",
+    "Sure! Here you go:\n<req><req_id>1</req_id><req_details>a</req_details></req>\n"
+    "<req><req_id>2</req_id><req_details>b</req_details></req>\nLet me know!",
+    "<file><file_name>a.py</file_name><file_content>```python\nprint('<hi>')\nx = a < b\n```</file_content></file>"
+    "<cmd><command>pip install x</command></cmd> trailing text",
+    "<test><test_id>1</test_id><test_data><file_name>f</file_name><file_description>g</file_description></test_data>"
+    "<exp_result>ok</exp_result></test>",
+    "<a><b>x</a>",
+    "<a> <b>1</b>",
+    "<x><y><a>1</a></x>",
+    "<A>upper</A><a><B>q</B></a>",
+    "</z><q>1</q>",
+    "<a>1</A>",
+    "<a><b></a></b>",
+    "<a>x<b>y</a>z</b>",
+    "<a><b>1</b><b>2</b></a>",
+    "<a><b>1</b></a><c>2</c><a><b>3</b></a>",
+    "<a>< b>not a tag</ b></a>",
+    "<a>x</a><unclosed><b>1</b><c>2</c>",
+    "<a></a>",
+    "<a>\n\n  multi\nline\n</a>",
+    "<a_b1>underscore</a_b1>",
+]
+
+
+@pytest.mark.parametrize("document", DOCUMENTS)
+def test_parity_whole_response(document):
+    assert Response._extract_tagged_content(document) == old_extract_tagged_content(document)
+
+
+@pytest.mark.parametrize("document", DOCUMENTS)
+def test_parity_streamed_chunks(document):
+    rng = random.Random(document)
+    for _ in range(25):
+        assert feed_in_chunks(StreamParser(), document, rng) == old_extract_tagged_content(document)
+
+
+@pytest.mark.parametrize("document", DOCUMENTS)
+def test_parity_single_character_chunks(document):
+    parser = StreamParser()
+    for char in document:
+        parser.feed(char)
+    assert parser.close() == old_extract_tagged_content(document)
+
+
+@pytest.mark.parametrize("document", DOCUMENTS)
+def test_parity_fence_stripping(document):
+    parser = StreamParser(strip_fences=True)
+    result = feed_in_chunks(parser, document, random.Random(0))
+    assert result == old_extract_tagged_content(remove_sections(document))
+
+
+# Random well-formed element trees with noise in between. Tag names are never nested inside
+# themselves, and noise tags are never matched, since the old parser mishandles both
+def random_document(rng):
+    names = ['a', 'b', 'c', 'd', 'e']
+    noise = ['', ' ', '\n', 'text', '<', 'x < y', '< a>', '</zz>', '<u1>', '<u2>', '```py', '>', '</', '<3']
+
+    def element(lvl, used):
+        name = rng.choice([n for n in names if n not in used])
+        parts = [f"<{name}>"]
+        if lvl < 3 and len(used) < len(names) - 1 and rng.random() < 0.5:
+            for _ in range(rng.randint(1, 3)):
+                parts.append(rng.choice(noise))
+                parts.append(element(lvl + 1, used | {name}))
+        else:
+            parts.append(rng.choice(noise) + "content" + rng.choice(noise))
+        parts.append(f"</{name}>")
+        return "".join(parts)
+
+    parts = []
+    for _ in range(rng.randint(0, 4)):
+        parts.append(rng.choice(noise))
+        parts.append(element(1, frozenset()))
+    parts.append(rng.choice(noise))
+    return "".join(parts)
+
+
+def test_parity_random_documents():
+    rng = random.Random(1234)
+    for _ in range(500):
+        document = random_document(rng)
+        expected = old_extract_tagged_content(document)
+        assert Response._extract_tagged_content(document) == expected, document
+        assert feed_in_chunks(StreamParser(), document, rng) == expected, document
+
+
+def test_nested_same_name_tags():
+    # The old lazy regex closed the outer tag at the first closing tag it found
+    document = "<a><a>inner</a></a>"
+    assert old_extract_tagged_content(document) == {'a': ['<a>inner']}
+    assert Response._extract_tagged_content(document) == {'a': [{'a': 'inner'}]}
+
+
+def test_repeated_top_level_tags():
+    document = "<a>1</a><a>2</a><a>3</a>"
+    assert Response._extract_tagged_content(document) == {'a': ['1', '2', '3']}
+
+
+def test_whitelist_treats_unknown_tags_as_text():
+    content = "<html><body><div>hi</div></body></html>"
+    document = f"<file><file_name>index.html</file_name><file_content>{content}</file_content></file>"
+    tags = {'file', 'file_name', 'file_content'}
+    assert Response._extract_tagged_content(document, tags) == {
+        'file': [{'file_name': 'index.html', 'file_content': content}]
+    }
+
+    # Without a whitelist the HTML is parsed as child elements
+    assert Response._extract_tagged_content(document)['file'][0]['file_content'] == {'html': {'body': {'div': 'hi'}}}
+
+
+def test_whitelist_streamed():
+    document = "<file><file_content>if a<b> and c</b>:\n    <p>x</p></file_content></file>"
+    parser = StreamParser(tags={'file', 'file_content'})
+    result = feed_in_chunks(parser, document, random.Random(7), max_chunk=3)
+    assert result == {'file': [{'file_content': "if a<b> and c</b>:\n    <p>x</p>"}]}
+
+
+def test_large_leaf_across_many_chunks():
+    body = "".join(f"line {i} <i> & </i>\n" for i in range(20000))
+    document = f"<file><file_name>big.txt</file_name><file_content>{body}</file_content></file>"
+    parser = StreamParser(tags={'file', 'file_name', 'file_content'})
+    result = feed_in_chunks(parser, document, random.Random(3), max_chunk=64)
+    assert result['file'][0]['file_content'] == body
+
+
+def test_callbacks():
+    opened, completed = [], []
+    parser = StreamParser(on_element=lambda tag, value: completed.append((tag, value)), on_open=opened.append)
+    assert parser.feed("<a>1</a><b><c>") == [('a', '1')]
+    assert parser.feed("2</c></b>") == [('b', {'c': '2'})]
+    assert opened == ['a', 'b']
+    assert completed == [('a', '1'), ('b', {'c': '2'})]
+
+
+def test_values_are_spans_of_one_buffer():
+    document = "<file><file_name>a.py</file_name><file_content>```python\nx = 'é'\n```</file_content></file>"
+    parser = StreamParser(strip_fences=True, tags={'file', 'file_name', 'file_content'})
+    feed_in_chunks(parser, document, random.Random(5), max_chunk=4)
+    item = parser.results['file'][0]
+    span = item.span('file_content')
+    assert span.buffer is parser.buffer
+    assert span.text() == item['file_content'] == "\nx = 'é'\n"
+    assert len(span) == len("\nx = 'é'\n".encode('utf-8'))
+
+    # Assigned values replace the span
+    item['file_content'] = "y"
+    assert item.span('file_content') is None
+    assert item == {'file_name': 'a.py', 'file_content': 'y'}
+
+
+def test_span_write_to(tmp_path):
+    parser = StreamParser(strip_fences=True)
+    parser.feed("<f><c>```py\nprint('<hi>')\n```</c></f>")
+    path = tmp_path / "out.py"
+    with open(path, 'wb') as f:
+        parser.close()['f'][0].span('c').write_to(f)
+    assert path.read_text(encoding='utf-8') == "\nprint('<hi>')\n"
+
+
+def test_response_raw_text():
+    document = "Intro\n<a>```py\ncode\n```</a>"
+    resp = Response(document, strip_fences=True)
+    assert resp.raw_text == "Intro\n<a>\ncode\n</a>"
+    assert resp.props == {'a': ['\ncode\n']}
+    assert Response(document).raw_text == document